@@ -0,0 +1,242 @@
+"""Classifies a directory of MRS data files with a stored classifier.
+
+The classifier is loaded from the database once. Files are streamed from the
+directory, parsed and featurized in a pool of worker processes, and
+classified in batches. Results are written to a CSV file with one row per
+MRS data file. Only a bounded number of files are held in memory at a time,
+however many files the directory contains.
+
+Usage: python batchclassify.py -classifier_id=<id> -input_dir=<dir>
+    [-output=classifications.csv] [-batch_size=64] [-workers=4]
+    [-feature_dtype=float64] [-database=database.db]
+"""
+
+import argparse
+import csv
+import itertools
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+
+import compiledmodels
+import datastorage as ds
+import dataparser
+import ensemble
+import fourier_transformer
+import preprocessing
+
+
+# Columns of the output CSV file.
+CSV_COLUMNS = ['file', 'label', 'probability', 'featurize_ms', 'classify_ms', 'error']
+
+# scandir lists directories lazily. It is built into Python 3.5 and
+# available as a package for older versions.
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+
+def iter_mrs_files(input_dir):
+    """Yields the paths of MRS data files in a directory.
+
+    Files are yielded in directory order, without sorting, so that
+    classification starts before a large directory has been listed. The
+    directory is listed lazily if scandir is available. Hidden files and
+    subdirectories are skipped.
+
+    Args:
+        input_dir: Directory containing MRS data files.
+    """
+    if scandir is not None:
+        for entry in scandir(input_dir):
+            if not entry.name.startswith('.') and entry.is_file():
+                yield entry.path
+        return
+    for file_name in os.listdir(input_dir):
+        path = os.path.join(input_dir, file_name)
+        if not file_name.startswith('.') and os.path.isfile(path):
+            yield path
+
+
+def featurize_file(task):
+    """Parses and featurizes a MRS data file.
+
+    This runs in worker processes, so it takes and returns only picklable
+    values.
+
+    Args:
+        task: Tuple containing (path of the MRS data file, preprocessing
+            pipeline config or None to apply FFT, feature dtype name).
+
+    Returns:
+        Tuple containing (path, features or None, error message or None,
+        featurization time in seconds).
+    """
+    path, pipeline_config, dtype_name = task
+    t_start = time.time()
+    try:
+        with open(path, 'r') as mrs_file:
+            file_contents = mrs_file.read()
+        dtype = dataparser.FEATURE_DTYPES[dtype_name]
+        xy_data = dataparser.get_xy_array(file_contents, dtype=dtype)
+        if pipeline_config is not None:
+            pipeline = preprocessing.Pipeline.from_config(pipeline_config)
+            features = pipeline(xy_data[np.newaxis, :])[0]
+        else:
+            features = fourier_transformer.get_fft(xy_data, dtype=dtype)
+    except Exception as error:  # pylint:disable=broad-except
+        return (path, None, str(error), time.time() - t_start)
+    return (path, features, None, time.time() - t_start)
+
+
+def load_classifier(conn, classifier_id):
+    """Fetches a stored classifier, preferring its NumPy-only export.
+
+    Args:
+        conn: A database Connection object.
+        classifier_id: ID of the classifier.
+
+    Returns:
+        The classifier.
+
+    Raises:
+        ValueError if there is no classifier with the given ID.
+    """
+    classifier = ds.fetch_compiled_classifier(conn, classifier_id)
+    if classifier is None:
+        db_entry = ds.fetch_classifier(conn, classifier_id)
+        if db_entry is None:
+            raise ValueError('No classifier with ID %s' % classifier_id)
+        classifier = db_entry[3]
+    return classifier
+
+
+def classify_batch(classifier, features):
+    """Classifies a batch of featurized MRS data.
+
+    Args:
+        classifier: A trained classifier.
+        features: 2-D array of classifier inputs.
+
+    Returns:
+        Tuple containing (array of labels, array of the probabilities of the
+        labels or None if the classifier cannot estimate probabilities).
+    """
+    labels = np.asarray(classifier.predict(features)).ravel()
+    classes = ensemble.get_classes(classifier)
+    if classes is None:
+        return (labels, None)
+    try:
+        probabilities = np.asarray(classifier.predict_proba(features))
+    except AttributeError:
+        return (labels, None)
+    # Look up the column of each predicted label.
+    columns = [list(classes).index(label) for label in labels]
+    return (labels, probabilities[np.arange(len(labels)), columns])
+
+
+def classify_directory(classifier, input_dir, output_file, batch_size=64, n_workers=4,
+                       dtype_name='float64'):
+    """Classifies all MRS data files in a directory.
+
+    While one batch is classified, the worker processes featurize the next,
+    so at most two batches of files are held in memory.
+
+    Args:
+        classifier: A trained classifier. Preprocessing pipelines of
+            compiledmodels.PreprocessedClassifier are run in the workers.
+        input_dir: Directory containing MRS data files.
+        output_file: File object to write CSV rows to.
+        batch_size: Number of files classified together.
+        n_workers: Number of worker processes.
+        dtype_name: Name of the feature dtype, 'float32' or 'float64'.
+
+    Returns:
+        Tuple containing (number of files classified, number of failures).
+    """
+    pipeline_config = None
+    if isinstance(classifier, compiledmodels.PreprocessedClassifier):
+        pipeline_config = classifier.pipeline.get_config()
+        classifier = classifier.classifier
+
+    writer = csv.writer(output_file)
+    writer.writerow(CSV_COLUMNS)
+    tasks = ((path, pipeline_config, dtype_name) for path in iter_mrs_files(input_dir))
+    n_classified = 0
+    n_failed = 0
+    pool = multiprocessing.Pool(n_workers)
+    try:
+        pending = pool.map_async(featurize_file, list(itertools.islice(tasks, batch_size)))
+        while True:
+            results = pending.get()
+            if not results:
+                break
+            # Featurize the next batch while this one is classified.
+            pending = pool.map_async(featurize_file, list(itertools.islice(tasks, batch_size)))
+
+            featurized = [result for result in results if result[1] is not None]
+            labels, probabilities, classify_time = [], None, 0.0
+            if featurized:
+                t_start = time.time()
+                labels, probabilities = classify_batch(
+                    classifier, np.array([result[1] for result in featurized]))
+                classify_time = (time.time() - t_start) / len(featurized)
+
+            # Write results in the order the files were listed.
+            labelled = dict(zip([result[0] for result in featurized], range(len(labels))))
+            for path, _, error, featurize_time in results:
+                if error is not None:
+                    n_failed += 1
+                    writer.writerow([path, '', '', '%.3f' % (featurize_time * 1000.0), '', error])
+                    continue
+                index = labelled[path]
+                probability = '' if probabilities is None else '%.6f' % probabilities[index]
+                writer.writerow([path, labels[index], probability,
+                                 '%.3f' % (featurize_time * 1000.0),
+                                 '%.3f' % (classify_time * 1000.0), ''])
+                n_classified += 1
+            output_file.flush()
+    finally:
+        pool.terminate()
+        pool.join()
+    return (n_classified, n_failed)
+
+
+def main(argv):
+    """Classifies a directory of MRS data files."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-classifier_id', action="store", type=str, required=True)
+    parser.add_argument('-input_dir', action="store", type=str, required=True)
+    parser.add_argument('-output', action="store", type=str, default='classifications.csv')
+    parser.add_argument('-batch_size', action="store", type=int, default=64)
+    parser.add_argument('-workers', action="store", type=int,
+                        default=multiprocessing.cpu_count())
+    parser.add_argument('-feature_dtype', action="store", type=str, default='float64',
+                        choices=sorted(dataparser.FEATURE_DTYPES))
+    parser.add_argument('-database', action="store", type=str,
+                        default=ds.SQLITE_DATABASE_FILE)
+    args = parser.parse_args(argv)
+
+    conn = ds.create_sqlite_connection(args.database)
+    classifier = load_classifier(conn, args.classifier_id)
+    conn.close()
+
+    t_start = time.time()
+    with open(args.output, 'wb') as output_file:
+        n_classified, n_failed = classify_directory(
+            classifier, args.input_dir, output_file, batch_size=args.batch_size,
+            n_workers=args.workers, dtype_name=args.feature_dtype)
+    elapsed = time.time() - t_start
+    print 'Classified %d files (%d failed) in %.1f s. Results written to %s.' % (
+        n_classified, n_failed, elapsed, args.output)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
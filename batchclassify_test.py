@@ -0,0 +1,96 @@
+"""Unit tests for the batch classification module."""
+
+import batchclassify
+import compiledmodels
+import csv
+import io
+import os
+import preprocessing
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+
+class ThresholdClassifier(object):
+    """Classifies samples by the sign of their first feature."""
+
+    classes = np.array(['groupA', 'groupB'])
+
+    def predict_proba(self, samples):
+        p_group_b = 1.0 / (1.0 + np.exp(-np.asarray(samples)[:, 0]))
+        return np.column_stack([1 - p_group_b, p_group_b])
+
+    def predict(self, samples):
+        return self.classes[np.argmax(self.predict_proba(samples), axis=1)]
+
+
+class TestBatchClassify(unittest.TestCase):
+    """Tests the batch classification module."""
+
+    def setUp(self):
+        """Create a directory of MRS data files and one invalid file."""
+        self.input_dir = tempfile.mkdtemp()
+        for i in range(5):
+            shutil.copy('data/05_E2', os.path.join(self.input_dir, 'scan%d' % i))
+        with open(os.path.join(self.input_dir, 'invalid'), 'w') as invalid_file:
+            invalid_file.write('not MRS data\n')
+        os.mkdir(os.path.join(self.input_dir, 'subdir'))
+
+    def tearDown(self):
+        """Delete the directory of MRS data files."""
+        shutil.rmtree(self.input_dir)
+
+    def classify(self, classifier):
+        """Classifies the test directory and returns the CSV rows."""
+        output_file = io.BytesIO()
+        counts = batchclassify.classify_directory(
+            classifier, self.input_dir, output_file, batch_size=2, n_workers=2)
+        output_file.seek(0)
+        return (counts, list(csv.DictReader(output_file)))
+
+    def test_iter_mrs_files(self):
+        """Only files are listed, in directory order."""
+        self.assertEqual(
+            ['invalid', 'scan0', 'scan1', 'scan2', 'scan3', 'scan4'],
+            sorted(os.path.basename(path)
+                   for path in batchclassify.iter_mrs_files(self.input_dir)))
+
+    def test_featurize_file(self):
+        """Files are featurized like the server does, reporting errors."""
+        path, features, error, _ = batchclassify.featurize_file(
+            (os.path.join(self.input_dir, 'scan0'), None, 'float32'))
+        self.assertIsNone(error)
+        self.assertEqual(np.float32, features.dtype)
+        self.assertEqual(os.path.join(self.input_dir, 'scan0'), path)
+
+        _, features, error, _ = batchclassify.featurize_file(
+            (os.path.join(self.input_dir, 'invalid'), None, 'float64'))
+        self.assertIsNone(features)
+        self.assertIsNotNone(error)
+
+    def test_classify_directory(self):
+        """Every file gets a row, with probabilities if available."""
+        (n_classified, n_failed), rows = self.classify(ThresholdClassifier())
+        self.assertEqual((5, 1), (n_classified, n_failed))
+        self.assertEqual(6, len(rows))
+        rows = sorted(rows, key=lambda row: row['file'])
+        self.assertTrue(rows[0]['error'])
+        for row in rows[1:]:
+            self.assertEqual('groupB', row['label'])
+            self.assertTrue(0.5 < float(row['probability']) <= 1)
+            self.assertFalse(row['error'])
+
+    def test_classify_directory_preprocessed(self):
+        """Preprocessing pipelines are applied to the files."""
+        pipeline = preprocessing.Pipeline([
+            preprocessing.Spectrum(), preprocessing.Normalization()])
+        classifier = compiledmodels.PreprocessedClassifier(pipeline, ThresholdClassifier())
+        (n_classified, _), rows = self.classify(classifier)
+        self.assertEqual(5, n_classified)
+        self.assertEqual(['groupB'] * 5, [row['label'] for row in rows if not row['error']])
+
+
+if __name__ == '__main__':
+    unittest.main()
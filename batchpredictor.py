@@ -0,0 +1,108 @@
+"""Micro-batching of concurrent classification requests."""
+
+import threading
+
+import numpy as np
+
+
+class _PendingBatch(object):
+    """Samples waiting to be classified together by one classifier."""
+
+    def __init__(self):
+        self.samples = []
+        self.predictions = None
+        self.error = None
+        # Set when the batch stops accepting samples.
+        self.closed = threading.Event()
+        # Set when predictions (or an error) are available.
+        self.done = threading.Event()
+
+
+class BatchPredictor(object):
+    """Groups concurrent predict calls into batched classifier calls.
+
+    Samples are queued per classifier ID. The first request to arrive for a
+    classifier waits until either max_batch_size samples are queued or
+    max_latency seconds have passed, then runs a single predict call for the
+    whole batch and hands each waiting request its own result.
+    """
+
+    def __init__(self, max_batch_size=32, max_latency=0.005, enabled=True):
+        """Creates a new batch predictor.
+
+        Args:
+            max_batch_size: Maximum number of samples in one predict call.
+            max_latency: Maximum time in seconds to wait for a batch to fill.
+            enabled: If False, every sample is classified on its own.
+        """
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._open_batches = {}
+
+    def predict(self, classifier_id, classifier, sample):
+        """Classifies a single sample.
+
+        Args:
+            classifier_id: Unique identifier for the classifier.
+            classifier: Classifier with a predict method.
+            sample: Feature vector to classify.
+
+        Returns:
+            The classifier's prediction for the sample, in the same form as
+            classifier.predict returns for a single-row input.
+        """
+        if not self.enabled or self.max_batch_size <= 1:
+            return classifier.predict(np.array([sample]))
+
+        # Add the sample to the open batch for this classifier.
+        with self._lock:
+            batch = self._open_batches.get(classifier_id)
+            is_leader = batch is None
+            if is_leader:
+                batch = _PendingBatch()
+                self._open_batches[classifier_id] = batch
+            index = len(batch.samples)
+            batch.samples.append(sample)
+            if len(batch.samples) >= self.max_batch_size:
+                self._close(classifier_id, batch)
+
+        if is_leader:
+            # Wait for the batch to fill up or for the deadline to pass.
+            batch.closed.wait(self.max_latency)
+            with self._lock:
+                self._close(classifier_id, batch)
+            self._run(classifier, batch)
+        else:
+            batch.done.wait()
+
+        if batch.error is not None:
+            raise batch.error
+        return batch.predictions[index:index + 1]
+
+    def _close(self, classifier_id, batch):
+        """Stops the given batch from accepting samples. Requires the lock.
+
+        Args:
+            classifier_id: Unique identifier for the batch's classifier.
+            batch: The batch to close.
+        """
+        if self._open_batches.get(classifier_id) is batch:
+            del self._open_batches[classifier_id]
+        batch.closed.set()
+
+    @staticmethod
+    def _run(classifier, batch):
+        """Classifies all samples in the given batch.
+
+        Args:
+            classifier: Classifier with a predict method.
+            batch: A closed batch.
+        """
+        try:
+            batch.predictions = classifier.predict(np.array(batch.samples))
+        except Exception as error:  # pylint:disable=broad-except
+            batch.error = error
+        finally:
+            batch.done.set()
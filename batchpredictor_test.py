@@ -0,0 +1,92 @@
+"""Unit tests for the batch predictor module."""
+
+import batchpredictor
+import threading
+import unittest
+
+import numpy as np
+
+
+class FakeClassifier(object):
+    """Classifier that records the size of each predict call."""
+
+    def __init__(self):
+        self.batch_sizes = []
+
+    def predict(self, samples):
+        """Classifies each sample as the sum of its features."""
+        self.batch_sizes.append(len(samples))
+        return np.sum(samples, axis=1)
+
+
+class FailingClassifier(object):
+    """Classifier that always fails."""
+
+    def predict(self, samples):
+        """Raises an exception."""
+        raise ValueError('bad input')
+
+
+class TestBatchPredictor(unittest.TestCase):
+    """Tests the batch predictor module."""
+
+    def predict_concurrently(self, predictor, classifier, samples):
+        """Classifies each sample from its own thread.
+
+        Returns:
+            List of predictions, ordered like the samples.
+        """
+        results = [None] * len(samples)
+
+        def classify(index):
+            """Stores the prediction for one sample."""
+            results[index] = predictor.predict('id', classifier, samples[index])
+
+        threads = [threading.Thread(target=classify, args=(index,))
+                   for index in range(len(samples))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_predict_disabled(self):
+        """Each sample is classified on its own when batching is disabled."""
+        predictor = batchpredictor.BatchPredictor(enabled=False)
+        classifier = FakeClassifier()
+        prediction = predictor.predict('id', classifier, [1.0, 2.0])
+        # Result has the same form as a direct single-row predict call.
+        np.testing.assert_array_equal(np.array([3.0]), prediction)
+        self.assertEqual([1], classifier.batch_sizes)
+
+    def test_predict_batches_concurrent_samples(self):
+        """Concurrent samples are classified in one predict call."""
+        predictor = batchpredictor.BatchPredictor(
+            max_batch_size=4, max_latency=5.0)
+        classifier = FakeClassifier()
+        samples = [[float(i), 1.0] for i in range(4)]
+        results = self.predict_concurrently(predictor, classifier, samples)
+        # The batch was flushed as soon as it was full.
+        self.assertEqual([4], classifier.batch_sizes)
+        # Each request received its own prediction.
+        for sample, result in zip(samples, results):
+            np.testing.assert_array_equal(np.array([sum(sample)]), result)
+
+    def test_predict_flushes_after_latency(self):
+        """A partial batch is classified once the deadline passes."""
+        predictor = batchpredictor.BatchPredictor(
+            max_batch_size=32, max_latency=0.001)
+        classifier = FakeClassifier()
+        prediction = predictor.predict('id', classifier, [1.0, 2.0])
+        np.testing.assert_array_equal(np.array([3.0]), prediction)
+        self.assertEqual([1], classifier.batch_sizes)
+
+    def test_predict_raises_classifier_error(self):
+        """Errors from the classifier reach every request in the batch."""
+        predictor = batchpredictor.BatchPredictor(max_latency=0.001)
+        with self.assertRaises(ValueError):
+            predictor.predict('id', FailingClassifier(), [1.0])
+
+
+if __name__ == '__main__':
+    unittest.main()
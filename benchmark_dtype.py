@@ -0,0 +1,97 @@
+"""Compares float32 and float64 MRS features for SVM training.
+
+Builds a synthetic two-group data set from an MRS data file, then reports
+featurization time, training time and held-out accuracy of train_svm for each
+feature precision.
+
+Usage: python benchmark_dtype.py [-data=data/05_E2] [-n_samples=400]
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+import dataparser
+import fourier_transformer
+import trainclassifier as trainer
+
+
+def make_data_set(xy_data, n_samples, random):
+    """Creates noisy copies of the given MRS data in two groups.
+
+    Args:
+        xy_data: Complex time-domain MRS data points.
+        n_samples: Number of samples to create.
+        random: A numpy RandomState.
+
+    Returns:
+        Tuple containing (array of time-domain samples, array of labels).
+    """
+    n_points = len(xy_data)
+    # Scale the data to unit mean amplitude so RBF kernels are informative.
+    xy_data = xy_data / np.abs(xy_data).mean()
+    time_axis = np.arange(n_points)
+    # Group B has an extra decaying resonance.
+    extra_peak = np.exp((2j * np.pi * 0.05 - 0.01) * time_axis)
+    labels = np.array(['groupA', 'groupB'] * (n_samples / 2))
+    noise = 0.5 * (random.randn(n_samples, n_points)
+                   + 1j * random.randn(n_samples, n_points))
+    samples = xy_data[np.newaxis, :] + noise
+    samples[labels == 'groupB'] += extra_peak
+    return (samples, labels)
+
+
+def featurize(samples, dtype):
+    """Applies FFT to each sample in the given precision.
+
+    Returns:
+        Tuple containing (feature matrix, featurization time in seconds).
+    """
+    t_start = time.time()
+    features = np.array([
+        fourier_transformer.get_fft(sample.astype(np.result_type(dtype, np.complex64)),
+                                    dtype=dtype)
+        for sample in samples])
+    return (features, time.time() - t_start)
+
+
+def evaluate(train_method, inputs, outputs):
+    """Trains on the first half of the samples and tests on the second.
+
+    Returns:
+        Tuple containing (training time in seconds, test accuracy).
+    """
+    n_train = len(inputs) / 2
+    t_start = time.time()
+    clf = train_method((inputs[:n_train], outputs[:n_train]))
+    training_time = time.time() - t_start
+    accuracy = np.mean(
+        np.ravel(clf.predict(inputs[n_train:])) == outputs[n_train:])
+    return (training_time, accuracy)
+
+
+def main(argv):
+    """Runs the benchmark."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-data', action="store", type=str, default='data/05_E2')
+    parser.add_argument('-n_samples', action="store", type=int, default=400)
+    args = parser.parse_args(argv)
+
+    xy_data = dataparser.get_xy_array(open(args.data, 'r').read())
+    samples, labels = make_data_set(xy_data, args.n_samples, np.random.RandomState(0))
+    train_methods = [('train_svm', trainer.train_svm)]
+
+    print '%-22s %-8s %10s %10s %9s' % (
+        'method', 'dtype', 'fft (s)', 'train (s)', 'accuracy')
+    for dtype in (np.float64, np.float32):
+        features, featurize_time = featurize(samples, dtype)
+        for name, train_method in train_methods:
+            training_time, accuracy = evaluate(train_method, features, labels)
+            print '%-22s %-8s %10.3f %10.3f %9.3f' % (
+                name, np.dtype(dtype).name, featurize_time, training_time, accuracy)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,409 @@
+"""NumPy-only classifiers exported from trained models for fast inference.
+
+This module must only depend on NumPy so that classification workers can load
+and run exported models without importing the training frameworks.
+"""
+
+import io
+import json
+
+import numpy as np
+
+import preprocessing
+
+
+class CompiledSVM(object):
+    """Multi-class RBF SVM using libsvm's one-vs-one decision rule."""
+
+    model_type = 'SVM'
+
+    def __init__(self, support_vectors, dual_coef, intercept, n_support,
+                 gamma, classes):
+        """Creates a compiled SVM.
+
+        Args:
+            support_vectors: Array of shape (n_SV, n_features). Stored as
+                float64.
+            dual_coef: Array of shape (n_classes - 1, n_SV), as used by libsvm.
+            intercept: Array of shape (n_classes * (n_classes - 1) / 2,),
+                equal to minus libsvm's rho.
+            n_support: Number of support vectors for each class.
+            gamma: RBF kernel coefficient.
+            classes: Class labels.
+        """
+        # Kernel values are computed in float64 even for float32 features:
+        # with the large magnitudes of MRS features, float32 distances lose
+        # too much precision to cancellation.
+        self.support_vectors = np.asarray(support_vectors, dtype=np.float64)
+        self.dual_coef = np.asarray(dual_coef)
+        self.intercept = np.asarray(intercept)
+        self.n_support = np.asarray(n_support)
+        self.gamma = float(gamma)
+        self.classes = np.asarray(classes)
+        # Squared norms of the support vectors, reused for every prediction.
+        self._sv_norms = np.einsum(
+            'ij,ij->i', self.support_vectors, self.support_vectors)
+
+    def kernel(self, samples):
+        """Computes RBF kernel values between samples and support vectors.
+
+        Args:
+            samples: Array of shape (n_samples, n_features).
+
+        Returns:
+            Array of shape (n_samples, n_SV).
+        """
+        samples = np.asarray(samples, dtype=np.float64)
+        sq_dists = (np.einsum('ij,ij->i', samples, samples)[:, np.newaxis]
+                    - 2.0 * samples.dot(self.support_vectors.T)
+                    + self._sv_norms[np.newaxis, :])
+        np.maximum(sq_dists, 0, out=sq_dists)
+        return np.exp(-self.gamma * sq_dists)
+
+    def predict(self, samples):
+        """Classifies the given samples.
+
+        Args:
+            samples: Array of shape (n_samples, n_features).
+
+        Returns:
+            Array of predicted class labels.
+        """
+        kernel = self.kernel(samples)
+        n_classes = len(self.classes)
+        starts = np.concatenate(([0], np.cumsum(self.n_support)))
+        votes = np.zeros((kernel.shape[0], n_classes), dtype=int)
+        # Vote over every pair of classes, as libsvm does.
+        pair = 0
+        for i in range(n_classes):
+            for j in range(i + 1, n_classes):
+                sv_i = slice(starts[i], starts[i + 1])
+                sv_j = slice(starts[j], starts[j + 1])
+                decision = (kernel[:, sv_i].dot(self.dual_coef[j - 1, sv_i])
+                            + kernel[:, sv_j].dot(self.dual_coef[i, sv_j])
+                            + self.intercept[pair])
+                votes[:, i] += decision > 0
+                votes[:, j] += decision <= 0
+                pair += 1
+        return self.classes[np.argmax(votes, axis=1)]
+
+    def score(self, samples, outputs):
+        """Computes the classification accuracy on the given samples.
+
+        Args:
+            samples: Array of shape (n_samples, n_features).
+            outputs: Array of expected class labels.
+
+        Returns:
+            Fraction of correctly classified samples.
+        """
+        return np.mean(self.predict(samples) == np.ravel(outputs))
+
+    def get_arrays(self):
+        """Returns the arrays needed to reconstruct this model."""
+        return {
+            'support_vectors': self.support_vectors,
+            'dual_coef': self.dual_coef,
+            'intercept': self.intercept,
+            'n_support': self.n_support,
+            'gamma': np.array(self.gamma),
+            'classes': self.classes}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Reconstructs a model from the output of get_arrays."""
+        return cls(arrays['support_vectors'], arrays['dual_coef'],
+                   arrays['intercept'], arrays['n_support'],
+                   arrays['gamma'], arrays['classes'])
+
+
+class CompiledNeuralNetwork(object):
+    """Feed-forward network of Maxout hidden layers and a Softmax output."""
+
+    model_type = 'NeuralNetwork'
+
+    def __init__(self, weights, biases, pieces, classes):
+        """Creates a compiled neural network.
+
+        Args:
+            weights: List of weight matrices, one per layer. Maxout layers have
+                units * pieces output columns.
+            biases: List of bias vectors, one per layer.
+            pieces: List with the number of Maxout pieces of each hidden layer.
+            classes: Class labels, ordered like the Softmax outputs.
+        """
+        self.weights = [np.asarray(w) for w in weights]
+        self.biases = [np.asarray(b) for b in biases]
+        self.pieces = [int(p) for p in pieces]
+        self.classes = np.asarray(classes)
+
+    def predict_proba(self, samples):
+        """Computes class probabilities for the given samples.
+
+        Args:
+            samples: Array of shape (n_samples, n_features).
+
+        Returns:
+            Array of shape (n_samples, n_classes).
+        """
+        activations = np.asarray(samples, dtype=self.weights[0].dtype)
+        # Hidden Maxout layers: max over consecutive groups of pieces.
+        for weights, biases, pieces in zip(
+                self.weights[:-1], self.biases[:-1], self.pieces):
+            activations = activations.dot(weights) + biases
+            activations = activations.reshape(
+                activations.shape[0], -1, pieces).max(axis=2)
+        # Softmax output layer.
+        logits = activations.dot(self.weights[-1]) + self.biases[-1]
+        logits -= logits.max(axis=1)[:, np.newaxis]
+        probabilities = np.exp(logits)
+        probabilities /= probabilities.sum(axis=1)[:, np.newaxis]
+        return probabilities
+
+    def predict(self, samples):
+        """Classifies the given samples.
+
+        Args:
+            samples: Array of shape (n_samples, n_features).
+
+        Returns:
+            Array of predicted class labels.
+        """
+        return self.classes[np.argmax(self.predict_proba(samples), axis=1)]
+
+    def get_arrays(self):
+        """Returns the arrays needed to reconstruct this model."""
+        arrays = {'pieces': np.array(self.pieces), 'classes': self.classes}
+        for layer, (weights, biases) in enumerate(zip(self.weights, self.biases)):
+            arrays['weights_%d' % layer] = weights
+            arrays['biases_%d' % layer] = biases
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Reconstructs a model from the output of get_arrays."""
+        n_layers = len(arrays['pieces']) + 1
+        weights = [arrays['weights_%d' % layer] for layer in range(n_layers)]
+        biases = [arrays['biases_%d' % layer] for layer in range(n_layers)]
+        return cls(weights, biases, arrays['pieces'], arrays['classes'])
+
+
+class LinearProjection(object):
+    """Linear dimensionality reduction, such as a fitted PCA."""
+
+    model_type = 'LinearProjection'
+
+    def __init__(self, mean, components):
+        """Creates a linear projection.
+
+        Args:
+            mean: Array of shape (n_features,) subtracted before projecting.
+            components: Array of shape (n_components, n_features).
+        """
+        self.mean = np.asarray(mean)
+        self.components = np.asarray(components)
+
+    def transform(self, samples):
+        """Projects the given samples.
+
+        Args:
+            samples: Array of shape (n_samples, n_features).
+
+        Returns:
+            Array of shape (n_samples, n_components).
+        """
+        samples = np.asarray(samples, dtype=self.components.dtype)
+        return (samples - self.mean).dot(self.components.T)
+
+    def get_arrays(self):
+        """Returns the arrays needed to reconstruct this model."""
+        return {'mean': self.mean, 'components': self.components}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Reconstructs a model from the output of get_arrays."""
+        return cls(arrays['mean'], arrays['components'])
+
+
+class ReducedClassifier(object):
+    """Classifier that projects its inputs before classifying them.
+
+    The wrapped classifier may be any classifier with a predict method, so the
+    projection is stored and applied together with the classifier it was used
+    to train.
+    """
+
+    model_type = 'ReducedClassifier'
+
+    def __init__(self, projection, classifier):
+        """Creates a reduced classifier.
+
+        Args:
+            projection: A LinearProjection.
+            classifier: Classifier trained on projected samples.
+        """
+        self.projection = projection
+        self.classifier = classifier
+
+    def predict(self, samples):
+        """Classifies the given samples.
+
+        Args:
+            samples: Array of shape (n_samples, n_features).
+
+        Returns:
+            Array of predicted class labels.
+        """
+        return self.classifier.predict(self.projection.transform(samples))
+
+    def predict_proba(self, samples):
+        """Computes class probabilities for the given samples.
+
+        Args:
+            samples: Array of shape (n_samples, n_features).
+
+        Returns:
+            Array of shape (n_samples, n_classes).
+        """
+        return self.classifier.predict_proba(self.projection.transform(samples))
+
+    def score(self, samples, outputs):
+        """Computes the classification accuracy on the given samples.
+
+        Args:
+            samples: Array of shape (n_samples, n_features).
+            outputs: Array of expected class labels.
+
+        Returns:
+            Fraction of correctly classified samples.
+        """
+        predictions = np.ravel(self.predict(samples))
+        return np.mean(predictions == np.ravel(outputs))
+
+    def get_arrays(self):
+        """Returns the arrays needed to reconstruct this model."""
+        arrays = _get_classifier_arrays(self.classifier)
+        for name, array in self.projection.get_arrays().items():
+            arrays['projection_' + name] = array
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Reconstructs a model from the output of get_arrays."""
+        projection_arrays = {}
+        for name in arrays.keys():
+            if name.startswith('projection_'):
+                projection_arrays[name[len('projection_'):]] = arrays[name]
+        return cls(LinearProjection.from_arrays(projection_arrays),
+                   _classifier_from_arrays(arrays))
+
+
+class PreprocessedClassifier(object):
+    """Classifier that preprocesses raw time-domain MRS data.
+
+    Inputs are arrays of shape (n_scans, n_points) of complex time-domain
+    data, which are run through a preprocessing.Pipeline before being passed
+    to the wrapped classifier.
+    """
+
+    model_type = 'PreprocessedClassifier'
+
+    def __init__(self, pipeline, classifier):
+        """Creates a preprocessed classifier.
+
+        Args:
+            pipeline: A preprocessing.Pipeline.
+            classifier: Classifier trained on preprocessed data.
+        """
+        self.pipeline = pipeline
+        self.classifier = classifier
+
+    def predict(self, samples):
+        """Classifies the given time-domain samples.
+
+        Args:
+            samples: Array of shape (n_scans, n_points).
+
+        Returns:
+            Array of predicted class labels.
+        """
+        return self.classifier.predict(self.pipeline(np.asarray(samples)))
+
+    def predict_proba(self, samples):
+        """Computes class probabilities for the given time-domain samples.
+
+        Args:
+            samples: Array of shape (n_scans, n_points).
+
+        Returns:
+            Array of shape (n_samples, n_classes).
+        """
+        return self.classifier.predict_proba(self.pipeline(np.asarray(samples)))
+
+    def get_arrays(self):
+        """Returns the arrays needed to reconstruct this model."""
+        arrays = _get_classifier_arrays(self.classifier)
+        arrays['pipeline_config'] = np.array(json.dumps(self.pipeline.get_config()))
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Reconstructs a model from the output of get_arrays."""
+        pipeline = preprocessing.Pipeline.from_config(
+            json.loads(str(arrays['pipeline_config'])))
+        return cls(pipeline, _classifier_from_arrays(arrays))
+
+
+def _get_classifier_arrays(classifier):
+    """Returns the arrays of a wrapped classifier, with prefixed names."""
+    arrays = {'classifier_type': np.array(classifier.model_type)}
+    for name, array in classifier.get_arrays().items():
+        arrays['classifier_' + name] = array
+    return arrays
+
+
+def _classifier_from_arrays(arrays):
+    """Reconstructs a wrapped classifier from arrays with prefixed names."""
+    classifier_arrays = {}
+    for name in arrays.keys():
+        if name.startswith('classifier_') and name != 'classifier_type':
+            classifier_arrays[name[len('classifier_'):]] = arrays[name]
+    classifier_class = MODEL_TYPES[str(arrays['classifier_type'])]
+    return classifier_class.from_arrays(classifier_arrays)
+
+
+# Compiled model classes keyed by model type.
+MODEL_TYPES = dict(
+    (model_class.model_type, model_class)
+    for model_class in (CompiledSVM, CompiledNeuralNetwork, LinearProjection,
+                        ReducedClassifier, PreprocessedClassifier))
+
+
+def dumps(model):
+    """Serializes a compiled model without pickling any Python objects.
+
+    Args:
+        model: A compiled model.
+
+    Returns:
+        String containing the model in NumPy .npz format.
+    """
+    arrays = model.get_arrays()
+    arrays['model_type'] = np.array(model.model_type)
+    output = io.BytesIO()
+    np.savez(output, **arrays)
+    return output.getvalue()
+
+
+def loads(serialized_model):
+    """Deserializes a compiled model.
+
+    Args:
+        serialized_model: String produced by dumps.
+
+    Returns:
+        The compiled model.
+    """
+    arrays = np.load(io.BytesIO(serialized_model), allow_pickle=False)
+    model_class = MODEL_TYPES[str(arrays['model_type'])]
+    return model_class.from_arrays(arrays)
@@ -0,0 +1,125 @@
+"""Unit tests for the compiled models module."""
+
+import sys
+import types
+import unittest
+
+import numpy as np
+from sklearn import svm
+
+# Compiled SVMs are built with trainclassifier.export_svm, which imports sknn.
+# Stub it if it is not installed.
+try:
+    import sknn.mlp  # pylint:disable=unused-import
+except ImportError:
+    SKNN_MLP = types.ModuleType('sknn.mlp')
+    SKNN_MLP.Classifier = type('Classifier', (object,), {})
+    SKNN_MLP.Layer = type('Layer', (object,), {})
+    sys.modules['sknn'] = types.ModuleType('sknn')
+    sys.modules['sknn.mlp'] = SKNN_MLP
+
+import compiledmodels  # pylint:disable=wrong-import-position
+import preprocessing  # pylint:disable=wrong-import-position
+from trainclassifier import export_svm  # pylint:disable=wrong-import-position
+
+
+class TestCompiledModels(unittest.TestCase):
+    """Tests the compiled models module."""
+
+    def setUp(self):
+        """Create random sample data."""
+        self.random = np.random.RandomState(0)
+        self.sample_inputs = self.random.randn(60, 5)
+
+    def test_compiled_svm_two_classes(self):
+        """Compiled SVM matches sklearn predictions for two classes."""
+        sample_outputs = np.where(self.sample_inputs[:, 0] > 0, 'groupA', 'groupB')
+        clf = svm.SVC(gamma=0.2).fit(self.sample_inputs, sample_outputs)
+        test_inputs = self.random.randn(40, 5)
+        np.testing.assert_array_equal(
+            clf.predict(test_inputs), export_svm(clf).predict(test_inputs))
+
+    def test_compiled_svm_three_classes(self):
+        """Compiled SVM matches sklearn predictions for three classes."""
+        sample_outputs = np.digitize(self.sample_inputs[:, 0], [-0.5, 0.5])
+        clf = svm.SVC(gamma=0.2).fit(self.sample_inputs, sample_outputs)
+        test_inputs = self.random.randn(40, 5)
+        np.testing.assert_array_equal(
+            clf.predict(test_inputs), export_svm(clf).predict(test_inputs))
+
+    def test_compiled_neural_network(self):
+        """Compiled network applies Maxout and Softmax layers."""
+        # One Maxout layer with two units of two pieces, and two classes.
+        weights = [np.array([[1.0, -1.0, 0.0, 0.0],
+                             [0.0, 0.0, 1.0, -1.0]]),
+                   np.array([[1.0, 0.0],
+                             [0.0, 1.0]])]
+        biases = [np.zeros(4), np.zeros(2)]
+        model = compiledmodels.CompiledNeuralNetwork(
+            weights, biases, [2], ['groupA', 'groupB'])
+        # Hidden activations are (|x0|, |x1|).
+        test_inputs = np.array([[-3.0, 1.0], [0.5, -2.0]])
+        np.testing.assert_array_equal(
+            ['groupA', 'groupB'], model.predict(test_inputs))
+        probabilities = model.predict_proba(test_inputs)
+        np.testing.assert_allclose(np.ones(2), probabilities.sum(axis=1))
+        self.assertAlmostEqual(1.0 / (1.0 + np.exp(-2.0)), probabilities[0, 0])
+
+    def test_dumps_loads(self):
+        """Serialized compiled models are restored without pickling."""
+        sample_outputs = np.where(self.sample_inputs[:, 0] > 0, 'groupA', 'groupB')
+        model = export_svm(svm.SVC(gamma=0.2).fit(self.sample_inputs, sample_outputs))
+        restored = compiledmodels.loads(compiledmodels.dumps(model))
+        self.assertIsInstance(restored, compiledmodels.CompiledSVM)
+        np.testing.assert_array_equal(
+            model.predict(self.sample_inputs), restored.predict(self.sample_inputs))
+
+        network = compiledmodels.CompiledNeuralNetwork(
+            [np.ones((5, 4)), np.ones((2, 3))], [np.zeros(4), np.zeros(3)],
+            [2], ['a', 'b', 'c'])
+        restored = compiledmodels.loads(compiledmodels.dumps(network))
+        self.assertIsInstance(restored, compiledmodels.CompiledNeuralNetwork)
+        np.testing.assert_array_equal(
+            network.predict_proba(self.sample_inputs),
+            restored.predict_proba(self.sample_inputs))
+
+    def test_reduced_classifier(self):
+        """Reduced classifier projects samples before classifying them."""
+        projection = compiledmodels.LinearProjection(
+            np.ones(5), np.eye(5)[:2])
+        sample_outputs = np.where(self.sample_inputs[:, 0] > 1, 'groupA', 'groupB')
+        clf = svm.SVC(gamma=0.2).fit(
+            projection.transform(self.sample_inputs), sample_outputs)
+        model = compiledmodels.ReducedClassifier(projection, export_svm(clf))
+        np.testing.assert_array_equal(
+            clf.predict(self.sample_inputs[:, :2] - 1), model.predict(self.sample_inputs))
+        self.assertEqual(
+            clf.score(self.sample_inputs[:, :2] - 1, sample_outputs),
+            model.score(self.sample_inputs, sample_outputs))
+
+        # Serialized reduced classifiers include the projection.
+        restored = compiledmodels.loads(compiledmodels.dumps(model))
+        self.assertIsInstance(restored, compiledmodels.ReducedClassifier)
+        self.assertIsInstance(restored.classifier, compiledmodels.CompiledSVM)
+        np.testing.assert_array_equal(
+            model.predict(self.sample_inputs), restored.predict(self.sample_inputs))
+
+    def test_preprocessed_classifier(self):
+        """Preprocessed classifier applies its pipeline before classifying."""
+        pipeline = preprocessing.Pipeline([preprocessing.Normalization('max')])
+        sample_outputs = np.where(self.sample_inputs[:, 0] > 0, 'groupA', 'groupB')
+        clf = svm.SVC(gamma=0.2).fit(pipeline(self.sample_inputs), sample_outputs)
+        model = compiledmodels.PreprocessedClassifier(pipeline, export_svm(clf))
+        np.testing.assert_array_equal(
+            clf.predict(pipeline(self.sample_inputs)), model.predict(self.sample_inputs))
+
+        # Serialized preprocessed classifiers include the pipeline.
+        restored = compiledmodels.loads(compiledmodels.dumps(model))
+        self.assertIsInstance(restored, compiledmodels.PreprocessedClassifier)
+        self.assertEqual(pipeline.key(), restored.pipeline.key())
+        np.testing.assert_array_equal(
+            model.predict(self.sample_inputs), restored.predict(self.sample_inputs))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,6 +3,8 @@
 import dataparser
 import unittest
 
+import numpy as np
+
 
 class TestDataParser(unittest.TestCase):
     """Tests the data parser module."""
@@ -19,6 +21,13 @@ class TestDataParser(unittest.TestCase):
         self.assertIs(dict, type(header_data))
         self.assertTrue(len(header_data) > 0)
 
+    def test_get_header_data_fields(self):
+        """Method parses header field names and values, skipping blank lines."""
+        header_data = dataparser.get_header_data('\n' + self.mrs_data)
+        self.assertEqual('63.8470001', header_data['HZPPPM'])
+        self.assertEqual('(2e15.6)', header_data['FMTDAT'])
+        self.assertEqual('1.', header_data['VOLUME'])
+
     def test_get_xy_data(self):
         """Method parses header from MRS data file."""
         xy_data = dataparser.get_xy_data(self.mrs_data)
@@ -27,6 +36,20 @@ class TestDataParser(unittest.TestCase):
         self.assertTrue(len(xy_data) > 0)
         self.assertIs(complex, type(xy_data[0]))
 
+    def test_get_xy_array(self):
+        """Method parses the same data points as get_xy_data."""
+        xy_array = dataparser.get_xy_array(self.mrs_data)
+        self.assertEqual(np.complex128, xy_array.dtype)
+        np.testing.assert_array_equal(
+            dataparser.get_xy_data(self.mrs_data), xy_array)
+
+    def test_get_xy_array_float32(self):
+        """Method parses data points in single precision."""
+        xy_array = dataparser.get_xy_array(self.mrs_data, dtype=np.float32)
+        self.assertEqual(np.complex64, xy_array.dtype)
+        np.testing.assert_allclose(
+            dataparser.get_xy_data(self.mrs_data), xy_array, rtol=1e-6)
+
 
 if __name__ == '__main__':
     unittest.main()
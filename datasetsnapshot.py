@@ -0,0 +1,277 @@
+"""Methods for saving and loading featurized training data sets.
+
+A snapshot holds the feature matrix and labels built from a selection of MRS
+data. Snapshots are keyed by a hash of the selected IDs and feature
+configuration, so repeated training requests on the same selection can load
+the saved features instead of rebuilding them.
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+
+import numpy as np
+
+import compiledmodels
+
+
+# Directory where snapshots are saved.
+SNAPSHOT_DIR = 'snapshots'
+
+# Snapshot keys are SHA-1 hex digests.
+SNAPSHOT_KEY_PATTERN = re.compile(r'^[0-9a-f]{40}\Z')
+# Kernel matrices are cached per data set: a snapshot, optionally reduced to a
+# number of PCA components.
+DATA_SET_KEY_PATTERN = re.compile(r'^[0-9a-f]{40}(\.pca[0-9]+)?\Z')
+
+
+def snapshot_key(data_ids, config, data_versions=None):
+    """Computes the key of the snapshot for the given selection.
+
+    Args:
+        data_ids: IDs of the selected MRS data. Order does not matter.
+        config: Dictionary describing how features are computed.
+        data_versions: (optional) Dictionary of the (group label, content
+            hash) of each selected MRS data entry, keyed by ID. Including it
+            makes relabelled or changed MRS data produce a new snapshot.
+
+    Returns:
+        Hex digest identifying the snapshot.
+    """
+    selection = {'data_ids': sorted(set(data_ids)), 'config': config}
+    if data_versions is not None:
+        selection['data_versions'] = sorted(
+            [data_id, list(data_versions.get(data_id, ()))] for data_id in set(data_ids))
+    return hashlib.sha1(json.dumps(selection, sort_keys=True)).hexdigest()
+
+
+def _write_atomically(path, write):
+    """Writes a file so that readers never see it partially written.
+
+    Args:
+        path: Path of the file.
+        write: Function that writes the contents to a given file object.
+    """
+    # Temporary names are unique so that concurrent writers do not collide.
+    temp_path = '%s.%d-%d.tmp' % (path, os.getpid(), threading.current_thread().ident)
+    with open(temp_path, 'wb') as temp_file:
+        write(temp_file)
+    os.rename(temp_path, path)
+
+
+def is_valid_key(key):
+    """Returns whether a string has the form of a snapshot key.
+
+    Keys may come from requests, so they are checked before being used in
+    file paths.
+    """
+    return isinstance(key, basestring) and SNAPSHOT_KEY_PATTERN.match(key) is not None
+
+
+def _check_key(key, pattern=SNAPSHOT_KEY_PATTERN):
+    """Raises ValueError if a string does not have the form of a key.
+
+    Args:
+        key: The key.
+        pattern: Compiled regular expression that valid keys match.
+    """
+    if not isinstance(key, basestring) or pattern.match(key) is None:
+        raise ValueError('Invalid snapshot key: %r' % key)
+
+
+def _snapshot_paths(key, snapshot_dir):
+    """Returns the (feature file, metadata file) paths of a snapshot."""
+    _check_key(key)
+    path = os.path.join(snapshot_dir, key)
+    return (path + '.npy', path + '.json')
+
+
+def save_snapshot(key, data_ids, config, sample_inputs, sample_outputs,
+                  name=None, snapshot_dir=SNAPSHOT_DIR):
+    """Saves a featurized data set.
+
+    Args:
+        key: Key of the snapshot, as computed by snapshot_key.
+        data_ids: IDs of the MRS data, ordered like the samples.
+        config: Dictionary describing how features were computed.
+        sample_inputs: 2-D array of sample inputs.
+        sample_outputs: Array of sample outputs.
+        name: (optional) Human-readable name for the snapshot.
+        snapshot_dir: Directory where snapshots are saved.
+
+    Raises:
+        ValueError if the key is not a valid snapshot key.
+    """
+    if not os.path.isdir(snapshot_dir):
+        os.makedirs(snapshot_dir)
+    inputs_path, metadata_path = _snapshot_paths(key, snapshot_dir)
+    metadata = {
+        'key': key,
+        'name': name,
+        'data_ids': list(data_ids),
+        'config': config,
+        'sample_outputs': [str(output) for output in sample_outputs]}
+    # The metadata file marks the snapshot as complete, so write it last.
+    _write_atomically(
+        inputs_path, lambda f: np.save(f, np.ascontiguousarray(sample_inputs)))
+    _write_atomically(metadata_path, lambda f: json.dump(metadata, f))
+
+
+def load_snapshot(key, snapshot_dir=SNAPSHOT_DIR):
+    """Loads a featurized data set.
+
+    The feature matrix is memory-mapped, so it is only read from disk as it
+    is used.
+
+    Args:
+        key: Key of the snapshot.
+        snapshot_dir: Directory where snapshots are saved.
+
+    Returns:
+        Tuple containing (sample inputs, sample outputs), or None if the
+        snapshot does not exist.
+
+    Raises:
+        ValueError if the key is not a valid snapshot key.
+    """
+    inputs_path, metadata_path = _snapshot_paths(key, snapshot_dir)
+    if not os.path.exists(metadata_path):
+        return None
+    with open(metadata_path, 'r') as metadata_file:
+        metadata = json.load(metadata_file)
+    sample_inputs = np.load(inputs_path, mmap_mode='r', allow_pickle=False)
+    sample_outputs = np.array([str(output) for output in metadata['sample_outputs']])
+    return (sample_inputs, sample_outputs)
+
+
+def load_snapshot_config(key, snapshot_dir=SNAPSHOT_DIR):
+    """Loads the feature configuration of a snapshot.
+
+    Args:
+        key: Key of the snapshot.
+        snapshot_dir: Directory where snapshots are saved.
+
+    Returns:
+        Dictionary describing how the snapshot's features were computed, or
+        None if the snapshot does not exist.
+
+    Raises:
+        ValueError if the key is not a valid snapshot key.
+    """
+    _, metadata_path = _snapshot_paths(key, snapshot_dir)
+    if not os.path.exists(metadata_path):
+        return None
+    with open(metadata_path, 'r') as metadata_file:
+        return json.load(metadata_file)['config']
+
+
+def list_snapshots(snapshot_dir=SNAPSHOT_DIR):
+    """Lists all saved snapshots.
+
+    Args:
+        snapshot_dir: Directory where snapshots are saved.
+
+    Returns:
+        List of metadata dictionaries, each containing the snapshot's key,
+        name, data_ids and config.
+    """
+    if not os.path.isdir(snapshot_dir):
+        return []
+    snapshots = []
+    for file_name in sorted(os.listdir(snapshot_dir)):
+        if not file_name.endswith('.json'):
+            continue
+        with open(os.path.join(snapshot_dir, file_name), 'r') as metadata_file:
+            metadata = json.load(metadata_file)
+        del metadata['sample_outputs']
+        snapshots.append(metadata)
+    return snapshots
+
+
+def _reduction_path(key, n_components, snapshot_dir):
+    """Returns the path of a cached reduction of a snapshot."""
+    _check_key(key)
+    return os.path.join(snapshot_dir, '%s.pca%d.npz' % (key, n_components))
+
+
+def save_reduction(key, n_components, projection, snapshot_dir=SNAPSHOT_DIR):
+    """Caches a dimensionality reduction fitted to a snapshot.
+
+    Args:
+        key: Key of the snapshot.
+        n_components: Number of components requested for the reduction.
+        projection: A compiledmodels.LinearProjection.
+        snapshot_dir: Directory where snapshots are saved.
+
+    Raises:
+        ValueError if the key is not a valid snapshot key.
+    """
+    _write_atomically(
+        _reduction_path(key, n_components, snapshot_dir),
+        lambda f: f.write(compiledmodels.dumps(projection)))
+
+
+def load_reduction(key, n_components, snapshot_dir=SNAPSHOT_DIR):
+    """Loads a cached dimensionality reduction of a snapshot.
+
+    Args:
+        key: Key of the snapshot.
+        n_components: Number of components requested for the reduction.
+        snapshot_dir: Directory where snapshots are saved.
+
+    Returns:
+        A compiledmodels.LinearProjection, or None if none was cached.
+
+    Raises:
+        ValueError if the key is not a valid snapshot key.
+    """
+    path = _reduction_path(key, n_components, snapshot_dir)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as reduction_file:
+        return compiledmodels.loads(reduction_file.read())
+
+
+def _gram_path(key, gamma, snapshot_dir):
+    """Returns the path of a cached kernel matrix of a snapshot."""
+    _check_key(key, DATA_SET_KEY_PATTERN)
+    return os.path.join(snapshot_dir, '%s.gram-%r.npy' % (key, float(gamma)))
+
+
+def save_gram(key, gamma, gram, snapshot_dir=SNAPSHOT_DIR):
+    """Caches the RBF kernel matrix of a snapshot.
+
+    Args:
+        key: Key of the snapshot, followed by '.pca<n_components>' if the
+            data set is reduced.
+        gamma: RBF kernel coefficient.
+        gram: Kernel matrix of the snapshot's sample inputs.
+        snapshot_dir: Directory where snapshots are saved.
+
+    Raises:
+        ValueError if the key is not a valid data set key.
+    """
+    _write_atomically(_gram_path(key, gamma, snapshot_dir), lambda f: np.save(f, gram))
+
+
+def load_gram(key, gamma, snapshot_dir=SNAPSHOT_DIR):
+    """Loads a cached RBF kernel matrix of a snapshot, memory-mapped.
+
+    Args:
+        key: Key of the snapshot, followed by '.pca<n_components>' if the
+            data set is reduced.
+        gamma: RBF kernel coefficient.
+        snapshot_dir: Directory where snapshots are saved.
+
+    Returns:
+        The kernel matrix, or None if none was cached.
+
+    Raises:
+        ValueError if the key is not a valid data set key.
+    """
+    path = _gram_path(key, gamma, snapshot_dir)
+    if not os.path.exists(path):
+        return None
+    return np.load(path, mmap_mode='r', allow_pickle=False)
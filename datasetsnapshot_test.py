@@ -0,0 +1,117 @@
+"""Unit tests for the data set snapshot module."""
+
+import compiledmodels
+import datasetsnapshot
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+
+# A valid snapshot key.
+KEY = 'a' * 40
+
+class TestDataSetSnapshot(unittest.TestCase):
+    """Tests the data set snapshot module."""
+
+    def setUp(self):
+        """Create a temporary snapshot directory for each test case."""
+        self.snapshot_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Delete the temporary snapshot directory."""
+        shutil.rmtree(self.snapshot_dir)
+
+    def test_snapshot_key(self):
+        """Key depends on the selected IDs and config, but not their order."""
+        config = {'apply_fft': True}
+        key = datasetsnapshot.snapshot_key(['1', '2'], config)
+        self.assertEqual(key, datasetsnapshot.snapshot_key(['2', '1'], config))
+        self.assertNotEqual(key, datasetsnapshot.snapshot_key(['1'], config))
+        self.assertNotEqual(
+            key, datasetsnapshot.snapshot_key(['1', '2'], {'apply_fft': False}))
+
+    def test_snapshot_key_data_versions(self):
+        """Key changes when a selected MRS data entry is relabelled."""
+        config = {'apply_fft': True}
+        versions = {'1': ('groupA', 'hash1'), '2': ('groupB', 'hash2')}
+        key = datasetsnapshot.snapshot_key(['1', '2'], config, versions)
+        self.assertEqual(key, datasetsnapshot.snapshot_key(['2', '1'], config, dict(versions)))
+        self.assertNotEqual(key, datasetsnapshot.snapshot_key(['1', '2'], config))
+        versions['2'] = ('groupA', 'hash2')
+        self.assertNotEqual(key, datasetsnapshot.snapshot_key(['1', '2'], config, versions))
+
+    def test_save_load_snapshot(self):
+        """Saved snapshots are loaded memory-mapped."""
+        # Method returns None because the snapshot does not exist.
+        self.assertIsNone(datasetsnapshot.load_snapshot('b' * 40, self.snapshot_dir))
+
+        sample_inputs = np.arange(6, dtype=np.float32).reshape(2, 3)
+        sample_outputs = np.array(['groupA', 'groupB'])
+        datasetsnapshot.save_snapshot(
+            KEY, ['1', '2'], {'apply_fft': True}, sample_inputs,
+            sample_outputs, snapshot_dir=self.snapshot_dir)
+        loaded_inputs, loaded_outputs = datasetsnapshot.load_snapshot(
+            KEY, self.snapshot_dir)
+        self.assertIsInstance(loaded_inputs, np.memmap)
+        self.assertEqual(np.float32, loaded_inputs.dtype)
+        np.testing.assert_array_equal(sample_inputs, loaded_inputs)
+        np.testing.assert_array_equal(sample_outputs, loaded_outputs)
+
+    def test_invalid_key(self):
+        """Keys that are not hex digests are rejected before touching files."""
+        self.assertTrue(datasetsnapshot.is_valid_key(KEY))
+        for key in ['', 'key', '../' + KEY, KEY.upper(), KEY + '.npy', KEY + '\n', None]:
+            self.assertFalse(datasetsnapshot.is_valid_key(key))
+            self.assertRaises(
+                ValueError, datasetsnapshot.load_snapshot, key, self.snapshot_dir)
+        self.assertRaises(
+            ValueError, datasetsnapshot.save_snapshot, '../key', ['1'], {},
+            np.zeros((1, 3)), np.array(['groupA']), snapshot_dir=self.snapshot_dir)
+
+    def test_list_snapshots(self):
+        """Method lists metadata of all saved snapshots."""
+        self.assertEqual([], datasetsnapshot.list_snapshots(self.snapshot_dir))
+
+        datasetsnapshot.save_snapshot(
+            KEY, ['1'], {'apply_fft': True}, np.zeros((1, 3)),
+            np.array(['groupA']), name='sweep', snapshot_dir=self.snapshot_dir)
+        snapshots = datasetsnapshot.list_snapshots(self.snapshot_dir)
+        self.assertEqual(1, len(snapshots))
+        self.assertEqual(KEY, snapshots[0]['key'])
+        self.assertEqual('sweep', snapshots[0]['name'])
+        self.assertEqual(['1'], snapshots[0]['data_ids'])
+
+    def test_save_load_reduction(self):
+        """Reductions are cached per snapshot and number of components."""
+        self.assertIsNone(datasetsnapshot.load_reduction(KEY, 2, self.snapshot_dir))
+
+        projection = compiledmodels.LinearProjection(np.zeros(3), np.eye(3)[:2])
+        datasetsnapshot.save_reduction(KEY, 2, projection, self.snapshot_dir)
+        loaded = datasetsnapshot.load_reduction(KEY, 2, self.snapshot_dir)
+        np.testing.assert_array_equal(projection.components, loaded.components)
+        self.assertIsNone(datasetsnapshot.load_reduction(KEY, 3, self.snapshot_dir))
+
+    def test_save_load_gram(self):
+        """Kernel matrices are cached per snapshot and gamma."""
+        self.assertIsNone(datasetsnapshot.load_gram(KEY, 0.5, self.snapshot_dir))
+
+        gram = np.eye(3)
+        datasetsnapshot.save_gram(KEY, 0.5, gram, self.snapshot_dir)
+        loaded = datasetsnapshot.load_gram(KEY, 0.5, self.snapshot_dir)
+        self.assertIsInstance(loaded, np.memmap)
+        np.testing.assert_array_equal(gram, loaded)
+        self.assertIsNone(datasetsnapshot.load_gram(KEY, 0.25, self.snapshot_dir))
+
+        # Reduced data sets have their own kernel matrices.
+        datasetsnapshot.save_gram(KEY + '.pca2', 0.5, gram[:2, :2], self.snapshot_dir)
+        self.assertEqual(
+            (2, 2), datasetsnapshot.load_gram(KEY + '.pca2', 0.5, self.snapshot_dir).shape)
+        for key in ['../' + KEY, KEY + '.pca', KEY + '.pca2/..', KEY + '\n']:
+            self.assertRaises(
+                ValueError, datasetsnapshot.load_gram, key, 0.5, self.snapshot_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,17 +1,59 @@
 """Methods for storing and retrieving files in the database."""
 
 import cPickle
+import hashlib
+import multiprocessing
+import os
 import sqlite3
 
+import compiledmodels
+
 
 # Name of file for SQLite database.
 # Note: In-memory database (":memory:") is erased after closing the connection.
 SQLITE_DATABASE_FILE = 'database.db'
 
+# Number of SQLite files that MRS data is sharded across. With one shard, all
+# data is kept in SQLITE_DATABASE_FILE.
+SHARD_COUNT = 1
+# How MRS data is assigned to shards: by a hash of its ID or of its group
+# label.
+SHARD_KEYS = ('id', 'group_label')
+SHARD_KEY = 'id'
+
 # Name of table containing brain scan data.
 TABLE_NAME_BRAINSCANS = 'BrainScans'
 # Column description for table containing brain scan data.
-TABLE_COLS_BRAINSCANS = '(Id TEXT, FileName TEXT, FileContents BLOB, GroupLabel TEXT)'
+# pylint:disable=line-too-long
+TABLE_COLS_BRAINSCANS = '(Id TEXT, FileName TEXT, FileContents BLOB, GroupLabel TEXT, ContentHash TEXT)'
+# Name of unique index on the content hash of brain scan data.
+INDEX_NAME_BRAINSCANS_HASH = 'BrainScansContentHash'
+# Names of indexes on the ID and group label of brain scan data.
+INDEX_NAME_BRAINSCANS_ID = 'BrainScansId'
+INDEX_NAME_BRAINSCANS_LABEL = 'BrainScansGroupLabel'
+
+# Name of table in the main database file that maps the content hash of
+# sharded MRS data to its ID and shard, so that duplicates are detected across
+# shards.
+TABLE_NAME_CONTENTHASHES = 'ContentHashes'
+# Column description for table of content hashes of sharded MRS data.
+TABLE_COLS_CONTENTHASHES = '(ContentHash TEXT, Id TEXT, Shard INTEGER)'
+# Names of indexes on the content hash and ID of sharded MRS data.
+INDEX_NAME_CONTENTHASHES_HASH = 'ContentHashesContentHash'
+INDEX_NAME_CONTENTHASHES_ID = 'ContentHashesId'
+
+# Name of table containing header fields of brain scan data.
+TABLE_NAME_SCANHEADERS = 'ScanHeaders'
+# Column description for table containing header fields. Values that can be
+# parsed as numbers are also stored in NumericValue for range queries.
+TABLE_COLS_SCANHEADERS = '(ScanId TEXT, FieldName TEXT, TextValue TEXT, NumericValue REAL)'
+# Names of indexes on header fields.
+INDEX_NAME_SCANHEADERS_SCAN = 'ScanHeadersScanId'
+INDEX_NAME_SCANHEADERS_TEXT = 'ScanHeadersText'
+INDEX_NAME_SCANHEADERS_NUMERIC = 'ScanHeadersNumeric'
+
+# Comparison operators allowed in header predicates.
+HEADER_PREDICATE_OPERATORS = ('=', '!=', '<', '<=', '>', '>=')
 
 # Name of table containing classifiers.
 TABLE_NAME_CLASSIFIERS = 'Classifiers'
@@ -19,19 +61,168 @@ TABLE_NAME_CLASSIFIERS = 'Classifiers'
 # pylint:disable=line-too-long
 TABLE_COLS_CLASSIFIERS = '(Id TEXT, ClassifierName TEXT, ClassifierType TEXT, SerializedClassifier TEXT)'
 
+# Name of table containing classifiers exported for NumPy-only inference.
+TABLE_NAME_COMPILED_CLASSIFIERS = 'CompiledClassifiers'
+# Column description for table containing exported classifiers.
+TABLE_COLS_COMPILED_CLASSIFIERS = '(Id TEXT, SerializedModel BLOB)'
+
 
-def create_sqlite_connection(db_filename=SQLITE_DATABASE_FILE):
+def create_sqlite_connection(db_filename=SQLITE_DATABASE_FILE, n_shards=None,
+                             shard_key=None):
     """Creates a connection to the SQLite database in the specified file.
 
     Args:
         db_filename: Path to the SQLite database file.
+        n_shards: (optional) Number of files that MRS data is sharded across.
+            Defaults to SHARD_COUNT.
+        shard_key: (optional) How MRS data is assigned to shards, one of
+            SHARD_KEYS. Defaults to SHARD_KEY.
 
     Returns:
-        A database Connection object.
+        A database Connection object, or a ShardedConnection if MRS data is
+        sharded across several files.
     """
+    n_shards = SHARD_COUNT if n_shards is None else n_shards
+    if n_shards > 1:
+        return ShardedConnection(db_filename, n_shards, shard_key or SHARD_KEY)
     return sqlite3.connect(db_filename)
 
 
+def get_shard_filenames(db_filename, n_shards):
+    """Returns the paths of the files that MRS data is sharded across.
+
+    Args:
+        db_filename: Path to the main SQLite database file.
+        n_shards: Number of shards.
+
+    Returns:
+        List of paths, e.g. 'database-shard0.db' for 'database.db'.
+    """
+    root, extension = os.path.splitext(db_filename)
+    return ['%s-shard%d%s' % (root, i, extension) for i in range(n_shards)]
+
+
+def _shard_index(value, n_shards):
+    """Maps a value to a shard with a hash that is the same in every process."""
+    return int(hashlib.md5(str(value)).hexdigest(), 16) % n_shards
+
+
+class ShardedConnection(object):
+    """Connection to a database whose MRS data is sharded across several files.
+
+    MRS data and its header fields are stored in one of several shard files,
+    chosen by a hash of the MRS data's ID or group label, so that each shard
+    has its own write lock. The MRS data functions of this module accept a
+    ShardedConnection and route each call to the relevant shards. All other
+    tables stay in the main database file, and everything else, including
+    'with conn:' transactions, is delegated to the main file's connection.
+    """
+
+    def __init__(self, db_filename, n_shards, shard_key='id'):
+        """Connects to the main database file and its shards.
+
+        Shard files are connected to on first use.
+
+        Args:
+            db_filename: Path to the main SQLite database file.
+            n_shards: Number of files that MRS data is sharded across.
+            shard_key: How MRS data is assigned to shards, one of SHARD_KEYS.
+
+        Raises:
+            ValueError if the shard key is invalid.
+        """
+        if shard_key not in SHARD_KEYS:
+            raise ValueError('Invalid shard key: %s' % shard_key)
+        self.main = sqlite3.connect(db_filename)
+        self.shard_key = shard_key
+        self.shard_filenames = get_shard_filenames(db_filename, n_shards)
+        self._shards = [None] * n_shards
+
+    def __getattr__(self, name):
+        # Tables other than MRS data are stored in the main database file.
+        return getattr(self.main, name)
+
+    def __enter__(self):
+        return self.main.__enter__()
+
+    def __exit__(self, *args):
+        return self.main.__exit__(*args)
+
+    def shard(self, index):
+        """Returns the connection to the shard with given index."""
+        if self._shards[index] is None:
+            self._shards[index] = sqlite3.connect(self.shard_filenames[index])
+        return self._shards[index]
+
+    @property
+    def shards(self):
+        """Connections to all shards."""
+        return [self.shard(i) for i in range(len(self._shards))]
+
+    def shard_index_for(self, file_id, group_label):
+        """Returns the index of the shard where given MRS data belongs."""
+        value = file_id if self.shard_key == 'id' else group_label
+        return _shard_index(value, len(self._shards))
+
+    def shard_for(self, file_id, group_label):
+        """Returns the connection to the shard where given MRS data belongs."""
+        return self.shard(self.shard_index_for(file_id, group_label))
+
+    def shards_for_id(self, file_id):
+        """Returns connections to the shards that may hold the given ID."""
+        if self.shard_key == 'id':
+            return [self.shard_for(file_id, None)]
+        return self.shards
+
+    def shards_for_group_label(self, group_label):
+        """Returns connections to the shards that may hold the given label.
+
+        Args:
+            group_label: A group label, or None for any group label.
+        """
+        if self.shard_key == 'group_label' and group_label is not None:
+            return [self.shard_for(None, group_label)]
+        return self.shards
+
+    def close(self):
+        """Closes the connections to the main database file and all shards."""
+        for shard in self._shards:
+            if shard is not None:
+                shard.close()
+        self.main.close()
+
+
+def map_shards(function, db_filename=SQLITE_DATABASE_FILE, n_shards=None,
+               n_workers=None):
+    """Applies a function to every shard of MRS data in worker processes.
+
+    Each worker opens its own connection to its shard, so shards are read and
+    written concurrently.
+
+    Args:
+        function: Picklable function that takes the path of a SQLite database
+            file. It should connect with create_sqlite_connection(path,
+            n_shards=1).
+        db_filename: Path to the main SQLite database file.
+        n_shards: (optional) Number of shards. Defaults to SHARD_COUNT.
+        n_workers: (optional) Number of worker processes. Defaults to the
+            number of shards.
+
+    Returns:
+        List of the function's results, ordered by shard. Without sharding,
+        the function is applied to the main database file in this process.
+    """
+    n_shards = SHARD_COUNT if n_shards is None else n_shards
+    if n_shards <= 1:
+        return [function(db_filename)]
+    pool = multiprocessing.Pool(n_workers or n_shards)
+    try:
+        return pool.map(function, get_shard_filenames(db_filename, n_shards))
+    finally:
+        pool.close()
+        pool.join()
+
+
 def _table_exists(conn, table_name):
     """Determines whether or not the given table exists in the database.
 
@@ -65,6 +256,23 @@ def _create_table(conn, table_name, columns):
         cur.execute('CREATE TABLE IF NOT EXISTS %s%s' % (table_name, columns))
 
 
+def _create_index(conn, index_name, table_name, columns, unique=False):
+    """Creates an index on columns of the given table.
+
+    Args:
+        conn: A database Connection object.
+        index_name: Name of the index to create.
+        table_name: Name of the indexed table.
+        columns: Comma-separated names of the indexed columns.
+        unique: Whether the indexed values must be unique.
+    """
+    # Create the index.
+    with conn:
+        cur = conn.cursor()
+        cur.execute('CREATE %sINDEX IF NOT EXISTS %s ON %s(%s)' % (
+            'UNIQUE ' if unique else '', index_name, table_name, columns))
+
+
 def _fetch_entry_from_table(conn, table_name, entry_id):
     """Fetches entry with specified ID from table.
 
@@ -126,21 +334,392 @@ def _store_entry_in_table(conn, table_name, entry):
         cur.execute('INSERT INTO %s VALUES%s' % (table_name, template), entry)
 
 
-def store_mrs_data(conn, file_id, file_name, file_contents, group_label):
+def compute_content_hash(file_contents):
+    """Computes the content hash used to identify duplicate MRS data.
+
+    Args:
+        file_contents: Raw file contents.
+
+    Returns:
+        Hex digest of the SHA-256 hash of the file contents.
+    """
+    return hashlib.sha256(str(file_contents)).hexdigest()
+
+
+def upgrade_brainscans_table(conn):
+    """Adds content hashes to a brain scan table created without them.
+
+    Databases created before MRS data was deduplicated have no ContentHash
+    column. The column is added if necessary and the hash of every entry
+    without one is filled in, so an interrupted upgrade is completed by the
+    next call. Existing MRS data with identical contents is kept: the unique
+    content hash index is only created once there are no duplicates, which
+    remove_duplicate_mrs_data resolves on request.
+
+    Args:
+        conn: A database Connection object.
+
+    Returns:
+        Number of MRS data entries whose contents duplicate an earlier entry.
+    """
+    if not _table_exists(conn, TABLE_NAME_BRAINSCANS):
+        return 0
+    with conn:
+        cur = conn.cursor()
+        cur.execute('PRAGMA table_info(%s)' % TABLE_NAME_BRAINSCANS)
+        if 'ContentHash' not in [column[1] for column in cur.fetchall()]:
+            cur.execute('ALTER TABLE %s ADD COLUMN ContentHash TEXT' % TABLE_NAME_BRAINSCANS)
+        # Commits reset open cursors, so read all row IDs before updating.
+        cur.execute('SELECT rowid FROM %s WHERE ContentHash IS NULL' % TABLE_NAME_BRAINSCANS)
+        row_ids = [row[0] for row in cur.fetchall()]
+    for row_id in row_ids:
+        with conn:
+            cur = conn.cursor()
+            cur.execute('SELECT FileContents FROM %s WHERE rowid=?' %
+                        TABLE_NAME_BRAINSCANS, (row_id,))
+            content_hash = compute_content_hash(cur.fetchone()[0])
+            cur.execute('UPDATE %s SET ContentHash=? WHERE rowid=?' %
+                        TABLE_NAME_BRAINSCANS, (content_hash, row_id))
+    n_duplicates = _count_duplicate_mrs_data(conn)
+    _create_brainscans_indexes(conn, unique_hashes=n_duplicates == 0)
+    return n_duplicates
+
+
+def _count_duplicate_mrs_data(conn):
+    """Counts MRS data entries whose contents duplicate an earlier entry."""
+    with conn:
+        cur = conn.cursor()
+        cur.execute('SELECT COUNT(*) - COUNT(DISTINCT ContentHash) FROM %s' %
+                    TABLE_NAME_BRAINSCANS)
+        return cur.fetchone()[0]
+
+
+def remove_duplicate_mrs_data(conn):
+    """Removes MRS data whose contents duplicate an earlier entry.
+
+    Of MRS data with identical contents, the earliest stored entry is kept.
+    Header fields of the removed entries are removed too. Afterwards the
+    unique content hash index is created, so that no new duplicates are
+    stored.
+
+    Args:
+        conn: A database Connection object. The brain scan table should have
+            been upgraded with upgrade_brainscans_table.
+
+    Returns:
+        List of IDs of the removed MRS data entries.
+    """
+    if not _table_exists(conn, TABLE_NAME_BRAINSCANS):
+        return []
+    with conn:
+        cur = conn.cursor()
+        cur.execute(('SELECT rowid, Id FROM %s AS scans WHERE rowid > '
+                     '(SELECT MIN(rowid) FROM %s WHERE ContentHash=scans.ContentHash)') % (
+                         TABLE_NAME_BRAINSCANS, TABLE_NAME_BRAINSCANS))
+        duplicates = cur.fetchall()
+        for row_id, file_id in duplicates:
+            cur.execute('DELETE FROM %s WHERE rowid=?' % TABLE_NAME_BRAINSCANS, (row_id,))
+            if _table_exists(conn, TABLE_NAME_SCANHEADERS):
+                cur.execute('DELETE FROM %s WHERE ScanId=?' % TABLE_NAME_SCANHEADERS,
+                            (file_id,))
+    _create_brainscans_indexes(conn, unique_hashes=True)
+    return [file_id for _, file_id in duplicates]
+
+
+def _create_brainscans_indexes(conn, unique_hashes=True):
+    """Creates the indexes of the brain scan table if necessary.
+
+    Args:
+        conn: A database Connection object.
+        unique_hashes: Whether the content hash index should be unique. A
+            non-unique content hash index is replaced by a unique one.
+    """
+    with conn:
+        cur = conn.cursor()
+        cur.execute('PRAGMA index_list(%s)' % TABLE_NAME_BRAINSCANS)
+        unique_indexes = dict((index[1], index[2]) for index in cur.fetchall())
+    if unique_hashes and unique_indexes.get(INDEX_NAME_BRAINSCANS_HASH) == 0:
+        with conn:
+            conn.execute('DROP INDEX %s' % INDEX_NAME_BRAINSCANS_HASH)
+    _create_index(
+        conn, INDEX_NAME_BRAINSCANS_HASH, TABLE_NAME_BRAINSCANS, 'ContentHash',
+        unique=unique_hashes)
+    _create_index(conn, INDEX_NAME_BRAINSCANS_ID, TABLE_NAME_BRAINSCANS, 'Id')
+    _create_index(
+        conn, INDEX_NAME_BRAINSCANS_LABEL, TABLE_NAME_BRAINSCANS, 'GroupLabel')
+
+
+def _create_brainscans_table(conn):
+    """Creates the brain scan table and its indexes if it does not exist.
+
+    Existing tables are left unchanged, so this is cheap to call before
+    every write. Tables of older databases are upgraded by
+    upgrade_brainscans_table.
+
+    Args:
+        conn: A database Connection object.
+    """
+    if _table_exists(conn, TABLE_NAME_BRAINSCANS):
+        return
+    _create_table(conn, TABLE_NAME_BRAINSCANS, TABLE_COLS_BRAINSCANS)
+    _create_brainscans_indexes(conn)
+
+
+def _create_content_hash_table(conn):
+    """Creates the content hash table of sharded MRS data if it does not exist.
+
+    Args:
+        conn: Connection to the main database file.
+    """
+    if _table_exists(conn, TABLE_NAME_CONTENTHASHES):
+        return
+    _create_table(conn, TABLE_NAME_CONTENTHASHES, TABLE_COLS_CONTENTHASHES)
+    _create_index(
+        conn, INDEX_NAME_CONTENTHASHES_HASH, TABLE_NAME_CONTENTHASHES,
+        'ContentHash', unique=True)
+    _create_index(conn, INDEX_NAME_CONTENTHASHES_ID, TABLE_NAME_CONTENTHASHES, 'Id')
+
+
+def index_content_hashes(conn):
+    """Rebuilds the content hash table of sharded MRS data from the shards.
+
+    Used for sharded databases created before the table existed, and to drop
+    entries left behind by interrupted writes. Of MRS data with identical
+    contents in several shards, only the first found is indexed.
+
+    Args:
+        conn: A ShardedConnection.
+
+    Returns:
+        Number of MRS data entries indexed.
+    """
+    _create_content_hash_table(conn.main)
+    with conn.main:
+        cur = conn.main.cursor()
+        cur.execute('DELETE FROM %s' % TABLE_NAME_CONTENTHASHES)
+        for index, shard in enumerate(conn.shards):
+            if not _table_exists(shard, TABLE_NAME_BRAINSCANS):
+                continue
+            rows = shard.execute(
+                'SELECT ContentHash, Id FROM %s' % TABLE_NAME_BRAINSCANS)
+            cur.executemany(
+                'INSERT OR IGNORE INTO %s VALUES (?, ?, ?)' % TABLE_NAME_CONTENTHASHES,
+                ((content_hash, file_id, index) for content_hash, file_id in rows))
+        cur.execute('SELECT COUNT(*) FROM %s' % TABLE_NAME_CONTENTHASHES)
+        return cur.fetchone()[0]
+
+
+def fetch_mrs_data_id_by_hash(conn, content_hash):
+    """Looks up the ID of stored MRS data with the given content hash.
+
+    Args:
+        conn: A database Connection object.
+        content_hash: Content hash computed by compute_content_hash.
+
+    Returns:
+        ID of the matching MRS data entry, or None if there is no such entry.
+    """
+    # Content hashes of sharded MRS data are kept in the main database file.
+    table_name = TABLE_NAME_BRAINSCANS
+    if isinstance(conn, ShardedConnection):
+        conn = conn.main
+        table_name = TABLE_NAME_CONTENTHASHES
+    # Make sure the table exists.
+    if not _table_exists(conn, table_name):
+        return None
+    # Query the content hash index.
+    with conn:
+        cur = conn.cursor()
+        cur.execute('SELECT Id FROM %s WHERE ContentHash=?' % table_name, (content_hash,))
+        query_result = cur.fetchone()
+        return query_result[0] if query_result else None
+
+
+def _find_shard(conn, file_id):
+    """Finds the shard that holds the specified MRS data.
+
+    Args:
+        conn: A ShardedConnection.
+        file_id: Unique identifier for the file.
+
+    Returns:
+        Connection to the shard, or None if no shard holds the MRS data.
+    """
+    shards = conn.shards_for_id(file_id)
+    if len(shards) > 1 and _table_exists(conn.main, TABLE_NAME_CONTENTHASHES):
+        # Try the shard recorded in the content hash table first.
+        with conn.main:
+            cur = conn.main.cursor()
+            cur.execute('SELECT Shard FROM %s WHERE Id=?' % TABLE_NAME_CONTENTHASHES,
+                        (file_id,))
+            query_result = cur.fetchone()
+        if query_result:
+            shards.insert(0, shards.pop(query_result[0]))
+    for shard in shards:
+        if not _table_exists(shard, TABLE_NAME_BRAINSCANS):
+            continue
+        with shard:
+            cur = shard.cursor()
+            cur.execute(
+                'SELECT 1 FROM %s WHERE Id=?' % TABLE_NAME_BRAINSCANS, (file_id,))
+            if cur.fetchone():
+                return shard
+    return None
+
+
+def _move_mrs_data(source, destination, file_id, group_label):
+    """Moves MRS data and its header fields to another database file.
+
+    The data is written to the destination before it is deleted from the
+    source, so an interruption never loses it.
+
+    Args:
+        source: Connection to the database file that holds the MRS data.
+        destination: Connection to the database file to move it to.
+        file_id: Unique identifier for the file.
+        group_label: Group label of the MRS data at the destination.
+    """
+    entry = fetch_mrs_data(source, file_id)
+    header_data = fetch_header_data(source, file_id)
+    _create_brainscans_table(destination)
+    _store_entry_in_table(
+        destination, TABLE_NAME_BRAINSCANS,
+        (entry[0], entry[1], entry[2], group_label, entry[4]))
+    if header_data:
+        store_header_data(destination, file_id, header_data)
+    with source:
+        cur = source.cursor()
+        cur.execute('DELETE FROM %s WHERE Id=?' % TABLE_NAME_BRAINSCANS, (file_id,))
+        if _table_exists(source, TABLE_NAME_SCANHEADERS):
+            cur.execute(
+                'DELETE FROM %s WHERE ScanId=?' % TABLE_NAME_SCANHEADERS, (file_id,))
+
+
+def update_group_label(conn, file_id, group_label):
+    """Changes the group label of the specified MRS data.
+
+    If MRS data is sharded by group label, the data moves to the shard of its
+    new group label.
+
+    Args:
+        conn: A database Connection object.
+        file_id: Unique identifier for the file.
+        group_label: New therapy group label for the file.
+    """
+    if isinstance(conn, ShardedConnection):
+        shard = _find_shard(conn, file_id)
+        if shard is None:
+            return
+        destination_index = conn.shard_index_for(file_id, group_label)
+        destination = conn.shard(destination_index)
+        if destination is not shard:
+            _move_mrs_data(shard, destination, file_id, group_label)
+            if _table_exists(conn.main, TABLE_NAME_CONTENTHASHES):
+                with conn.main:
+                    conn.main.execute(
+                        'UPDATE %s SET Shard=? WHERE Id=?' % TABLE_NAME_CONTENTHASHES,
+                        (destination_index, file_id))
+            return
+        conn = shard
+    with conn:
+        cur = conn.cursor()
+        cur.execute(
+            'UPDATE %s SET GroupLabel=? WHERE Id=?' % TABLE_NAME_BRAINSCANS,
+            (group_label, file_id))
+
+
+def _store_sharded_mrs_data(conn, file_id, file_name, file_contents, group_label,
+                            update_label):
+    """Stores given MRS data in its shard unless its contents are stored already.
+
+    The content hash is first inserted into the content hash table of the
+    main database file, whose unique index rejects duplicates from any shard
+    and any concurrent writer. Only then is the data written to its shard.
+
+    Args:
+        conn: A ShardedConnection.
+        file_id: Unique identifier for the file.
+        file_name: Name of the file.
+        file_contents: Raw file contents.
+        group_label: Name of the therapy group that the given patient data belongs to.
+        update_label: Whether a duplicate should take on the given group label.
+
+    Returns:
+        Tuple containing (ID of the stored MRS data, whether the data was a
+        duplicate of an existing entry).
+    """
+    content_hash = compute_content_hash(file_contents)
+    shard_index = conn.shard_index_for(file_id, group_label)
+    _create_content_hash_table(conn.main)
+    try:
+        _store_entry_in_table(
+            conn.main, TABLE_NAME_CONTENTHASHES, (content_hash, file_id, shard_index))
+    except sqlite3.IntegrityError:
+        existing_id = fetch_mrs_data_id_by_hash(conn, content_hash)
+        if update_label:
+            update_group_label(conn, existing_id, group_label)
+        return (existing_id, True)
+    try:
+        stored_id, is_duplicate = store_mrs_data(
+            conn.shard(shard_index), file_id, file_name, file_contents, group_label)
+    except:  # pylint:disable=bare-except
+        # Release the content hash so that the data can be stored again.
+        with conn.main:
+            conn.main.execute(
+                'DELETE FROM %s WHERE ContentHash=?' % TABLE_NAME_CONTENTHASHES,
+                (content_hash,))
+        raise
+    if is_duplicate:
+        # The shard held the contents without an entry in the hash table.
+        with conn.main:
+            conn.main.execute(
+                'UPDATE %s SET Id=? WHERE ContentHash=?' % TABLE_NAME_CONTENTHASHES,
+                (stored_id, content_hash))
+        if update_label:
+            update_group_label(conn, stored_id, group_label)
+    return (stored_id, is_duplicate)
+
+
+def store_mrs_data(conn, file_id, file_name, file_contents, group_label,
+                   update_label=False):
     """Stores given MRS data in the database.
 
+    MRS data is deduplicated by content: if a file with identical contents has
+    already been stored, nothing new is written and the existing ID is
+    returned instead of file_id.
+
     Args:
         conn: A database Connection object.
         file_id: Unique identifier for the file.
         file_name: Name of the file.
         file_contents: Raw file contents.
         group_label: Name of the therapy group that the given patient data belongs to.
+        update_label: Whether a duplicate should take on the given group label.
+
+    Returns:
+        Tuple containing (ID of the stored MRS data, whether the data was a
+        duplicate of an existing entry).
     """
+    if isinstance(conn, ShardedConnection):
+        return _store_sharded_mrs_data(
+            conn, file_id, file_name, file_contents, group_label, update_label)
     # Create the table if it does not exist.
-    _create_table(conn, TABLE_NAME_BRAINSCANS, TABLE_COLS_BRAINSCANS)
+    _create_brainscans_table(conn)
+    content_hash = compute_content_hash(file_contents)
     # Try to insert a new row into the table.
-    table_entry = (file_id, file_name, file_contents, group_label)
-    _store_entry_in_table(conn, TABLE_NAME_BRAINSCANS, table_entry)
+    existing_id = fetch_mrs_data_id_by_hash(conn, content_hash)
+    if existing_id is None:
+        table_entry = (file_id, file_name, file_contents, group_label, content_hash)
+        try:
+            _store_entry_in_table(conn, TABLE_NAME_BRAINSCANS, table_entry)
+            return (file_id, False)
+        except sqlite3.IntegrityError:
+            # Another writer stored the same contents since the lookup.
+            existing_id = fetch_mrs_data_id_by_hash(conn, content_hash)
+    # Resolve the duplicate to the existing entry.
+    if update_label:
+        update_group_label(conn, existing_id, group_label)
+    return (existing_id, True)
 
 
 def fetch_mrs_data(conn, file_id):
@@ -152,13 +731,92 @@ def fetch_mrs_data(conn, file_id):
 
     Returns:
         If an entry with specified ID is found, the MRS data is returned in a
-        4-tuple of the form (file_id, file_name, file_contents, group_label).
-        Otherwise, the method returns None.
+        5-tuple of the form (file_id, file_name, file_contents, group_label,
+        content_hash). Otherwise, the method returns None.
     """
+    if isinstance(conn, ShardedConnection):
+        for shard in conn.shards_for_id(file_id):
+            entry = fetch_mrs_data(shard, file_id)
+            if entry is not None:
+                return entry
+        return None
     # Fetch specified MRS data from the database.
     return _fetch_entry_from_table(conn, TABLE_NAME_BRAINSCANS, file_id)
 
 
+def _group_ids_by_shard(conn, file_ids):
+    """Groups MRS data IDs by the shard that holds them.
+
+    With sharding by ID, the shard follows from the ID. Otherwise it is looked
+    up in the content hash table.
+
+    Args:
+        conn: A ShardedConnection.
+        file_ids: IDs of the MRS data.
+
+    Returns:
+        Dictionary of lists of IDs keyed by shard index. IDs whose shard is
+        not known are listed under None.
+    """
+    groups = {}
+    if conn.shard_key == 'id':
+        for file_id in file_ids:
+            groups.setdefault(conn.shard_index_for(file_id, None), []).append(file_id)
+        return groups
+    file_ids = list(file_ids)
+    shard_indexes = {}
+    if _table_exists(conn.main, TABLE_NAME_CONTENTHASHES):
+        with conn.main:
+            cur = conn.main.cursor()
+            # Stay below SQLite's limit on the number of query parameters.
+            for start in range(0, len(file_ids), 500):
+                chunk = file_ids[start:start + 500]
+                cur.execute('SELECT Id, Shard FROM %s WHERE Id IN (%s)' % (
+                    TABLE_NAME_CONTENTHASHES, ', '.join('?' * len(chunk))), chunk)
+                shard_indexes.update(cur.fetchall())
+    for file_id in file_ids:
+        groups.setdefault(shard_indexes.get(file_id), []).append(file_id)
+    return groups
+
+
+def fetch_mrs_data_versions(conn, file_ids):
+    """Fetches the group label and content hash of the specified MRS data.
+
+    File contents are not read, so this is much cheaper than fetching the
+    MRS data itself.
+
+    Args:
+        conn: A database Connection object.
+        file_ids: IDs of the MRS data.
+
+    Returns:
+        Dictionary of (group label, content hash) tuples keyed by ID. IDs that
+        are not found are left out.
+    """
+    if isinstance(conn, ShardedConnection):
+        versions = {}
+        for shard_index, shard_ids in _group_ids_by_shard(conn, file_ids).items():
+            shards = conn.shards if shard_index is None else [conn.shard(shard_index)]
+            for shard in shards:
+                versions.update(fetch_mrs_data_versions(shard, shard_ids))
+        return versions
+    # Make sure the table exists.
+    if not _table_exists(conn, TABLE_NAME_BRAINSCANS):
+        return {}
+    file_ids = list(file_ids)
+    versions = {}
+    with conn:
+        cur = conn.cursor()
+        # Stay below SQLite's limit on the number of query parameters.
+        for start in range(0, len(file_ids), 500):
+            chunk = file_ids[start:start + 500]
+            cur.execute('SELECT Id, GroupLabel, ContentHash FROM %s WHERE Id IN (%s)' % (
+                TABLE_NAME_BRAINSCANS, ', '.join('?' * len(chunk))), chunk)
+            for file_id, group_label, content_hash in cur.fetchall():
+                versions[file_id] = (group_label, content_hash)
+    return versions
+
+
 def fetch_all_mrs_data(conn):
     """Fetches all MRS data from the database.
 
@@ -167,12 +825,225 @@ def fetch_all_mrs_data(conn):
 
     Returns:
         List of all MRS data entries in the database. Each item in the list is
-        a 4-tuple of the form (ID, filename, MRS file contents, group label).
+        a 5-tuple of the form (ID, filename, MRS file contents, group label,
+        content hash).
     """
+    if isinstance(conn, ShardedConnection):
+        return [entry for shard in conn.shards for entry in fetch_all_mrs_data(shard)]
     # Fetch all MRS data from the database.
     return _fetch_all_from_table(conn, TABLE_NAME_BRAINSCANS)
 
 
+def _create_scanheaders_table(conn):
+    """Creates the header table and its indexes if necessary.
+
+    Args:
+        conn: A database Connection object.
+    """
+    _create_table(conn, TABLE_NAME_SCANHEADERS, TABLE_COLS_SCANHEADERS)
+    _create_index(
+        conn, INDEX_NAME_SCANHEADERS_SCAN, TABLE_NAME_SCANHEADERS, 'ScanId')
+    _create_index(
+        conn, INDEX_NAME_SCANHEADERS_TEXT, TABLE_NAME_SCANHEADERS,
+        'FieldName, TextValue')
+    _create_index(
+        conn, INDEX_NAME_SCANHEADERS_NUMERIC, TABLE_NAME_SCANHEADERS,
+        'FieldName, NumericValue')
+
+
+def _to_number(value):
+    """Converts a header value to a number, or returns None if it is not one."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def store_header_data(conn, file_id, header_data):
+    """Stores the header fields of the specified MRS data.
+
+    Any previously stored header fields of the MRS data are replaced.
+
+    Args:
+        conn: A database Connection object.
+        file_id: Unique identifier for the MRS data.
+        header_data: Dictionary of header values keyed by field name.
+    """
+    if isinstance(conn, ShardedConnection):
+        # Header fields are stored in the same shard as their MRS data.
+        shard = _find_shard(conn, file_id) or conn.shards_for_id(file_id)[0]
+        store_header_data(shard, file_id, header_data)
+        return
+    # Create the table if it does not exist.
+    _create_scanheaders_table(conn)
+    table_entries = [
+        (file_id, name, value, _to_number(value))
+        for name, value in header_data.items()]
+    # Replace the header fields in a single transaction.
+    with conn:
+        cur = conn.cursor()
+        cur.execute(
+            'DELETE FROM %s WHERE ScanId=?' % TABLE_NAME_SCANHEADERS, (file_id,))
+        cur.executemany(
+            'INSERT INTO %s VALUES(?, ?, ?, ?)' % TABLE_NAME_SCANHEADERS,
+            table_entries)
+
+
+def fetch_header_data(conn, file_id):
+    """Fetches the header fields of the specified MRS data.
+
+    Args:
+        conn: A database Connection object.
+        file_id: Unique identifier for the MRS data.
+
+    Returns:
+        Dictionary of header values keyed by field name.
+    """
+    if isinstance(conn, ShardedConnection):
+        for shard in conn.shards_for_id(file_id):
+            header_data = fetch_header_data(shard, file_id)
+            if header_data:
+                return header_data
+        return {}
+    # Make sure the table exists.
+    if not _table_exists(conn, TABLE_NAME_SCANHEADERS):
+        return {}
+    with conn:
+        cur = conn.cursor()
+        cur.execute(
+            'SELECT FieldName, TextValue FROM %s WHERE ScanId=?' %
+            TABLE_NAME_SCANHEADERS, (file_id,))
+        return dict(cur.fetchall())
+
+
+def fetch_mrs_data_without_headers(conn):
+    """Fetches all MRS data whose header fields have not been stored.
+
+    Args:
+        conn: A database Connection object.
+
+    Returns:
+        List of MRS data entries, in the same form as fetch_all_mrs_data.
+    """
+    if isinstance(conn, ShardedConnection):
+        return [entry for shard in conn.shards
+                for entry in fetch_mrs_data_without_headers(shard)]
+    # Make sure the tables exist.
+    if not _table_exists(conn, TABLE_NAME_BRAINSCANS):
+        return []
+    _create_scanheaders_table(conn)
+    with conn:
+        cur = conn.cursor()
+        cur.execute('SELECT * FROM %s WHERE Id NOT IN (SELECT ScanId FROM %s)' % (
+            TABLE_NAME_BRAINSCANS, TABLE_NAME_SCANHEADERS))
+        return cur.fetchall()
+
+
+def select_mrs_data(conn, header_predicates=(), group_label=None):
+    """Fetches MRS data matching the given header predicates and group label.
+
+    All conditions are combined into a single query that uses the header
+    table's indexes.
+
+    Args:
+        conn: A database Connection object.
+        header_predicates: List of (field name, operator, value) tuples that
+            must all hold. The operator is one of HEADER_PREDICATE_OPERATORS.
+            Numeric values are compared numerically; other values are compared
+            as text.
+        group_label: (optional) Group label that the MRS data must have.
+
+    Returns:
+        List of matching MRS data entries, in the same form as
+        fetch_all_mrs_data.
+
+    Raises:
+        ValueError if a predicate has an invalid operator.
+    """
+    if isinstance(conn, ShardedConnection):
+        # Header fields are in the same shard as their MRS data, so each
+        # shard is queried on its own.
+        return [entry for shard in conn.shards_for_group_label(group_label)
+                for entry in select_mrs_data(shard, header_predicates, group_label)]
+    # Make sure the tables exist.
+    if not _table_exists(conn, TABLE_NAME_BRAINSCANS):
+        return []
+    _create_scanheaders_table(conn)
+    # Join one copy of the header table per predicate.
+    joins = []
+    params = []
+    for i, (name, operator, value) in enumerate(header_predicates):
+        if operator not in HEADER_PREDICATE_OPERATORS:
+            raise ValueError('Invalid operator: %s' % operator)
+        number = _to_number(value)
+        column = 'TextValue' if number is None else 'NumericValue'
+        joins.append(
+            ' JOIN %s AS h%d ON h%d.ScanId=b.Id AND h%d.FieldName=? AND h%d.%s%s?' % (
+                TABLE_NAME_SCANHEADERS, i, i, i, i, column, operator))
+        params.extend([name, value if number is None else number])
+    query = 'SELECT b.* FROM %s AS b%s' % (TABLE_NAME_BRAINSCANS, ''.join(joins))
+    if group_label is not None:
+        query += ' WHERE b.GroupLabel=?'
+        params.append(group_label)
+    with conn:
+        cur = conn.cursor()
+        cur.execute(query, params)
+        return cur.fetchall()
+
+
+def move_mrs_data_to_shards(conn):
+    """Moves MRS data stored in the main database file into its shards.
+
+    Used when sharding is enabled for a database that already holds MRS data.
+    Entries are moved one at a time, so only their IDs are held in memory.
+
+    Args:
+        conn: A ShardedConnection.
+
+    Returns:
+        Number of MRS data entries moved.
+
+    Raises:
+        ValueError if the main database file holds duplicate MRS data. See
+        remove_duplicate_mrs_data.
+    """
+    if not _table_exists(conn.main, TABLE_NAME_BRAINSCANS):
+        return 0
+    # Shards do not accept duplicate contents, so duplicates would be lost.
+    if upgrade_brainscans_table(conn.main):
+        raise ValueError('Remove duplicate MRS data before sharding it.')
+    # Commits reset open cursors, so list the IDs before moving any rows.
+    with conn.main:
+        cur = conn.main.cursor()
+        cur.execute('SELECT Id FROM %s' % TABLE_NAME_BRAINSCANS)
+        file_ids = [row[0] for row in cur.fetchall()]
+    _create_content_hash_table(conn.main)
+    n_moved = 0
+    for file_id in file_ids:
+        entry = fetch_mrs_data(conn.main, file_id)
+        shard_index = conn.shard_index_for(entry[0], entry[3])
+        shard = conn.shard(shard_index)
+        _create_brainscans_table(shard)
+        try:
+            _store_entry_in_table(shard, TABLE_NAME_BRAINSCANS, entry)
+        except sqlite3.IntegrityError:
+            # Already moved by an interrupted earlier run.
+            pass
+        with conn.main:
+            conn.main.execute(
+                'INSERT OR IGNORE INTO %s VALUES (?, ?, ?)' % TABLE_NAME_CONTENTHASHES,
+                (entry[4], entry[0], shard_index))
+        header_data = fetch_header_data(conn.main, entry[0])
+        if header_data:
+            store_header_data(shard, entry[0], header_data)
+        n_moved += 1
+    # Only delete the originals once every entry is stored in a shard.
+    with conn.main:
+        conn.main.execute('DROP TABLE %s' % TABLE_NAME_BRAINSCANS)
+        conn.main.execute('DROP TABLE IF EXISTS %s' % TABLE_NAME_SCANHEADERS)
+    return n_moved
+
+
 def store_classifier(conn, classifier_id, classifier_name, classifier_type, classifier):
     """Stores the given classifier in the database.
 
@@ -231,3 +1102,39 @@ def fetch_all_classifiers(conn):
         converted_entries.append(
             (entry[0], entry[1], entry[2], cPickle.loads(str(entry[3]))))
     return converted_entries
+
+
+def store_compiled_classifier(conn, classifier_id, compiled_classifier):
+    """Stores a classifier exported for inference alongside the original.
+
+    Args:
+        conn: A database Connection object.
+        classifier_id: ID of the original classifier.
+        compiled_classifier: Classifier from the compiledmodels module.
+    """
+    # Serialize the classifier without pickling.
+    serialized_model = buffer(compiledmodels.dumps(compiled_classifier))
+    # Create the table if it does not exist.
+    _create_table(
+        conn, TABLE_NAME_COMPILED_CLASSIFIERS, TABLE_COLS_COMPILED_CLASSIFIERS)
+    # Store classifier in the database.
+    table_entry = (classifier_id, serialized_model)
+    _store_entry_in_table(conn, TABLE_NAME_COMPILED_CLASSIFIERS, table_entry)
+
+
+def fetch_compiled_classifier(conn, classifier_id):
+    """Fetches the exported version of the specified classifier.
+
+    Args:
+        conn: A database Connection object.
+        classifier_id: ID of the original classifier.
+
+    Returns:
+        Classifier from the compiledmodels module, or None if the specified
+        classifier was not exported.
+    """
+    db_entry = _fetch_entry_from_table(
+        conn, TABLE_NAME_COMPILED_CLASSIFIERS, classifier_id)
+    if db_entry is None:
+        return None
+    return compiledmodels.loads(str(db_entry[1]))
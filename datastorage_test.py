@@ -1,8 +1,14 @@
 """Unit tests for the data storage module."""
 
+import compiledmodels
 import datastorage as ds
+import os
+import shutil
+import tempfile
 import unittest
 
+import numpy as np
+
 
 class TestDataStorage(unittest.TestCase):
     """Tests the data storage module."""
@@ -130,6 +136,359 @@ class TestDataStorage(unittest.TestCase):
         expected_entries = [table_entry]
         self.assertEqual(expected_entries, db_entries)
 
+    def test_store_mrs_data(self):
+        """Method stores MRS data and returns its ID."""
+        stored_id, is_duplicate = ds.store_mrs_data(
+            self.conn, '1', 'scan', buffer('contents'), 'groupA')
+        # The new entry is stored under the given ID.
+        self.assertEqual('1', stored_id)
+        self.assertFalse(is_duplicate)
+        db_entry = ds.fetch_mrs_data(self.conn, '1')
+        self.assertEqual('scan', db_entry[1])
+        self.assertEqual('groupA', db_entry[3])
+        self.assertEqual(ds.compute_content_hash('contents'), db_entry[4])
+
+    def test_store_mrs_data_duplicate(self):
+        """Method resolves duplicate MRS data to the existing entry."""
+        ds.store_mrs_data(self.conn, '1', 'scan', buffer('contents'), 'groupA')
+
+        # Storing identical contents returns the existing ID.
+        stored_id, is_duplicate = ds.store_mrs_data(
+            self.conn, '2', 'copy', buffer('contents'), 'groupB')
+        self.assertEqual('1', stored_id)
+        self.assertTrue(is_duplicate)
+        # Nothing new was written, and the label is unchanged.
+        self.assertEqual(1, len(ds.fetch_all_mrs_data(self.conn)))
+        self.assertEqual('groupA', ds.fetch_mrs_data(self.conn, '1')[3])
+
+        # The duplicate can optionally relabel the existing entry.
+        ds.store_mrs_data(
+            self.conn, '3', 'copy', buffer('contents'), 'groupB',
+            update_label=True)
+        self.assertEqual(1, len(ds.fetch_all_mrs_data(self.conn)))
+        self.assertEqual('groupB', ds.fetch_mrs_data(self.conn, '1')[3])
+
+    def create_old_brainscans_table(self):
+        """Creates a brain scan table without content hashes."""
+        ds._create_table(
+            self.conn, ds.TABLE_NAME_BRAINSCANS,
+            '(Id TEXT, FileName TEXT, FileContents BLOB, GroupLabel TEXT)')
+        for file_id, contents in [('1', 'contents'), ('2', 'other'), ('3', 'contents')]:
+            ds._store_entry_in_table(
+                self.conn, ds.TABLE_NAME_BRAINSCANS,
+                (file_id, 'scan', buffer(contents), 'groupA'))
+        ds.store_header_data(self.conn, '3', {'HZPPPM': '63.8'})
+
+    def test_upgrade_brainscans_table(self):
+        """Tables without content hashes are upgraded, keeping duplicates."""
+        self.create_old_brainscans_table()
+        self.assertEqual(1, ds.upgrade_brainscans_table(self.conn))
+        self.assertEqual(['1', '2', '3'], sorted(
+            entry[0] for entry in ds.fetch_all_mrs_data(self.conn)))
+        self.assertEqual(ds.compute_content_hash('other'),
+                         ds.fetch_mrs_data(self.conn, '2')[4])
+        self.assertEqual({'HZPPPM': '63.8'}, ds.fetch_header_data(self.conn, '3'))
+        # New duplicates still resolve to the existing entries.
+        self.assertTrue(ds.store_mrs_data(
+            self.conn, '4', 'copy', buffer('other'), 'groupA')[1])
+        self.assertEqual(3, len(ds.fetch_all_mrs_data(self.conn)))
+
+        # Hashes missing after an interrupted upgrade are filled in.
+        with self.conn:
+            self.conn.execute('UPDATE %s SET ContentHash=NULL' % ds.TABLE_NAME_BRAINSCANS)
+        self.assertEqual(1, ds.upgrade_brainscans_table(self.conn))
+        self.assertEqual(ds.compute_content_hash('other'),
+                         ds.fetch_mrs_data(self.conn, '2')[4])
+
+    def test_remove_duplicate_mrs_data(self):
+        """Duplicates are removed on request, along with their header fields."""
+        self.create_old_brainscans_table()
+        ds.upgrade_brainscans_table(self.conn)
+        self.assertEqual(['3'], ds.remove_duplicate_mrs_data(self.conn))
+        self.assertEqual(['1', '2'], sorted(
+            entry[0] for entry in ds.fetch_all_mrs_data(self.conn)))
+        self.assertEqual({}, ds.fetch_header_data(self.conn, '3'))
+        self.assertEqual(0, ds.upgrade_brainscans_table(self.conn))
+        # The content hash index is now unique.
+        self.assertRaises(
+            ds.sqlite3.IntegrityError, ds._store_entry_in_table, self.conn,
+            ds.TABLE_NAME_BRAINSCANS, ('5', 'copy', buffer('other'), 'groupA',
+                                       ds.compute_content_hash('other')))
+
+    def test_fetch_mrs_data_id_by_hash(self):
+        """Method finds MRS data by content hash."""
+        content_hash = ds.compute_content_hash('contents')
+        # Method returns None because the table does not exist.
+        self.assertIsNone(ds.fetch_mrs_data_id_by_hash(self.conn, content_hash))
+
+        # Method returns the ID of the entry with matching contents.
+        ds.store_mrs_data(self.conn, '1', 'scan', buffer('contents'), 'groupA')
+        self.assertEqual('1', ds.fetch_mrs_data_id_by_hash(self.conn, content_hash))
+        self.assertIsNone(ds.fetch_mrs_data_id_by_hash(
+            self.conn, ds.compute_content_hash('other')))
+
+    def test_fetch_mrs_data_versions(self):
+        """Method fetches group labels and content hashes of MRS data."""
+        # Method returns nothing because the table does not exist.
+        self.assertEqual({}, ds.fetch_mrs_data_versions(self.conn, ['1']))
+
+        ds.store_mrs_data(self.conn, '1', 'scan', buffer('contents'), 'groupA')
+        ds.store_mrs_data(self.conn, '2', 'scan', buffer('other'), 'groupB')
+        self.assertEqual(
+            {'1': ('groupA', ds.compute_content_hash('contents'))},
+            ds.fetch_mrs_data_versions(self.conn, ['1', '3']))
+        ds.update_group_label(self.conn, '1', 'groupB')
+        self.assertEqual('groupB', ds.fetch_mrs_data_versions(self.conn, ['1'])['1'][0])
+
+    def test_store_compiled_classifier(self):
+        """Method stores an exported classifier under the original's ID."""
+        # Method returns None because no classifier was exported.
+        self.assertIsNone(ds.fetch_compiled_classifier(self.conn, '1'))
+
+        model = compiledmodels.CompiledNeuralNetwork(
+            [np.ones((3, 4)), np.ones((2, 2))], [np.zeros(4), np.zeros(2)],
+            [2], ['groupA', 'groupB'])
+        ds.store_compiled_classifier(self.conn, '1', model)
+        # Method retrieves an equivalent model from the database.
+        fetched_model = ds.fetch_compiled_classifier(self.conn, '1')
+        self.assertIsInstance(fetched_model, compiledmodels.CompiledNeuralNetwork)
+        np.testing.assert_array_equal(model.weights[0], fetched_model.weights[0])
+
+    def test_store_header_data(self):
+        """Method stores header fields, replacing previous ones."""
+        # Method returns no fields because the table does not exist.
+        self.assertEqual({}, ds.fetch_header_data(self.conn, '1'))
+
+        ds.store_header_data(self.conn, '1', {'HZPPPM': '63.8', 'ID': 'FILCOR'})
+        self.assertEqual({'HZPPPM': '63.8', 'ID': 'FILCOR'},
+                         ds.fetch_header_data(self.conn, '1'))
+        ds.store_header_data(self.conn, '1', {'HZPPPM': '127.7'})
+        self.assertEqual({'HZPPPM': '127.7'}, ds.fetch_header_data(self.conn, '1'))
+
+    def test_fetch_mrs_data_without_headers(self):
+        """Method fetches MRS data whose headers were not stored."""
+        self.assertEqual([], ds.fetch_mrs_data_without_headers(self.conn))
+
+        ds.store_mrs_data(self.conn, '1', 'scan1', buffer('contents1'), 'groupA')
+        ds.store_mrs_data(self.conn, '2', 'scan2', buffer('contents2'), 'groupA')
+        ds.store_header_data(self.conn, '1', {'HZPPPM': '63.8'})
+        db_entries = ds.fetch_mrs_data_without_headers(self.conn)
+        self.assertEqual(['2'], [entry[0] for entry in db_entries])
+
+    def test_select_mrs_data(self):
+        """Method selects MRS data by header predicates and group label."""
+        # Method returns empty list because the table does not exist.
+        self.assertEqual([], ds.select_mrs_data(self.conn, [('HZPPPM', '>', '60')]))
+
+        headers = {
+            '1': ({'HZPPPM': '63.8', 'FMTDAT': '(2e15.6)'}, 'groupA'),
+            '2': ({'HZPPPM': '127.7', 'FMTDAT': '(2e15.6)'}, 'groupA'),
+            '3': ({'HZPPPM': '127.7', 'FMTDAT': '(2e16.6)'}, 'groupB')}
+        for file_id, (header_data, group_label) in headers.items():
+            ds.store_mrs_data(
+                self.conn, file_id, 'scan', buffer(file_id), group_label)
+            ds.store_header_data(self.conn, file_id, header_data)
+
+        def selected_ids(predicates, group_label=None):
+            """Returns the sorted IDs of the selected MRS data."""
+            return sorted(entry[0] for entry in ds.select_mrs_data(
+                self.conn, predicates, group_label))
+
+        # Numeric and text comparisons.
+        self.assertEqual(['2', '3'], selected_ids([('HZPPPM', '>', '100')]))
+        self.assertEqual(['1'], selected_ids([('HZPPPM', '<=', '63.8')]))
+        self.assertEqual(['3'], selected_ids([('FMTDAT', '=', '(2e16.6)')]))
+        # Predicates and group label are combined.
+        self.assertEqual(['2'], selected_ids(
+            [('HZPPPM', '>', '100'), ('FMTDAT', '!=', '(2e16.6)')]))
+        self.assertEqual(['3'], selected_ids([('HZPPPM', '>', '100')], 'groupB'))
+        self.assertEqual(['1', '2'], selected_ids([], 'groupA'))
+        # Unknown fields match nothing.
+        self.assertEqual([], selected_ids([('VOLUME', '=', '1')]))
+        # Invalid operators are rejected.
+        with self.assertRaises(ValueError):
+            ds.select_mrs_data(self.conn, [('HZPPPM', '; DROP', '1')])
+
+
+def count_mrs_data(db_filename):
+    """Counts the MRS data in a database file, for map_shards."""
+    return len(ds.fetch_all_mrs_data(ds.create_sqlite_connection(db_filename, n_shards=1)))
+
+
+class TestShardedDataStorage(unittest.TestCase):
+    """Tests the data storage module with MRS data sharded across files."""
+
+    def setUp(self):
+        """Create a temporary directory for the database files."""
+        self.db_dir = tempfile.mkdtemp()
+        self.db_filename = os.path.join(self.db_dir, 'database.db')
+
+    def tearDown(self):
+        """Delete the database files."""
+        shutil.rmtree(self.db_dir)
+
+    def connect(self, shard_key='id', n_shards=4):
+        """Returns a connection to the sharded test database."""
+        return ds.create_sqlite_connection(self.db_filename, n_shards, shard_key)
+
+    def store_scans(self, conn, n_scans=12):
+        """Stores MRS data with alternating group labels and header fields."""
+        for i in range(n_scans):
+            file_id = str(i)
+            ds.store_mrs_data(conn, file_id, 'scan', buffer('contents%d' % i),
+                              'groupA' if i % 2 else 'groupB')
+            ds.store_header_data(conn, file_id, {'HZPPPM': str(60 + i)})
+
+    def test_create_sharded_connection(self):
+        """Sharded connections are created if more than one shard is used."""
+        conn = self.connect()
+        self.assertIsInstance(conn, ds.ShardedConnection)
+        self.assertEqual(
+            [os.path.join(self.db_dir, 'database-shard%d.db' % i) for i in range(4)],
+            conn.shard_filenames)
+        self.assertNotIsInstance(
+            ds.create_sqlite_connection(self.db_filename, n_shards=1), ds.ShardedConnection)
+        self.assertRaises(ValueError, self.connect, 'file_name')
+
+    def test_shard_by_id(self):
+        """MRS data is spread across shards by ID and fetched from them."""
+        conn = self.connect()
+        self.store_scans(conn)
+        counts = [len(ds.fetch_all_mrs_data(shard)) for shard in conn.shards]
+        self.assertEqual(12, sum(counts))
+        self.assertTrue(sum(1 for count in counts if count) > 1)
+
+        self.assertEqual('contents5', str(ds.fetch_mrs_data(conn, '5')[2]))
+        self.assertIsNone(ds.fetch_mrs_data(conn, '12'))
+        self.assertEqual({'HZPPPM': '65'}, ds.fetch_header_data(conn, '5'))
+        self.assertEqual(12, len(ds.fetch_all_mrs_data(conn)))
+        self.assertEqual(['1', '11', '3', '5', '7', '9'], sorted(
+            entry[0] for entry in ds.select_mrs_data(conn, group_label='groupA')))
+        self.assertEqual(['10', '11'], sorted(
+            entry[0] for entry in ds.select_mrs_data(conn, [('HZPPPM', '>=', '70')])))
+        self.assertEqual([], ds.fetch_mrs_data_without_headers(conn))
+
+        # Classifiers are stored in the main database file.
+        ds.store_classifier(conn, 'c', 'name', 'SVM', None)
+        self.assertEqual('name', ds.fetch_classifier(
+            ds.create_sqlite_connection(self.db_filename, n_shards=1), 'c')[1])
+
+    def test_shard_duplicates(self):
+        """Duplicates are found across shards."""
+        conn = self.connect()
+        self.store_scans(conn)
+        for i in range(12):
+            stored_id, is_duplicate = ds.store_mrs_data(
+                conn, 'copy%d' % i, 'copy', buffer('contents%d' % i), 'groupC')
+            self.assertEqual((str(i), True), (stored_id, is_duplicate))
+        self.assertEqual(12, len(ds.fetch_all_mrs_data(conn)))
+
+    def test_shard_content_hashes(self):
+        """Content hashes of all shards are kept in the main database file."""
+        conn = self.connect('group_label')
+        self.store_scans(conn)
+        self.assertEqual('5', ds.fetch_mrs_data_id_by_hash(
+            conn, ds.compute_content_hash('contents5')))
+        main = ds.create_sqlite_connection(self.db_filename, n_shards=1)
+        self.assertEqual(12, len(ds._fetch_all_from_table(main, ds.TABLE_NAME_CONTENTHASHES)))
+
+        # A content hash that is already claimed resolves to its entry, even
+        # before the claiming writer has stored the data in its shard.
+        ds._store_entry_in_table(
+            main, ds.TABLE_NAME_CONTENTHASHES, (ds.compute_content_hash('new'), 'a', 0))
+        self.assertEqual(('a', True), ds.store_mrs_data(
+            conn, 'b', 'copy', buffer('new'), 'groupA'))
+        self.assertIsNone(ds.fetch_mrs_data(conn, 'b'))
+
+        # Rebuilding the table drops claims without stored data.
+        self.assertEqual(12, ds.index_content_hashes(conn))
+        self.assertIsNone(ds.fetch_mrs_data_id_by_hash(conn, ds.compute_content_hash('new')))
+        self.assertEqual(('b', False), ds.store_mrs_data(
+            conn, 'b', 'copy', buffer('new'), 'groupA'))
+
+    def test_shard_content_hashes_follow_moves(self):
+        """Relabelled MRS data is found in its new shard."""
+        conn = self.connect('group_label')
+        self.store_scans(conn)
+        ds.update_group_label(conn, '0', 'groupC')
+        shard_c = conn.shard_index_for(None, 'groupC')
+        main = ds.create_sqlite_connection(self.db_filename, n_shards=1)
+        self.assertEqual(
+            [(shard_c,)], main.execute('SELECT Shard FROM %s WHERE Id="0"' %
+                                       ds.TABLE_NAME_CONTENTHASHES).fetchall())
+        self.assertEqual('groupC', ds.fetch_mrs_data(conn, '0')[3])
+
+    def test_shard_fetch_mrs_data_versions(self):
+        """Group labels and content hashes are fetched from the shards of the IDs."""
+        for shard_key in ds.SHARD_KEYS:
+            self.db_filename = os.path.join(self.db_dir, '%s.db' % shard_key)
+            conn = self.connect(shard_key)
+            self.store_scans(conn)
+            ds.update_group_label(conn, '5', 'groupC')
+            groups = ds._group_ids_by_shard(conn, ['5', 'unknown'])
+            self.assertEqual(['5'], groups[conn.shard_index_for('5', 'groupC')])
+            versions = ds.fetch_mrs_data_versions(conn, [str(i) for i in range(12)])
+            self.assertEqual(12, len(versions))
+            self.assertEqual(
+                ('groupC', ds.compute_content_hash('contents5')), versions['5'])
+            conn.close()
+
+        # IDs without a known shard are looked up in every shard.
+        conn = self.connect('group_label')
+        self.assertEqual({None: ['unknown']}, ds._group_ids_by_shard(conn, ['unknown']))
+
+    def test_shard_by_group_label(self):
+        """MRS data moves to the shard of its new group label."""
+        conn = self.connect('group_label')
+        self.store_scans(conn)
+        shard_a = conn.shard_for(None, 'groupA')
+        self.assertEqual(6, len(ds.fetch_all_mrs_data(shard_a)))
+        self.assertEqual(6, len(ds.select_mrs_data(conn, group_label='groupA')))
+
+        ds.store_mrs_data(conn, 'copy', 'copy', buffer('contents0'), 'groupA',
+                          update_label=True)
+        self.assertEqual('groupA', ds.fetch_mrs_data(conn, '0')[3])
+        self.assertEqual(7, len(ds.fetch_all_mrs_data(shard_a)))
+        self.assertEqual(12, len(ds.fetch_all_mrs_data(conn)))
+        # Header fields move with the MRS data.
+        self.assertEqual({'HZPPPM': '60'}, ds.fetch_header_data(shard_a, '0'))
+
+    def test_move_mrs_data_to_shards(self):
+        """MRS data in the main database file is moved into the shards."""
+        self.store_scans(ds.create_sqlite_connection(self.db_filename, n_shards=1))
+        conn = self.connect()
+        self.assertEqual(12, ds.move_mrs_data_to_shards(conn))
+        self.assertEqual(0, ds.move_mrs_data_to_shards(conn))
+        self.assertEqual(12, len(ds.fetch_all_mrs_data(conn)))
+        self.assertEqual({'HZPPPM': '63'}, ds.fetch_header_data(conn, '3'))
+        # Moved MRS data is deduplicated across shards.
+        self.assertEqual(('3', True), ds.store_mrs_data(
+            conn, 'copy', 'copy', buffer('contents3'), 'groupC'))
+
+    def test_move_duplicate_mrs_data_to_shards(self):
+        """Duplicate MRS data must be removed before it is sharded."""
+        main = ds.create_sqlite_connection(self.db_filename, n_shards=1)
+        ds._create_table(main, ds.TABLE_NAME_BRAINSCANS, ds.TABLE_COLS_BRAINSCANS)
+        for file_id in ['1', '2']:
+            ds._store_entry_in_table(main, ds.TABLE_NAME_BRAINSCANS, (
+                file_id, 'scan', buffer('contents'), 'groupA',
+                ds.compute_content_hash('contents')))
+        conn = self.connect()
+        self.assertRaises(ValueError, ds.move_mrs_data_to_shards, conn)
+        self.assertEqual(2, len(ds.fetch_all_mrs_data(main)))
+
+        ds.remove_duplicate_mrs_data(main)
+        self.assertEqual(1, ds.move_mrs_data_to_shards(conn))
+
+    def test_map_shards(self):
+        """Functions are applied to each shard in worker processes."""
+        self.store_scans(self.connect())
+        counts = ds.map_shards(count_mrs_data, self.db_filename, n_shards=4)
+        self.assertEqual(4, len(counts))
+        self.assertEqual(12, sum(counts))
+        # Without sharding, the function is applied to the main file.
+        self.assertEqual([0], ds.map_shards(count_mrs_data, self.db_filename, n_shards=1))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,149 @@
+"""Classification of a sample by an ensemble of classifiers.
+
+Members are applied concurrently in a thread pool, so an ensemble takes
+roughly as long as its slowest member. Their predictions are combined by
+majority vote or by averaging class probabilities.
+"""
+
+import collections
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+
+
+# Ways of combining the predictions of ensemble members.
+COMBINE_METHODS = ('vote', 'average')
+
+# Prediction of a single ensemble member. probabilities maps class labels to
+# probabilities, or is None if the member cannot estimate probabilities.
+# latency is the member's classification time in seconds.
+MemberResult = collections.namedtuple(
+    'MemberResult', ['member_id', 'label', 'probabilities', 'latency'])
+
+
+def get_classes(classifier):
+    """Returns the class labels of a classifier, ordered like its probabilities.
+
+    Args:
+        classifier: A trained classifier.
+
+    Returns:
+        Array of class labels, or None if they cannot be determined.
+    """
+    if hasattr(classifier, 'classes'):
+        return np.asarray(classifier.classes)
+    if hasattr(classifier, 'classes_'):
+        return np.asarray(classifier.classes_)
+    if hasattr(classifier, 'label_binarizers'):
+        return np.asarray(classifier.label_binarizers[0].classes_)
+    # Wrapped classifiers, e.g. compiledmodels.ReducedClassifier.
+    if hasattr(classifier, 'classifier'):
+        return get_classes(classifier.classifier)
+    return None
+
+
+def classify_member(member):
+    """Classifies a sample with one ensemble member.
+
+    Args:
+        member: Tuple containing (member ID, classifier, sample).
+
+    Returns:
+        A MemberResult.
+    """
+    member_id, classifier, sample = member
+    samples = np.array([sample])
+    t_start = time.time()
+    # Not all classifiers estimate probabilities, e.g. SVMs trained without
+    # probability=True. Those that do are only applied once, with the label
+    # taken from the most probable class.
+    probabilities = None
+    classes = get_classes(classifier)
+    if classes is not None:
+        try:
+            row = np.asarray(classifier.predict_proba(samples))[0]
+            probabilities = dict(zip([str(c) for c in classes], row.tolist()))
+            label = classes[np.argmax(row)]
+        except AttributeError:
+            pass
+    if probabilities is None:
+        label = np.asarray(classifier.predict(samples)).ravel()[0]
+    latency = time.time() - t_start
+    return MemberResult(member_id, str(label), probabilities, latency)
+
+
+def combine(results, method='vote'):
+    """Combines the predictions of ensemble members.
+
+    Args:
+        results: List of MemberResults.
+        method: 'vote' to choose the label predicted by most members, or
+            'average' to choose the label with the highest mean probability.
+            Members without probabilities count as assigning probability 1 to
+            their predicted label.
+
+    Returns:
+        The combined label. Ties go to the label of the earliest member.
+
+    Raises:
+        ValueError: The combine method is invalid or there are no results.
+    """
+    if method not in COMBINE_METHODS:
+        raise ValueError('Invalid combine method: %s' % method)
+    if not results:
+        raise ValueError('Ensemble has no members')
+    scores = collections.OrderedDict()
+    for result in results:
+        scores.setdefault(result.label, 0.0)
+        if method == 'vote':
+            scores[result.label] += 1
+        elif result.probabilities is None:
+            scores[result.label] += 1.0 / len(results)
+        else:
+            for label, probability in result.probabilities.items():
+                scores[label] = scores.get(label, 0.0) + probability / len(results)
+    # max returns the first of equal scores, i.e. the earliest member's label.
+    return max(scores, key=scores.get)
+
+
+class Ensemble(object):
+    """Applies several classifiers to a sample concurrently."""
+
+    def __init__(self, max_workers=4):
+        """Creates an ensemble runner.
+
+        Args:
+            max_workers: Number of members applied at the same time. If 1,
+                members are applied one after another.
+        """
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def _get_pool(self):
+        """Returns the thread pool, creating it on first use."""
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPool(self.max_workers)
+            return self._pool
+
+    def classify(self, members, method='vote'):
+        """Classifies a sample with every member and combines the results.
+
+        Args:
+            members: List of (member ID, classifier, sample) tuples. Each
+                member is given its own sample, since members may expect
+                differently featurized input.
+            method: How predictions are combined. See combine.
+
+        Returns:
+            Tuple containing (combined label, list of MemberResults ordered
+            like members).
+        """
+        if self.max_workers <= 1 or len(members) <= 1:
+            results = [classify_member(member) for member in members]
+        else:
+            results = self._get_pool().map(classify_member, members)
+        return (combine(results, method), results)
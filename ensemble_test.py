@@ -0,0 +1,116 @@
+"""Unit tests for the ensemble module."""
+
+import compiledmodels
+import ensemble
+import threading
+import unittest
+
+import numpy as np
+
+
+class ConstantClassifier(object):
+    """Classifier that predicts the same probabilities for every sample."""
+
+    def __init__(self, classes, probabilities, barrier=None):
+        self.classes = np.array(classes)
+        self.probabilities = np.array(probabilities)
+        self.barrier = barrier
+        self.n_predict_calls = 0
+
+    def predict_proba(self, samples):
+        # Wait for all members of the ensemble to be running at once.
+        if self.barrier is not None:
+            self.barrier.wait()
+        return np.tile(self.probabilities, (len(samples), 1))
+
+    def predict(self, samples):
+        self.n_predict_calls += 1
+        return self.classes[np.argmax(self.predict_proba(samples), axis=1)]
+
+
+class LabelClassifier(object):
+    """Classifier without probabilities that predicts a fixed label."""
+
+    def __init__(self, label):
+        self.label = label
+
+    def predict(self, samples):
+        return np.array([self.label] * len(samples))
+
+
+class CountdownBarrier(object):
+    """Event set once a given number of threads have waited."""
+
+    def __init__(self, count):
+        self.count = count
+        self.lock = threading.Lock()
+        self.event = threading.Event()
+
+    def wait(self):
+        with self.lock:
+            self.count -= 1
+            if self.count <= 0:
+                self.event.set()
+        self.event.wait(5.0)
+
+
+class TestEnsemble(unittest.TestCase):
+    """Tests the ensemble module."""
+
+    def test_classify_member(self):
+        """Member results include label, probabilities and latency."""
+        classifier = ConstantClassifier(['groupA', 'groupB'], [0.25, 0.75])
+        result = ensemble.classify_member(('a', classifier, np.zeros(3)))
+        self.assertEqual('a', result.member_id)
+        self.assertEqual('groupB', result.label)
+        self.assertEqual({'groupA': 0.25, 'groupB': 0.75}, result.probabilities)
+        self.assertTrue(result.latency >= 0)
+        # The label is taken from the probabilities, without a second pass.
+        self.assertEqual(0, classifier.n_predict_calls)
+
+        # Probabilities are None if the classifier cannot estimate them.
+        result = ensemble.classify_member(('b', LabelClassifier('groupA'), np.zeros(3)))
+        self.assertEqual('groupA', result.label)
+        self.assertIsNone(result.probabilities)
+
+    def test_classify_wrapped_member(self):
+        """Class labels of wrapped classifiers are found."""
+        projection = compiledmodels.LinearProjection(np.zeros(3), np.eye(3))
+        classifier = compiledmodels.ReducedClassifier(
+            projection, ConstantClassifier(['groupA', 'groupB'], [0.6, 0.4]))
+        result = ensemble.classify_member(('a', classifier, np.zeros(3)))
+        self.assertEqual({'groupA': 0.6, 'groupB': 0.4}, result.probabilities)
+
+    def test_combine(self):
+        """Predictions are combined by vote or probability average."""
+        results = [
+            ensemble.MemberResult('a', 'groupA', {'groupA': 0.55, 'groupB': 0.45}, 0),
+            ensemble.MemberResult('b', 'groupA', {'groupA': 0.6, 'groupB': 0.4}, 0),
+            ensemble.MemberResult('c', 'groupB', {'groupA': 0.0, 'groupB': 1.0}, 0)]
+        self.assertEqual('groupA', ensemble.combine(results, 'vote'))
+        self.assertEqual('groupB', ensemble.combine(results, 'average'))
+
+        # Ties go to the earliest member's label.
+        self.assertEqual('groupB', ensemble.combine([results[2], results[1]], 'vote'))
+        self.assertEqual('groupA', ensemble.combine(results[:2] + [
+            ensemble.MemberResult('d', 'groupB', None, 0)] * 2, 'vote'))
+
+        self.assertRaises(ValueError, ensemble.combine, results, 'median')
+        self.assertRaises(ValueError, ensemble.combine, [], 'vote')
+
+    def test_classify_concurrently(self):
+        """Members are applied concurrently and results keep member order."""
+        barrier = CountdownBarrier(3)
+        members = [
+            (str(i), ConstantClassifier(['groupA', 'groupB'], probabilities, barrier),
+             np.zeros(3))
+            for i, probabilities in enumerate([[0.9, 0.1], [0.2, 0.8], [0.3, 0.7]])]
+        label, results = ensemble.Ensemble(max_workers=3).classify(members, 'vote')
+        self.assertEqual('groupB', label)
+        self.assertEqual(['0', '1', '2'], [result.member_id for result in results])
+        # Members would have waited on each other if applied sequentially.
+        self.assertTrue(all(result.latency < 5.0 for result in results))
+
+
+if __name__ == '__main__':
+    unittest.main()
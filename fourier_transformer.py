@@ -4,11 +4,13 @@ import numpy as np
 from scipy.fftpack import fft
 
 
-def get_fft(time_domain_mrs):
+def get_fft(time_domain_mrs, dtype=np.float64):
     """Applies FFT to given MRS data.
 
     Args:
         time_domain_mrs: Time-domain MRS data.
+        dtype: Floating-point NumPy dtype of the returned array. The FFT is
+            computed in the matching complex precision.
 
     Returns:
         Frequency-domain MRS data.
@@ -18,11 +20,11 @@ def get_fft(time_domain_mrs):
     # As recommeded by Professor Bluml, zero-fill the data up to ~8000
     # points to preserve all signal-to-noise.
     N = len(time_domain_mrs)*4
-    y = np.array(time_domain_mrs)
+    y = np.asarray(time_domain_mrs, dtype=np.result_type(dtype, np.complex64))
     y = np.lib.pad(y, (0, len(time_domain_mrs)*3), 'constant', constant_values=0)
     # Sample spacing.
     #T = 1.0 / 800.0
     #x = np.linspace(0.0, N*T, N)
     yf = fft(y)
     #xf = np.linspace(0.0, 1.0/(2.0*T), 21)
-    return 2.0/N * np.abs(yf[0:N/2:N/40])
+    return (2.0/N * np.abs(yf[0:N/2:N/40])).astype(dtype)
@@ -4,6 +4,8 @@ import dataparser
 import fourier_transformer
 import unittest
 
+import numpy as np
+
 
 class TestFourierTransformer(unittest.TestCase):
     """Tests the FFT module."""
@@ -22,6 +24,14 @@ class TestFourierTransformer(unittest.TestCase):
         self.assertTrue(len(fft_data) > 0)
         self.assertIs(float, type(float(fft_data[0])))  # convert numpy float
 
+    def test_get_fft_float32(self):
+        """Method applies FFT in single precision."""
+        fft_data = fourier_transformer.get_fft(self.mrs_data)
+        fft_data_32 = fourier_transformer.get_fft(self.mrs_data, dtype=np.float32)
+        self.assertEqual(np.float64, fft_data.dtype)
+        self.assertEqual(np.float32, fft_data_32.dtype)
+        np.testing.assert_allclose(fft_data, fft_data_32, rtol=1e-4)
+
 
 if __name__ == '__main__':
     unittest.main()
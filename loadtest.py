@@ -0,0 +1,257 @@
+"""Load test for the web application.
+
+Drives server.APP in-process from several threads with a configurable mix of
+upload, list, train and classify requests using synthetic MRS data files,
+then reports throughput and latency percentiles for each route.
+
+The test runs in a temporary working directory, so it uses its own database
+and snapshots and leaves the project's data untouched.
+
+Usage: python loadtest.py [-duration=10] [-threads=8] [-files=20]
+    [-mix=upload:2,list:2,train:1,classify:5] [-batch_predictions]
+"""
+
+import argparse
+import collections
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import webob
+
+import server
+
+
+# Header of the synthetic MRS data files.
+MRS_HEADER = """ $SEQPAR
+ HZPPPM =  63.8470001
+ $END
+ $NMID
+ BRUKER = F,
+ FMTDAT = '(2e15.6)',
+ ID = 'FILCOR',
+ SEQACQ = F,
+ TRAMP =  1.,
+ VOLUME =  1.
+ $END
+"""
+
+
+def make_mrs_file(random_state, n_points=2048):
+    """Creates the contents of a random MRS data file.
+
+    Args:
+        random_state: A numpy RandomState.
+        n_points: Number of time-domain data points.
+
+    Returns:
+        String contents of the file.
+    """
+    decay = np.exp(-np.arange(n_points) / 200.0)
+    values = 1e7 * decay[:, np.newaxis] * (1 + 0.1 * random_state.randn(n_points, 2))
+    return MRS_HEADER + ''.join(
+        '  %14.6E %14.6E\n' % (real, imag) for real, imag in values)
+
+
+class LoadTest(object):
+    """Sends a mix of requests to the web application and records latencies."""
+
+    def __init__(self, mix, n_files=20):
+        """Creates a load test.
+
+        Args:
+            mix: Dictionary of relative request weights keyed by request type
+                ('upload', 'list', 'train' or 'classify').
+            n_files: Number of MRS data files to upload before the test.
+        """
+        self.mix = mix
+        self.n_files = n_files
+        self.latencies = collections.defaultdict(list)
+        self.errors = collections.defaultdict(int)
+        self._lock = threading.Lock()
+        self._random = np.random.RandomState(0)
+        self._data_ids = []
+        self._classifier_id = None
+
+    @staticmethod
+    def _send(path, post=None):
+        """Sends a request to the application.
+
+        Args:
+            path: Request path.
+            post: (optional) List of (name, value) form fields. File fields
+                have (file name, contents) tuples as values.
+
+        Returns:
+            The response.
+        """
+        if post is None:
+            request = webob.Request.blank(path)
+        else:
+            request = webob.Request.blank(
+                path, POST=post, content_type='multipart/form-data')
+        return request.get_response(server.APP)
+
+    def _new_file(self):
+        """Returns (file name, contents) of a new random MRS data file."""
+        with self._lock:
+            seed = self._random.randint(2 ** 31)
+        return ('scan%d' % seed, make_mrs_file(np.random.RandomState(seed)))
+
+    def upload(self):
+        """Uploads a new MRS data file."""
+        response = self._send('/data_upload', [
+            ('myfile', self._new_file()),
+            ('grouplabel', random.choice(['groupA', 'groupB']))])
+        match = re.search(r'Database ID: (\w+)', response.body)
+        if match:
+            with self._lock:
+                self._data_ids.append(match.group(1))
+        return response
+
+    def list(self):
+        """Lists all MRS data."""
+        return self._send('/data_download')
+
+    def train(self):
+        """Trains a SVM on the uploaded MRS data."""
+        with self._lock:
+            data_ids = list(self._data_ids)
+        return self._send('/train_classifier', [
+            ('load_classifier', 'false'),
+            ('classifier_type', 'SVM'),
+            ('svm_penalty_c', '1.0'),
+            ('apply_fft', 'on')] + [
+                ('training_data_ids', data_id) for data_id in data_ids])
+
+    def classify(self):
+        """Classifies a new MRS data file with the saved classifier."""
+        return self._send('/classify_data', [
+            ('classifier_id', self._classifier_id),
+            ('myfile', self._new_file())])
+
+    def setup(self):
+        """Uploads MRS data and saves a classifier for classify requests."""
+        for _ in range(self.n_files):
+            self.upload()
+        response = self.train()
+        self._classifier_id = re.search(
+            r'name="classifier_id" value="(\w+)"', response.body).group(1)
+        self._send('/save_classifier', [
+            ('classifier_id', self._classifier_id),
+            ('classifier_name', 'loadtest'),
+            ('classifier_type', 'SVM')])
+
+    def _worker(self, deadline, seed):
+        """Sends randomly chosen requests until the deadline."""
+        random_state = random.Random(seed)
+        request_types = []
+        for request_type, weight in self.mix.items():
+            request_types.extend([request_type] * weight)
+        while time.time() < deadline:
+            request_type = random_state.choice(request_types)
+            t_start = time.time()
+            try:
+                response = getattr(self, request_type)()
+                failed = response.status_int >= 400
+            except Exception:  # pylint:disable=broad-except
+                failed = True
+            latency = time.time() - t_start
+            with self._lock:
+                self.latencies[request_type].append(latency)
+                if failed:
+                    self.errors[request_type] += 1
+
+    def run(self, duration, n_threads):
+        """Runs the load test.
+
+        Args:
+            duration: Length of the test in seconds.
+            n_threads: Number of concurrent clients.
+
+        Returns:
+            Elapsed time in seconds.
+        """
+        deadline = time.time() + duration
+        threads = [threading.Thread(target=self._worker, args=(deadline, seed))
+                   for seed in range(n_threads)]
+        t_start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.time() - t_start
+
+    def report(self, elapsed):
+        """Formats throughput and latency percentiles for each route.
+
+        Args:
+            elapsed: Elapsed time of the test in seconds.
+
+        Returns:
+            Report as a string.
+        """
+        lines = ['%-10s %8s %7s %9s %9s %9s %9s' % (
+            'route', 'requests', 'errors', 'req/s', 'p50 (ms)', 'p95 (ms)', 'p99 (ms)')]
+        for request_type in sorted(self.latencies):
+            latencies = np.array(self.latencies[request_type]) * 1000.0
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+            lines.append('%-10s %8d %7d %9.1f %9.1f %9.1f %9.1f' % (
+                request_type, len(latencies), self.errors[request_type],
+                len(latencies) / elapsed, p50, p95, p99))
+        total = sum(len(latencies) for latencies in self.latencies.values())
+        lines.append('total: %d requests in %.1f s (%.1f req/s)' % (
+            total, elapsed, total / elapsed))
+        return '\n'.join(lines)
+
+
+def parse_mix(mix_string):
+    """Parses a request mix such as 'upload:2,list:2,train:1,classify:5'."""
+    mix = {}
+    for item in mix_string.split(','):
+        request_type, weight = item.split(':')
+        if request_type not in ('upload', 'list', 'train', 'classify'):
+            raise ValueError('Invalid request type: %s' % request_type)
+        mix[request_type] = int(weight)
+    return mix
+
+
+def main(argv):
+    """Runs the load test."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-duration', action="store", type=float, default=10.0)
+    parser.add_argument('-threads', action="store", type=int, default=8)
+    parser.add_argument('-files', action="store", type=int, default=20)
+    parser.add_argument('-mix', action="store", type=str,
+                        default='upload:2,list:2,train:1,classify:5')
+    parser.add_argument('-batch_predictions', action="store_true")
+    parser.add_argument('-batch_size', action="store", type=int, default=32)
+    parser.add_argument('-batch_latency_ms', action="store", type=float, default=5.0)
+    args = parser.parse_args(argv)
+
+    # Configure the server like server.main does.
+    server.PREDICTOR.enabled = args.batch_predictions
+    server.PREDICTOR.max_batch_size = args.batch_size
+    server.PREDICTOR.max_latency = args.batch_latency_ms / 1000.0
+
+    load_test = LoadTest(parse_mix(args.mix), n_files=args.files)
+    working_dir = os.getcwd()
+    temp_dir = tempfile.mkdtemp()
+    os.chdir(temp_dir)
+    try:
+        load_test.setup()
+        elapsed = load_test.run(args.duration, args.threads)
+    finally:
+        os.chdir(working_dir)
+        shutil.rmtree(temp_dir)
+    print load_test.report(elapsed)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
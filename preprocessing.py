@@ -0,0 +1,222 @@
+"""Vectorized preprocessing of batches of MRS data.
+
+Each stage operates on a 2-D array of shape (n_scans, n_points) and processes
+all scans at once. Stages are combined into a Pipeline, whose configuration
+is hashed so that its outputs can be cached and reused between training and
+classification.
+
+This module only depends on NumPy so that it can be used by exported
+classifiers.
+"""
+
+import collections
+import hashlib
+import json
+import threading
+
+import numpy as np
+
+
+class PhaseCorrection(object):
+    """Zero-order phase correction of time-domain data.
+
+    Each scan is rotated so that its first data point is real and positive.
+    """
+
+    name = 'PhaseCorrection'
+
+    def __call__(self, data):
+        phase = np.angle(data[:, :1])
+        return data * np.exp(-1j * phase).astype(data.dtype)
+
+    def get_params(self):
+        """Returns the parameters of this stage."""
+        return {}
+
+
+class Spectrum(object):
+    """Magnitude spectrum of zero-filled time-domain data.
+
+    With the default parameters this matches fourier_transformer.get_fft.
+    """
+
+    name = 'Spectrum'
+
+    def __init__(self, zero_fill=4, n_bins=40):
+        """Creates a spectrum stage.
+
+        Args:
+            zero_fill: Factor by which the data is zero-filled before the FFT.
+            n_bins: The spectrum is sampled every N / n_bins points, where N is
+                the zero-filled length.
+        """
+        self.zero_fill = zero_fill
+        self.n_bins = n_bins
+
+    def __call__(self, data):
+        n_fft = data.shape[1] * self.zero_fill
+        spectrum = np.fft.fft(data, n=n_fft, axis=1)
+        magnitude = 2.0 / n_fft * np.abs(spectrum[:, 0:n_fft // 2:n_fft // self.n_bins])
+        return magnitude.astype(data.real.dtype)
+
+    def get_params(self):
+        """Returns the parameters of this stage."""
+        return {'zero_fill': self.zero_fill, 'n_bins': self.n_bins}
+
+
+class BaselineRemoval(object):
+    """Subtracts a least-squares polynomial baseline from each scan."""
+
+    name = 'BaselineRemoval'
+
+    def __init__(self, order=1):
+        """Creates a baseline removal stage.
+
+        Args:
+            order: Order of the baseline polynomial.
+        """
+        self.order = order
+
+    def __call__(self, data):
+        # Fit all scans at once against a shared Vandermonde matrix.
+        x_axis = np.linspace(-1.0, 1.0, data.shape[1])
+        vandermonde = np.vander(x_axis, self.order + 1)
+        coefficients = np.linalg.lstsq(vandermonde, data.T, rcond=None)[0]
+        return data - vandermonde.dot(coefficients).T.astype(data.dtype)
+
+    def get_params(self):
+        """Returns the parameters of this stage."""
+        return {'order': self.order}
+
+
+class Normalization(object):
+    """Scales each scan to unit amplitude."""
+
+    name = 'Normalization'
+
+    def __init__(self, norm='l2'):
+        """Creates a normalization stage.
+
+        Args:
+            norm: 'l2' to scale to unit Euclidean norm, or 'max' to scale to
+                unit maximum absolute value.
+        """
+        if norm not in ('l2', 'max'):
+            raise ValueError('Invalid norm: %s' % norm)
+        self.norm = norm
+
+    def __call__(self, data):
+        if self.norm == 'l2':
+            scale = np.sqrt(np.sum(np.abs(data) ** 2, axis=1))
+        else:
+            scale = np.max(np.abs(data), axis=1)
+        scale[scale == 0] = 1
+        return data / scale[:, np.newaxis].astype(data.real.dtype)
+
+    def get_params(self):
+        """Returns the parameters of this stage."""
+        return {'norm': self.norm}
+
+
+# Stage classes keyed by name.
+STAGE_TYPES = dict(
+    (stage_class.name, stage_class)
+    for stage_class in (PhaseCorrection, Spectrum, BaselineRemoval, Normalization))
+
+
+class Pipeline(object):
+    """Sequence of preprocessing stages."""
+
+    def __init__(self, stages):
+        """Creates a pipeline.
+
+        Args:
+            stages: List of stages, applied in order.
+        """
+        self.stages = list(stages)
+
+    def __call__(self, data):
+        """Applies all stages to the given scans.
+
+        Args:
+            data: Array of shape (n_scans, n_points).
+
+        Returns:
+            Array of preprocessed scans.
+        """
+        for stage in self.stages:
+            data = stage(data)
+        return data
+
+    def get_config(self):
+        """Returns a JSON-serializable description of this pipeline."""
+        return [[stage.name, stage.get_params()] for stage in self.stages]
+
+    def key(self):
+        """Returns a hash identifying this pipeline's configuration."""
+        return hashlib.sha1(json.dumps(self.get_config(), sort_keys=True)).hexdigest()
+
+    @classmethod
+    def from_config(cls, config):
+        """Creates a pipeline from the output of get_config."""
+        return cls([STAGE_TYPES[name](**params) for name, params in config])
+
+
+def default_pipeline():
+    """Returns the default preprocessing pipeline.
+
+    Phase correction, magnitude spectrum, linear baseline removal and L2
+    normalization.
+    """
+    return Pipeline([PhaseCorrection(), Spectrum(), BaselineRemoval(), Normalization()])
+
+
+class FeatureCache(object):
+    """Least-recently-used cache of preprocessed scans.
+
+    Entries are keyed by pipeline configuration and scan content hash, so a
+    scan is preprocessed once per pipeline regardless of whether it is used
+    for training or classification.
+    """
+
+    def __init__(self, max_entries=10000):
+        """Creates an empty cache.
+
+        Args:
+            max_entries: Maximum number of preprocessed scans to keep.
+        """
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+
+    def apply(self, pipeline, data, content_hashes):
+        """Applies a pipeline to scans, reusing cached results.
+
+        Args:
+            pipeline: A Pipeline.
+            data: Array of shape (n_scans, n_points).
+            content_hashes: Content hash of each scan.
+
+        Returns:
+            Array of preprocessed scans.
+        """
+        pipeline_key = (pipeline.key(), data.dtype.str)
+        keys = [(pipeline_key, content_hash) for content_hash in content_hashes]
+        with self._lock:
+            rows = [self._entries.get(key) for key in keys]
+        # Preprocess all missing scans in one batch.
+        missing = [i for i, row in enumerate(rows) if row is None]
+        if missing:
+            processed = pipeline(data[missing])
+            with self._lock:
+                for i, row in zip(missing, processed):
+                    rows[i] = row
+                    self._entries[keys[i]] = row
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        # Mark cached entries as recently used.
+        with self._lock:
+            for key in keys:
+                if key in self._entries:
+                    self._entries[key] = self._entries.pop(key)
+        return np.array(rows)
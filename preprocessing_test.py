@@ -0,0 +1,92 @@
+"""Unit tests for the preprocessing module."""
+
+import dataparser
+import fourier_transformer
+import preprocessing
+import unittest
+
+import numpy as np
+
+
+class TestPreprocessing(unittest.TestCase):
+    """Tests the preprocessing module."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Get time-domain data of a MRS data file."""
+        mrs_data = str(open('data/05_E2', 'r').read())
+        cls.time_domain_data = dataparser.get_xy_array(mrs_data)
+
+    def setUp(self):
+        """Create random complex data."""
+        random = np.random.RandomState(0)
+        self.data = random.randn(4, 64) + 1j * random.randn(4, 64)
+
+    def test_phase_correction(self):
+        """First data point of each scan becomes real and positive."""
+        corrected = preprocessing.PhaseCorrection()(self.data)
+        np.testing.assert_allclose(np.zeros(4), corrected[:, 0].imag, atol=1e-12)
+        self.assertTrue(np.all(corrected[:, 0].real > 0))
+        np.testing.assert_allclose(np.abs(self.data), np.abs(corrected))
+
+    def test_spectrum(self):
+        """Spectrum stage matches fourier_transformer.get_fft."""
+        spectrum = preprocessing.Spectrum()(self.time_domain_data[np.newaxis, :])
+        np.testing.assert_allclose(
+            fourier_transformer.get_fft(self.time_domain_data), spectrum[0])
+
+    def test_baseline_removal(self):
+        """Linear trends are removed from each scan."""
+        trend = np.outer(np.arange(1, 5), np.linspace(0, 10, 64)) + 3
+        corrected = preprocessing.BaselineRemoval()(trend)
+        np.testing.assert_allclose(np.zeros(trend.shape), corrected, atol=1e-9)
+
+    def test_normalization(self):
+        """Scans are scaled to unit norm, leaving all-zero scans unchanged."""
+        data = np.vstack([np.abs(self.data), np.zeros(64)])
+        normalized = preprocessing.Normalization()(data)
+        np.testing.assert_allclose([1, 1, 1, 1, 0], np.linalg.norm(normalized, axis=1))
+        normalized = preprocessing.Normalization('max')(data)
+        np.testing.assert_allclose([1, 1, 1, 1, 0], normalized.max(axis=1))
+        self.assertRaises(ValueError, preprocessing.Normalization, 'l1')
+
+    def test_pipeline_config(self):
+        """Pipelines are recreated from their configuration and keyed by it."""
+        pipeline = preprocessing.default_pipeline()
+        restored = preprocessing.Pipeline.from_config(pipeline.get_config())
+        self.assertEqual(pipeline.key(), restored.key())
+        np.testing.assert_array_equal(pipeline(self.data), restored(self.data))
+
+        other = preprocessing.Pipeline([preprocessing.Spectrum(n_bins=32)])
+        self.assertNotEqual(pipeline.key(), other.key())
+        self.assertEqual((4, 16), other(self.data).shape)
+
+    def test_feature_cache(self):
+        """Cached scans are reused and least recently used scans evicted."""
+        calls = []
+
+        class CountingPipeline(preprocessing.Pipeline):
+            """Pipeline that records the number of scans it processes."""
+            def __call__(self, data):
+                calls.append(len(data))
+                return preprocessing.Pipeline.__call__(self, data)
+
+        pipeline = CountingPipeline([preprocessing.Normalization()])
+        cache = preprocessing.FeatureCache(max_entries=3)
+        first = cache.apply(pipeline, self.data[:2], ['a', 'b'])
+        second = cache.apply(pipeline, self.data[1:3], ['b', 'c'])
+        # Only the scan that was not cached is processed.
+        self.assertEqual([2, 1], calls)
+        np.testing.assert_array_equal(first[1], second[0])
+        np.testing.assert_allclose(pipeline(self.data[:3]),
+                                   cache.apply(pipeline, self.data[:3], ['a', 'b', 'c']))
+
+        # Adding a fourth scan evicts the least recently used one.
+        cache.apply(pipeline, self.data[3:], ['d'])
+        del calls[:]
+        cache.apply(pipeline, self.data[:1], ['a'])
+        self.assertEqual([1], calls)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,21 +1,31 @@
 """Backend server for Brain Tumor Classification."""
 
 import argparse
+import collections
 import jinja2
+import json
 import logging
 import numpy as np
 import os
 import paste.cascade as cascade
 import paste.httpserver as httpserver
 import paste.urlparser as urlparser
+import re
 import sys
+import threading
 import time
 import uuid
 import webapp2
 
+import batchpredictor
+import compiledmodels
+import datasetsnapshot
 import datastorage as ds
 import dataparser
+import ensemble
 import fourier_transformer
+import preprocessing
+import similarityindex
 import trainclassifier as trainer
 
 # pylint:disable=no-member
@@ -34,6 +44,244 @@ LOGGER = logging.getLogger(__name__)
 # NOTE: This global variable is not shared among app instances.
 CACHE = {}
 
+# Groups concurrent classification requests into batched predict calls.
+# Disabled unless enabled on the command line.
+PREDICTOR = batchpredictor.BatchPredictor(enabled=False)
+
+# Floating-point type of MRS features used for training and classification,
+# one of dataparser.FEATURE_DTYPES.
+FEATURE_DTYPE = np.float64
+
+# Applies ensembles of classifiers concurrently.
+ENSEMBLE = ensemble.Ensemble()
+
+# Cache of preprocessed MRS data, shared by training and classification.
+FEATURE_CACHE = preprocessing.FeatureCache()
+
+# Progress of recent neural network training jobs, keyed by job ID.
+TRAINING_JOBS = collections.OrderedDict()
+TRAINING_JOBS_LOCK = threading.Lock()
+MAX_TRAINING_JOBS = 100
+
+# Nearest-neighbor index over FFT features of all stored MRS data. It is built
+# from the database on first use and updated as MRS data is uploaded. Updates
+# made while the index is being built are queued and applied once it is done.
+SIMILARITY_INDEX = None
+SIMILARITY_INDEX_UPDATES = None
+SIMILARITY_INDEX_LOCK = threading.Lock()
+SIMILARITY_INDEX_BUILD_LOCK = threading.Lock()
+
+
+def get_fft_features(file_contents):
+    """Parses MRS data file contents and applies FFT.
+
+    Args:
+        file_contents: MRS data file's string contents.
+
+    Returns:
+        Frequency-domain MRS data used as classifier input.
+    """
+    xy_data = dataparser.get_xy_array(file_contents, dtype=FEATURE_DTYPE)
+    return fourier_transformer.get_fft(xy_data, dtype=FEATURE_DTYPE)
+
+
+def get_classifier_input(classifier, file_contents):
+    """Transforms MRS data file contents for input to the given classifier.
+
+    Classifiers trained on preprocessed MRS data are given the output of their
+    preprocessing pipeline. Other classifiers are given FFT features.
+
+    Args:
+        classifier: A trained classifier.
+        file_contents: MRS data file's string contents.
+
+    Returns:
+        Tuple containing (classifier to apply, classifier input). If the given
+        classifier includes a preprocessing pipeline, the classifier to apply
+        is the one that it wraps.
+    """
+    if isinstance(classifier, compiledmodels.PreprocessedClassifier):
+        time_domain_data = dataparser.get_xy_array(file_contents, dtype=FEATURE_DTYPE)
+        features = FEATURE_CACHE.apply(
+            classifier.pipeline, time_domain_data[np.newaxis, :],
+            [ds.compute_content_hash(file_contents)])[0]
+        return (classifier.classifier, features)
+    return (classifier, get_fft_features(file_contents))
+
+
+def load_classifier_for_inference(conn, classifier_id):
+    """Fetches a classifier for classifying MRS data.
+
+    Args:
+        conn: A database Connection object.
+        classifier_id: ID of the classifier.
+
+    Returns:
+        The classifier's NumPy-only export if there is one, since it loads
+        much faster, and otherwise the original classifier.
+    """
+    classifier = ds.fetch_compiled_classifier(conn, classifier_id)
+    if classifier is None:
+        classifier = ds.fetch_classifier(conn, classifier_id)[3]
+    return classifier
+
+
+def get_ensemble_inputs(classifiers, file_contents):
+    """Transforms MRS data file contents for input to several classifiers.
+
+    FFT features are computed at most once, and preprocessed features once per
+    preprocessing pipeline.
+
+    Args:
+        classifiers: List of trained classifiers.
+        file_contents: MRS data file's string contents.
+
+    Returns:
+        List of (classifier to apply, classifier input) tuples, as returned by
+        get_classifier_input, ordered like classifiers.
+    """
+    fft_features = None
+    inputs = []
+    for classifier in classifiers:
+        if isinstance(classifier, compiledmodels.PreprocessedClassifier):
+            # Preprocessed features are cached per pipeline.
+            inputs.append(get_classifier_input(classifier, file_contents))
+            continue
+        if fft_features is None:
+            fft_features = get_fft_features(file_contents)
+        inputs.append((classifier, fft_features))
+    return inputs
+
+
+def register_training_job(job_id, monitor):
+    """Makes the progress of a training job available by its ID.
+
+    Args:
+        job_id: Unique identifier for the training job.
+        monitor: trainclassifier.TrainingMonitor of the job.
+    """
+    with TRAINING_JOBS_LOCK:
+        TRAINING_JOBS[job_id] = monitor
+        # Forget the oldest jobs.
+        while len(TRAINING_JOBS) > MAX_TRAINING_JOBS:
+            TRAINING_JOBS.popitem(last=False)
+
+
+def get_pipeline_key(pipeline):
+    """Returns the key of a preprocessing pipeline, or None for no pipeline."""
+    return None if pipeline is None else pipeline.key()
+
+
+def parse_header_filter(header_filter):
+    """Parses header predicates such as "HZPPPM>60; FMTDAT=(2e15.6)".
+
+    Args:
+        header_filter: Semicolon-separated predicates, each consisting of a
+            header field name, a comparison operator and a value.
+
+    Returns:
+        List of (field name, operator, value) tuples.
+
+    Raises:
+        ValueError if a predicate cannot be parsed.
+    """
+    predicates = []
+    for predicate in header_filter.split(';'):
+        if not predicate.strip():
+            continue
+        match_obj = re.match(r'\s*(\w+)\s*(<=|>=|!=|=|<|>)\s*(.*?)\s*$', predicate)
+        if match_obj is None:
+            raise ValueError('Invalid header predicate: %s' % predicate)
+        predicates.append(match_obj.groups())
+    return predicates
+
+
+def index_header_data():
+    """Stores header fields of MRS data uploaded before headers were indexed.
+
+    If MRS data is sharded, the shards are indexed concurrently in worker
+    processes.
+
+    Returns:
+        Number of MRS data entries whose header fields were stored.
+    """
+    return sum(ds.map_shards(_index_shard_header_data))
+
+
+def _index_shard_header_data(db_filename):
+    """Stores header fields of unindexed MRS data in one database file.
+
+    Args:
+        db_filename: Path to the SQLite database file or shard.
+
+    Returns:
+        Number of MRS data entries whose header fields were stored.
+    """
+    conn = ds.create_sqlite_connection(db_filename, n_shards=1)
+    entries = ds.fetch_mrs_data_without_headers(conn)
+    for entry in entries:
+        ds.store_header_data(
+            conn, entry[0], dataparser.get_header_data(str(entry[2])))
+    conn.close()
+    return len(entries)
+
+
+def get_similarity_index():
+    """Returns the similarity index, building it if necessary.
+
+    The index is built without holding SIMILARITY_INDEX_LOCK, so uploads are
+    not blocked by the build. Their updates are applied before the new index
+    is swapped in.
+    """
+    global SIMILARITY_INDEX, SIMILARITY_INDEX_UPDATES  # pylint:disable=global-statement
+    if SIMILARITY_INDEX is not None:
+        return SIMILARITY_INDEX
+    with SIMILARITY_INDEX_BUILD_LOCK:
+        if SIMILARITY_INDEX is not None:
+            return SIMILARITY_INDEX
+        with SIMILARITY_INDEX_LOCK:
+            SIMILARITY_INDEX_UPDATES = []
+        LOGGER.debug('Building similarity index...')
+        index = similarityindex.SimilarityIndex(dtype=FEATURE_DTYPE)
+        try:
+            for entry in ds.fetch_all_mrs_data(ds.create_sqlite_connection()):
+                _add_to_similarity_index(index, entry[0], str(entry[2]), entry[3])
+        except:  # pylint:disable=bare-except
+            # Stop queueing updates for an index that will not be built.
+            with SIMILARITY_INDEX_LOCK:
+                SIMILARITY_INDEX_UPDATES = None
+            raise
+        with SIMILARITY_INDEX_LOCK:
+            # Adding MRS data that is already indexed only updates its label,
+            # so updates of MRS data that the build has read are harmless.
+            for update in SIMILARITY_INDEX_UPDATES:
+                update(index)
+            SIMILARITY_INDEX_UPDATES = None
+            SIMILARITY_INDEX = index
+        LOGGER.debug('Similarity index contains %d entries.', len(index))
+        return index
+
+
+def update_similarity_index(update):
+    """Applies an update to the similarity index if it has been built.
+
+    Args:
+        update: Function that takes the similarity index and updates it.
+    """
+    with SIMILARITY_INDEX_LOCK:
+        if SIMILARITY_INDEX is not None:
+            update(SIMILARITY_INDEX)
+        elif SIMILARITY_INDEX_UPDATES is not None:
+            SIMILARITY_INDEX_UPDATES.append(update)
+
+
+def _add_to_similarity_index(index, entry_id, file_contents, group_label):
+    """Featurizes and indexes MRS data, skipping malformed or incompatible data."""
+    try:
+        index.add(entry_id, get_fft_features(file_contents), group_label)
+    except ValueError as error:
+        LOGGER.warning('MRS data %s not indexed: %s', entry_id, error)
+
 
 class Homepage(webapp2.RequestHandler):
     """Handler for website's home page."""
@@ -71,17 +319,34 @@ class MRSDataUploader(webapp2.RequestHandler):
         # Generate a random UUID for the file.
         database_id = str(uuid.uuid4().hex)
 
+        # Whether a duplicate upload should relabel the existing data.
+        update_label = 'update_label' in self.request.POST
+
         # Save MRS data to the database.
         conn = ds.create_sqlite_connection()
         LOGGER.debug('Saving MRS data to database...')
-        ds.store_mrs_data(conn, database_id, file_name, file_contents, group_label)
-        LOGGER.debug('MRS data saved to database.')
+        database_id, is_duplicate = ds.store_mrs_data(
+            conn, database_id, file_name, file_contents, group_label,
+            update_label=update_label)
+        LOGGER.debug('MRS data saved to database: duplicate=%s.', is_duplicate)
+        # Index header fields of new MRS data for queries.
+        if not is_duplicate:
+            ds.store_header_data(
+                conn, database_id, dataparser.get_header_data(str(file_contents)))
+        # Keep the similarity index up to date, if it has been built.
+        if not is_duplicate:
+            update_similarity_index(lambda index: _add_to_similarity_index(
+                index, database_id, str(file_contents), group_label))
+        elif update_label:
+            update_similarity_index(
+                lambda index: index.set_label(database_id, group_label))
         # Signal upload success to the user.
         template = JINJA_ENVIRONMENT.get_template('uploadcomplete.html')
         self.response.write(template.render(
             file_name=file_name,
             group_label=group_label,
-            database_id=database_id))
+            database_id=database_id,
+            is_duplicate=is_duplicate))
 
 
 class MRSDataDownloader(webapp2.RequestHandler):
@@ -137,6 +402,12 @@ class ClassifierUploader(webapp2.RequestHandler):
         conn = ds.create_sqlite_connection()
         ds.store_classifier(
             conn, classifier_id, classifier_name, classifier_type, classifier)
+        # Save a NumPy-only copy of the classifier for fast inference.
+        try:
+            ds.store_compiled_classifier(
+                conn, classifier_id, trainer.export_for_inference(classifier))
+        except ValueError as error:
+            LOGGER.debug('Classifier not exported for inference: %s', error)
 
         # Signal save success to user.
         template = JINJA_ENVIRONMENT.get_template('classifiersaved.html')
@@ -151,32 +422,92 @@ class ClassifierTrainer(webapp2.RequestHandler):
         # Get list of saved classifiers.
         conn = ds.create_sqlite_connection()
         classifiers = ds.fetch_all_classifiers(conn)
-        # Get list of available MRS data.
-        mrs_data = ds.fetch_all_mrs_data(conn)
+        # Get list of available MRS data, filtered by header fields and group
+        # label if specified by the user.
+        header_filter = self.request.get('header_filter')
+        group_label = self.request.get('group_label')
+        if header_filter or group_label:
+            try:
+                header_predicates = parse_header_filter(header_filter)
+            except ValueError as error:
+                self.abort(400, detail=str(error))
+            mrs_data = ds.select_mrs_data(
+                conn, header_predicates, group_label or None)
+        else:
+            mrs_data = ds.fetch_all_mrs_data(conn)
+        # Get list of saved training data snapshots.
+        snapshots = datasetsnapshot.list_snapshots()
 
         # Render the web page.
         template = JINJA_ENVIRONMENT.get_template('trainclassifier.html')
         self.response.write(template.render(
-            classifiers=classifiers, mrs_data=mrs_data))
+            classifiers=classifiers, mrs_data=mrs_data, snapshots=snapshots,
+            header_filter=header_filter, group_label=group_label))
 
     def post(self):
         """Trains a classifier as specified by the user."""
         # Load a saved classifier if specified by the user.
         classifier, classifier_name, classifier_type = self.load_specified_classifier() #pylint:disable=line-too-long
 
+        # Preprocess the MRS data if specified by the user. A loaded classifier
+        # must be trained further with the pipeline it was trained with.
+        pipeline = None
+        if 'apply_preprocessing' in self.request.POST:
+            pipeline = preprocessing.default_pipeline()
+        if isinstance(classifier, compiledmodels.PreprocessedClassifier):
+            classifier_pipeline = classifier.pipeline
+            classifier = classifier.classifier
+        else:
+            classifier_pipeline = None
+        if (classifier is not None and
+                get_pipeline_key(pipeline) != get_pipeline_key(classifier_pipeline)):
+            self.abort(400, detail='Preprocessing setting does not match the loaded classifier.')
+
+        # Check the requested number of PCA components before preparing data.
+        n_components = self.get_n_components()
+
         # Prepare MRS data set.
-        samples = self.prepare_mrs_data_set()
+        samples, snapshot_key = self.prepare_mrs_data_set(pipeline)
 
         LOGGER.debug(
             'TrainClassifier: type=%s, load_classifier=%s, num_samples=%d',
             classifier_type, (classifier != None), len(samples[0]))
 
+        # Reduce the dimensions of the data set if specified by the user.
+        # A loaded classifier keeps the projection it was trained with.
+        # Cached kernel matrices are keyed by the projected data set.
+        projection = None
+        data_set_key = snapshot_key
+        if isinstance(classifier, compiledmodels.ReducedClassifier):
+            projection = classifier.projection
+            classifier = classifier.classifier
+            data_set_key = None
+        elif n_components is not None:
+            projection = self.get_reduction(snapshot_key, samples[0], n_components)
+            data_set_key = '%s.pca%d' % (snapshot_key, n_components)
+        training_samples = samples
+        if projection is not None:
+            training_samples = (projection.transform(samples[0]), samples[1])
+
+        # Neural network training progress can be followed by job ID.
+        monitor = None
+        if classifier_type == "NeuralNetwork":
+            monitor = self.create_training_monitor(data_set_key)
+
         # Train the classifier.
         trained_classifier, training_time = self.train_classifier(
-            classifier_type, classifier, samples)
+            classifier_type, classifier, training_samples, data_set_key, monitor)
+        # Store the projection together with the classifier.
+        if projection is not None:
+            trained_classifier = compiledmodels.ReducedClassifier(
+                projection, trained_classifier)
 
         #TODO: Add test classifier option?
         training_accuracy = trained_classifier.score(samples[0], samples[1])
+        # Store the preprocessing pipeline together with the classifier.
+        if pipeline is not None:
+            trained_classifier = compiledmodels.PreprocessedClassifier(
+                pipeline, trained_classifier)
 
         # Cache the trained classifier.
         classifier_id = str(uuid.uuid4().hex)
@@ -189,7 +520,41 @@ class ClassifierTrainer(webapp2.RequestHandler):
             classifier_name=classifier_name,
             classifier_type=classifier_type,
             training_accuracy=training_accuracy,
-            training_time=training_time))
+            training_time=training_time,
+            training_status=monitor.get_status() if monitor else None))
+
+    def create_training_monitor(self, data_set_key):
+        """Creates a monitor for neural network training and registers it.
+
+        The job ID is chosen by the client so that it can poll the training
+        status while the request is running. Checkpoints are keyed by the data
+        set, loaded classifier and training parameters, so repeating an
+        interrupted request resumes training.
+
+        Args:
+            data_set_key: Snapshot key identifying the training samples, or
+                None if checkpointing is not possible.
+
+        Returns:
+            A trainclassifier.TrainingMonitor.
+        """
+        checkpoint_path = None
+        if data_set_key is not None:
+            loaded_classifier_id = None
+            if self.request.POST.get('load_classifier') == 'true':
+                loaded_classifier_id = self.request.POST.get('classifier_id')
+            checkpoint_path = trainer.get_checkpoint_path({
+                'data_set_key': data_set_key,
+                'classifier_id': loaded_classifier_id,
+                'learning_rate': self.request.POST['learning_rate'],
+                'n_iter': self.request.POST['n_iter'],
+                'validation_size': self.request.POST.get('validation_size', '0'),
+                'patience': self.request.POST.get('patience', '0')})
+        monitor = trainer.TrainingMonitor(
+            patience=int(self.request.POST.get('patience') or 0) or None,
+            checkpoint_path=checkpoint_path)
+        register_training_job(self.request.POST.get('job_id') or uuid.uuid4().hex, monitor)
+        return monitor
 
     def load_specified_classifier(self):
         """Loads the user-specified classifier.
@@ -213,29 +578,186 @@ class ClassifierTrainer(webapp2.RequestHandler):
             classifier_name = db_entry[1]
         return (classifier, classifier_name, classifier_type)
 
-    def prepare_mrs_data_set(self):
+    def prepare_mrs_data_set(self, pipeline=None):
         """Retrieves all specified MRS data entries and processes each entry.
 
-        Each MRS file is parsed and FFT is applied if specified.
+        Each MRS file is parsed and then either preprocessed or, if specified,
+        FFT is applied. The processed data set is saved as a snapshot keyed by
+        the selected IDs and feature configuration, and repeat requests load
+        the snapshot instead. The user may also select a saved snapshot
+        directly.
+
+        Args:
+            pipeline: (optional) preprocessing.Pipeline to apply. A selected
+                snapshot must have been preprocessed with the same pipeline.
+
+        Returns:
+            Tuple containing ((sample inputs, sample outputs), snapshot key).
+        """
+        # Load the snapshot selected by the user, if any.
+        key = self.request.POST.get('snapshot_key', '')
+        if key:
+            samples = None
+            if datasetsnapshot.is_valid_key(key):
+                samples = datasetsnapshot.load_snapshot(key)
+            if samples is None:
+                self.abort(400, detail='No snapshot with key %s' % key)
+            pipeline_config = datasetsnapshot.load_snapshot_config(key).get('preprocessing')
+            snapshot_pipeline = None
+            if pipeline_config is not None:
+                snapshot_pipeline = preprocessing.Pipeline.from_config(pipeline_config)
+            if get_pipeline_key(pipeline) != get_pipeline_key(snapshot_pipeline):
+                self.abort(400, detail='Preprocessing setting does not match the snapshot.')
+            return (samples, key)
+
+        # Drop repeated IDs so that each scan is featurized only once.
+        training_data_ids = []
+        seen_ids = set()
+        for data_id in self.request.get_all("training_data_ids"):
+            if data_id not in seen_ids:
+                seen_ids.add(data_id)
+                training_data_ids.append(data_id)
+        apply_fft = 'apply_fft' in self.request.POST and pipeline is None
+        LOGGER.debug('Processing MRS data: apply_fft=%s, preprocessing=%s',
+                     apply_fft, pipeline is not None)
+
+        # Reuse the snapshot of a previous identical request, if any.
+        config = {'apply_fft': apply_fft, 'dtype': np.dtype(FEATURE_DTYPE).name}
+        if pipeline is not None:
+            config['preprocessing'] = pipeline.get_config()
+        # The key covers the current labels and contents of the MRS data, so
+        # relabelled MRS data is not trained on with its old label.
+        data_versions = ds.fetch_mrs_data_versions(
+            ds.create_sqlite_connection(), training_data_ids)
+        key = datasetsnapshot.snapshot_key(training_data_ids, config, data_versions)
+        samples = datasetsnapshot.load_snapshot(key)
+        if samples is not None:
+            LOGGER.debug('Loaded MRS data set from snapshot %s.', key)
+            return (samples, key)
+
+        samples = self.build_mrs_data_set(training_data_ids, apply_fft, pipeline)
+        datasetsnapshot.save_snapshot(
+            key, training_data_ids, config, samples[0], samples[1],
+            name=self.request.POST.get('snapshot_name') or None)
+        return (samples, key)
+
+    def get_n_components(self):
+        """Parses the user-specified number of PCA components.
+
+        Returns:
+            The number of components, or None if no reduction was requested.
+        """
+        value = self.request.POST.get('n_components', '').strip()
+        if not value:
+            return None
+        try:
+            n_components = int(value)
+        except ValueError:
+            n_components = 0
+        if n_components < 1:
+            self.abort(400, detail='Invalid number of PCA components: %s' % value)
+        return n_components
+
+    def get_svm_penalties(self):
+        """Parses the user-specified comma-separated values of the SVM penalty C.
 
         Returns:
-            Tuple containing (list of sample inputs, list of sample outputs).
+            List of values of C. Empty items are ignored, and C is 1 if no
+            value is given.
+        """
+        value = self.request.POST.get('svm_penalty_c', '')
+        C_values = []  # pylint:disable=invalid-name
+        for item in value.split(','):
+            if not item.strip():
+                continue
+            try:
+                C = float(item)  # pylint:disable=invalid-name
+            except ValueError:
+                C = float('nan')  # pylint:disable=invalid-name
+            if not np.isfinite(C) or C <= 0:
+                self.abort(400, detail='Invalid SVM penalty C: %s' % item.strip())
+            C_values.append(C)
+        return C_values or [1.0]
+
+    @staticmethod
+    def get_reduction(snapshot_key, sample_inputs, n_components):
+        """Gets a PCA projection for the given data set.
+
+        Projections are fitted once per data set snapshot and cached.
+
+        Args:
+            snapshot_key: Key of the data set's snapshot.
+            sample_inputs: Array of sample inputs.
+            n_components: Number of components to keep.
+
+        Returns:
+            A compiledmodels.LinearProjection.
+        """
+        projection = datasetsnapshot.load_reduction(snapshot_key, n_components)
+        if projection is None:
+            LOGGER.debug('Fitting PCA with %d components...', n_components)
+            projection = trainer.fit_reduction(sample_inputs, n_components)
+            datasetsnapshot.save_reduction(snapshot_key, n_components, projection)
+        return projection
+
+    @staticmethod
+    def get_gram(data_set_key, sample_inputs, gamma):
+        """Gets the RBF kernel matrix of the given data set.
+
+        Kernel matrices are computed once per data set and gamma and cached.
+
+        Args:
+            data_set_key: Key identifying the data set, or None to skip caching.
+            sample_inputs: Array of sample inputs.
+            gamma: RBF kernel coefficient.
+
+        Returns:
+            The kernel matrix of the sample inputs.
+        """
+        gram = None
+        if data_set_key is not None:
+            gram = datasetsnapshot.load_gram(data_set_key, gamma)
+        if gram is None:
+            LOGGER.debug('Computing RBF kernel matrix...')
+            gram = trainer.compute_rbf_kernel(sample_inputs, sample_inputs, gamma)
+            if data_set_key is not None:
+                datasetsnapshot.save_gram(data_set_key, gamma, gram)
+        return gram
+
+    @staticmethod
+    def build_mrs_data_set(training_data_ids, apply_fft, pipeline=None):
+        """Retrieves the given MRS data entries and processes each entry.
+
+        Args:
+            training_data_ids: IDs of the MRS data to process.
+            apply_fft: Whether to apply FFT to the MRS data.
+            pipeline: (optional) preprocessing.Pipeline to apply to the MRS
+                data, in which case apply_fft is ignored.
+
+        Returns:
+            Tuple containing (array of sample inputs, array of sample outputs).
         """
-        training_data_ids = self.request.get_all("training_data_ids")
-        apply_fft = 'apply_fft' in self.request.POST
-        LOGGER.debug('Processing MRS data: apply_fft=%s', apply_fft)
         # Retrieve specified training data from the database.
         conn = ds.create_sqlite_connection()
         db_entries = [ds.fetch_mrs_data(conn, data_id) for data_id in training_data_ids]
+        if pipeline is not None:
+            # Preprocess all MRS data as one batch, reusing cached results.
+            time_domain_data = np.array([
+                dataparser.get_xy_array(str(entry[2]), dtype=FEATURE_DTYPE)
+                for entry in db_entries])
+            sample_inputs = FEATURE_CACHE.apply(
+                pipeline, time_domain_data, [entry[4] for entry in db_entries])
+            return (sample_inputs, np.array([entry[3] for entry in db_entries]))
+
         # Separate each database entry into input and output.
         sample_inputs = []
         sample_outputs = []
         for entry in db_entries:
             # Parse data points from the file contents.
-            mrs_data = dataparser.get_xy_data(str(entry[2]))
+            mrs_data = dataparser.get_xy_array(str(entry[2]), dtype=FEATURE_DTYPE)
             # Apply FFT to the data points if specified by user.
             if apply_fft:
-                mrs_data = fourier_transformer.get_fft(mrs_data)
+                mrs_data = fourier_transformer.get_fft(mrs_data, dtype=FEATURE_DTYPE)
             # Add input, output pair to separate lists.
             sample_inputs.append(mrs_data)
             sample_outputs.append(entry[3])
@@ -245,20 +767,25 @@ class ClassifierTrainer(webapp2.RequestHandler):
         n_features = len(sample_inputs[0])
         sample_inputs = np.array(sample_inputs)  # convert before using as buffer
         sample_inputs = np.ndarray(
-            shape=(n_samples, n_features), dtype=float, buffer=sample_inputs)
+            shape=(n_samples, n_features), dtype=FEATURE_DTYPE, buffer=sample_inputs)
         # Labels for training.
         sample_outputs = np.array(sample_outputs)
 
         # Return processed MRS data.
         return (sample_inputs, sample_outputs)
 
-    def train_classifier(self, classifier_type, classifier, samples):
+    def train_classifier(self, classifier_type, classifier, samples, data_set_key=None,
+                         monitor=None):
         """Trains specified classifier with given arguments and data.
 
         Args:
             classifier_type: The type of classifier to train.
             classifier: (optional) Classifier model to train.
             samples: Tuple of (sample inputs, sample outputs).
+            data_set_key: (optional) Snapshot key identifying the samples,
+                used to cache SVM kernel matrices.
+            monitor: (optional) trainclassifier.TrainingMonitor recording
+                neural network training progress.
 
         Returns:
             Tuples containing (trained classifier, training time in seconds).
@@ -272,10 +799,21 @@ class ClassifierTrainer(webapp2.RequestHandler):
             trained_classifier = trainer.train_neural_network(
                 samples, nn=classifier,
                 learning_rate=float(self.request.POST['learning_rate']),
-                n_iter=int(self.request.POST['n_iter']))
+                n_iter=int(self.request.POST['n_iter']),
+                validation_size=float(self.request.POST.get('validation_size') or 0),
+                monitor=monitor)
         elif classifier_type == "SVM":
-            # Train a SVM classifier.
-            trained_classifier = trainer.train_svm(samples)
+            # Train a SVM classifier. Several comma-separated values of C are
+            # compared by cross-validation on a shared kernel matrix.
+            C_values = self.get_svm_penalties()  # pylint:disable=invalid-name
+            if len(C_values) == 1:
+                trained_classifier = trainer.train_svm(samples, C=C_values[0])
+            else:
+                gamma = 1.0 / samples[0].shape[1]
+                gram = self.get_gram(data_set_key, samples[0], gamma)
+                trained_classifier, scores = trainer.sweep_svm(
+                    samples, C_values, gamma, gram=gram)
+                LOGGER.debug('SVM cross-validation accuracy by C: %s', scores)
         else:
             raise Exception("Invalid classifier type: %s" % classifier_type)
 
@@ -299,25 +837,117 @@ class DataClassifier(webapp2.RequestHandler):
         self.response.write(template.render(classifiers=classifiers))
 
     def post(self):
-        """Classifies given data using specified classifier."""
-        # Retrieve specified classifier from database.
-        classifier_id = self.request.POST['classifier_id']
-        conn = ds.create_sqlite_connection()
-        db_entry = ds.fetch_classifier(conn, classifier_id)
-        classifier = db_entry[3]
-        # Transform given MRS data for classifier input.
+        """Classifies given data using specified classifier.
+
+        If several classifiers are specified, the data is classified by each
+        of them concurrently and their predictions are combined.
+        """
+        classifier_ids = self.request.POST.getall('classifier_id')
         file_name = self.request.POST['myfile'].filename
         raw_data = self.request.POST['myfile'].file.read()
-        d = dataparser.get_xy_data(raw_data)
-        fftd = fourier_transformer.get_fft(d)
+        conn = ds.create_sqlite_connection()
+        if len(classifier_ids) > 1:
+            self.classify_with_ensemble(conn, classifier_ids, file_name, raw_data)
+            return
+
+        # Retrieve specified classifier from database.
+        classifier_id = classifier_ids[0]
+        classifier = load_classifier_for_inference(conn, classifier_id)
+        # Transform given MRS data for classifier input.
+        classifier, features = get_classifier_input(classifier, raw_data)
         # Classify the transformed MRS data.
-        test_input = np.array([fftd])
-        classification = classifier.predict(test_input)
+        classification = PREDICTOR.predict(classifier_id, classifier, features)
         # Show classification results.
         template = JINJA_ENVIRONMENT.get_template('classificationresults.html')
         self.response.write(template.render(
             classification=classification, file_name=file_name))
 
+    def classify_with_ensemble(self, conn, classifier_ids, file_name, raw_data):
+        """Classifies given data using an ensemble of classifiers.
+
+        Args:
+            conn: A database Connection object.
+            classifier_ids: IDs of the classifiers in the ensemble.
+            file_name: Name of the MRS data file.
+            raw_data: MRS data file's string contents.
+        """
+        method = self.request.POST.get('combine_method', 'vote')
+        if method not in ensemble.COMBINE_METHODS:
+            self.abort(400, detail='Invalid combine method: %s' % method)
+
+        # Featurize the MRS data once for all classifiers that share features.
+        classifiers = [load_classifier_for_inference(conn, classifier_id)
+                       for classifier_id in classifier_ids]
+        members = [(classifier_id,) + classifier_input for classifier_id, classifier_input
+                   in zip(classifier_ids, get_ensemble_inputs(classifiers, raw_data))]
+
+        # Classify the MRS data with all classifiers concurrently.
+        t_start = time.time()
+        classification, results = ENSEMBLE.classify(members, method)
+        latency = time.time() - t_start
+        LOGGER.debug('Ensemble of %d classifiers took %.1f ms.',
+                     len(members), latency * 1000.0)
+
+        # Show classification results.
+        template = JINJA_ENVIRONMENT.get_template('classificationresults.html')
+        self.response.write(template.render(
+            classification=classification, file_name=file_name,
+            member_results=results, combine_method=method, latency=latency))
+
+
+class TrainingStatus(webapp2.RequestHandler):
+    """Handler for the progress of neural network training jobs."""
+
+    def get(self):
+        """Writes the status of the training job with given ID as JSON."""
+        job_id = self.request.get('job_id')
+        with TRAINING_JOBS_LOCK:
+            monitor = TRAINING_JOBS.get(job_id)
+        if monitor is None:
+            self.abort(404, detail='No training job with ID %s' % job_id)
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(monitor.get_status()))
+
+
+class SimilarScanFinder(webapp2.RequestHandler):
+    """Handler for finding stored MRS data similar to a given scan."""
+
+    def get(self):
+        """Finds MRS data similar to the stored MRS data with given ID."""
+        mrs_data_id = self.request.get('mrs_data_id')
+        features = get_similarity_index().get_vector(mrs_data_id)
+        if features is None:
+            self.abort(404, detail='No indexed MRS data with ID %s' % mrs_data_id)
+        self.write_neighbors(features)
+
+    def post(self):
+        """Finds MRS data similar to the uploaded MRS data file."""
+        raw_data = self.request.POST['myfile'].file.read()
+        try:
+            features = get_fft_features(raw_data)
+        except ValueError as error:
+            self.abort(400, detail='Invalid MRS data file: %s' % error)
+        self.write_neighbors(features)
+
+    def write_neighbors(self, features):
+        """Writes the nearest neighbors of given features as JSON.
+
+        Args:
+            features: Frequency-domain MRS data.
+        """
+        try:
+            k = int(self.request.get('k', 20))
+        except ValueError:
+            self.abort(400, detail='Invalid number of neighbors: %s' % self.request.get('k'))
+        try:
+            neighbors = get_similarity_index().query(features, k)
+        except ValueError as error:
+            self.abort(400, detail=str(error))
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps({'neighbors': [
+            {'id': entry_id, 'distance': distance, 'group_label': group_label}
+            for entry_id, distance, group_label in neighbors]}))
+
 
 WEB_APP = webapp2.WSGIApplication([
     ('/', Homepage),
@@ -326,7 +956,9 @@ WEB_APP = webapp2.WSGIApplication([
     ('/data_manager', MRSDataManager),
     ('/data_upload', MRSDataUploader),
     ('/save_classifier', ClassifierUploader),
+    ('/similar_scans', SimilarScanFinder),
     ('/train_classifier', ClassifierTrainer),
+    ('/training_status', TrainingStatus),
 ], debug=True)
 
 # Static file server.
@@ -342,8 +974,30 @@ def main(argv):
     parser = argparse.ArgumentParser()
     parser.add_argument('-loglevel', action="store", type=str, default='INFO')
     parser.add_argument('-port', action="store", type=str, default='8080')
+    parser.add_argument('-batch_predictions', action="store_true")
+    parser.add_argument('-batch_size', action="store", type=int, default=32)
+    parser.add_argument('-batch_latency_ms', action="store", type=float, default=5.0)
+    parser.add_argument('-remove_duplicate_mrs_data', action="store_true")
+    parser.add_argument('-shards', action="store", type=int, default=1)
+    parser.add_argument('-shard_key', action="store", type=str, default='id',
+                        choices=ds.SHARD_KEYS)
+    parser.add_argument('-ensemble_workers', action="store", type=int, default=4)
+    parser.add_argument('-feature_dtype', action="store", type=str, default='float64',
+                        choices=sorted(dataparser.FEATURE_DTYPES))
     args = parser.parse_args(argv)
 
+    # Configure batching of classification requests.
+    PREDICTOR.enabled = args.batch_predictions
+    PREDICTOR.max_batch_size = args.batch_size
+    PREDICTOR.max_latency = args.batch_latency_ms / 1000.0
+
+    # Configure concurrency of ensemble classification.
+    ENSEMBLE.max_workers = args.ensemble_workers
+
+    # Configure precision of MRS features.
+    global FEATURE_DTYPE  # pylint:disable=global-statement
+    FEATURE_DTYPE = dataparser.FEATURE_DTYPES[args.feature_dtype]
+
     # Set logging level.
     numeric_level = getattr(logging, args.loglevel.upper(), None)
     if not isinstance(numeric_level, int):
@@ -358,6 +1012,37 @@ def main(argv):
     handler.setFormatter(formatter)
     LOGGER.addHandler(handler)
 
+    # Add content hashes to MRS data stored before deduplication.
+    conn = ds.create_sqlite_connection(n_shards=1)
+    n_duplicates = ds.upgrade_brainscans_table(conn)
+    # Duplicates stored before deduplication are only removed on request.
+    if n_duplicates and args.remove_duplicate_mrs_data:
+        removed_ids = ds.remove_duplicate_mrs_data(conn)
+        LOGGER.info('Removed %d duplicate MRS data entries: %s',
+                    len(removed_ids), ', '.join(removed_ids))
+    elif n_duplicates:
+        LOGGER.warning('Found %d duplicate MRS data entries. Restart with '
+                       '-remove_duplicate_mrs_data to remove them.', n_duplicates)
+    conn.close()
+
+    # Shard MRS data across several database files if specified, moving any
+    # MRS data already stored in the main database file into the shards.
+    ds.SHARD_COUNT = args.shards
+    ds.SHARD_KEY = args.shard_key
+    if args.shards > 1:
+        conn = ds.create_sqlite_connection()
+        n_moved = ds.move_mrs_data_to_shards(conn)
+        if n_moved:
+            LOGGER.info('Moved %d MRS data entries into %d shards.', n_moved, args.shards)
+        # Index the content hashes of all shards, so that duplicates are
+        # detected across shards.
+        n_indexed = ds.index_content_hashes(conn)
+        conn.close()
+        LOGGER.debug('Indexed content hashes of %d MRS data entries.', n_indexed)
+
+    # Index header fields of any MRS data that has not been indexed yet.
+    index_header_data()
+
     # Start ther server.
     httpserver.serve(APP, host='127.0.0.1', port=args.port)
 
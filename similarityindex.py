@@ -0,0 +1,126 @@
+"""Nearest-neighbor search over MRS feature vectors."""
+
+import threading
+
+import numpy as np
+
+
+class SimilarityIndex(object):
+    """Exact Euclidean nearest-neighbor index over feature vectors.
+
+    Queries are answered by a vectorized brute-force search. Squared norms of
+    the indexed vectors are precomputed, so each query costs a single
+    matrix-vector product. Vectors can be added incrementally; storage grows
+    by doubling so that adding n vectors takes amortized O(n) copies.
+    """
+
+    def __init__(self, n_features=None, dtype=np.float64, initial_capacity=1024):
+        """Creates an empty index.
+
+        Args:
+            n_features: Length of the indexed feature vectors. If None, it is
+                taken from the first vector that is added.
+            dtype: Floating-point NumPy dtype used to store vectors.
+            initial_capacity: Number of vectors to allocate space for.
+        """
+        self.n_features = n_features
+        self._lock = threading.Lock()
+        self._vectors = np.empty((initial_capacity, n_features or 0), dtype=dtype)
+        self._norms = np.empty(initial_capacity, dtype=dtype)
+        self._ids = []
+        self._labels = []
+        self._rows = {}  # row of each ID
+
+    def __len__(self):
+        return len(self._ids)
+
+    def add(self, entry_id, vector, label):
+        """Adds a feature vector to the index.
+
+        If the ID is already indexed, only its label is updated.
+
+        Args:
+            entry_id: Unique identifier for the vector (e.g. MRS data ID).
+            vector: Feature vector of length n_features.
+            label: Group label of the vector.
+
+        Raises:
+            ValueError if the vector does not have length n_features.
+        """
+        with self._lock:
+            if entry_id in self._rows:
+                self._labels[self._rows[entry_id]] = label
+                return
+            if self.n_features is None:
+                self.n_features = len(vector)
+                self._vectors = np.empty(
+                    (len(self._vectors), self.n_features), dtype=self._vectors.dtype)
+            if len(vector) != self.n_features:
+                raise ValueError('Expected %d features, got %d' % (
+                    self.n_features, len(vector)))
+            row = len(self._ids)
+            if row == len(self._vectors):
+                self._grow()
+            self._vectors[row] = vector
+            self._norms[row] = np.dot(self._vectors[row], self._vectors[row])
+            self._ids.append(entry_id)
+            self._labels.append(label)
+            self._rows[entry_id] = row
+
+    def set_label(self, entry_id, label):
+        """Changes the group label of an indexed vector.
+
+        Args:
+            entry_id: Unique identifier for the vector.
+            label: New group label.
+        """
+        with self._lock:
+            if entry_id in self._rows:
+                self._labels[self._rows[entry_id]] = label
+
+    def get_vector(self, entry_id):
+        """Returns a copy of the indexed vector with the given ID, or None."""
+        with self._lock:
+            if entry_id not in self._rows:
+                return None
+            return self._vectors[self._rows[entry_id]].copy()
+
+    def _grow(self):
+        """Doubles the storage capacity. Requires the lock."""
+        capacity = max(1, 2 * len(self._vectors))
+        vectors = np.empty((capacity, self.n_features), dtype=self._vectors.dtype)
+        vectors[:len(self._ids)] = self._vectors[:len(self._ids)]
+        norms = np.empty(capacity, dtype=self._norms.dtype)
+        norms[:len(self._ids)] = self._norms[:len(self._ids)]
+        self._vectors = vectors
+        self._norms = norms
+
+    def query(self, vector, k=20):
+        """Finds the indexed vectors closest to the given vector.
+
+        Args:
+            vector: Feature vector of length n_features.
+            k: Maximum number of neighbors to return.
+
+        Returns:
+            List of up to k (ID, distance, label) tuples, nearest first.
+        """
+        with self._lock:
+            n_vectors = len(self._ids)
+            if n_vectors == 0 or k <= 0:
+                return []
+            vector = np.asarray(vector, dtype=self._vectors.dtype)
+            if len(vector) != self.n_features:
+                raise ValueError('Expected %d features, got %d' % (
+                    self.n_features, len(vector)))
+            # Squared distances: |x|^2 - 2 x.v + |v|^2.
+            sq_dists = (self._norms[:n_vectors]
+                        - 2.0 * self._vectors[:n_vectors].dot(vector)
+                        + np.dot(vector, vector))
+            # Select the k nearest, then sort only those.
+            k = min(k, n_vectors)
+            nearest = np.argpartition(sq_dists, k - 1)[:k]
+            nearest = nearest[np.argsort(sq_dists[nearest])]
+            distances = np.sqrt(np.maximum(sq_dists[nearest], 0))
+            return [(self._ids[row], float(distance), self._labels[row])
+                    for row, distance in zip(nearest, distances)]
@@ -0,0 +1,60 @@
+"""Unit tests for the similarity index module."""
+
+import similarityindex
+import unittest
+
+import numpy as np
+
+
+class TestSimilarityIndex(unittest.TestCase):
+    """Tests the similarity index module."""
+
+    def setUp(self):
+        """Create an index of random vectors."""
+        self.random = np.random.RandomState(0)
+        self.vectors = self.random.randn(50, 4)
+        self.index = similarityindex.SimilarityIndex(initial_capacity=8)
+        for row, vector in enumerate(self.vectors):
+            self.index.add(str(row), vector, 'group%d' % (row % 2))
+
+    def test_query(self):
+        """Query returns the nearest vectors, nearest first."""
+        query = self.random.randn(4)
+        neighbors = self.index.query(query, k=5)
+        # Compare against a direct computation of all distances.
+        distances = np.sqrt(((self.vectors - query) ** 2).sum(axis=1))
+        expected_rows = np.argsort(distances)[:5]
+        self.assertEqual([str(row) for row in expected_rows],
+                         [entry_id for entry_id, _, _ in neighbors])
+        for (_, distance, label), row in zip(neighbors, expected_rows):
+            self.assertAlmostEqual(distances[row], distance)
+            self.assertEqual('group%d' % (row % 2), label)
+
+    def test_query_small_index(self):
+        """Query returns at most as many neighbors as indexed vectors."""
+        index = similarityindex.SimilarityIndex()
+        self.assertEqual([], index.query(np.zeros(4)))
+        index.add('1', np.ones(4), 'groupA')
+        self.assertEqual([('1', 2.0, 'groupA')], index.query(np.zeros(4), k=3))
+
+    def test_add_existing_id(self):
+        """Adding an indexed ID only updates its label."""
+        self.index.add('0', np.zeros(4), 'groupB')
+        self.assertEqual(len(self.vectors), len(self.index))
+        np.testing.assert_array_equal(self.vectors[0], self.index.get_vector('0'))
+        self.assertEqual('groupB', self.index.query(self.vectors[0], k=1)[0][2])
+
+    def test_add_wrong_length(self):
+        """Vectors must have the same length as indexed vectors."""
+        with self.assertRaises(ValueError):
+            self.index.add('new', np.zeros(3), 'groupA')
+
+    def test_set_label(self):
+        """Method changes the label of an indexed vector."""
+        self.index.set_label('0', 'groupC')
+        entry_id, _, label = self.index.query(self.vectors[0], k=1)[0]
+        self.assertEqual(('0', 'groupC'), (entry_id, label))
+
+
+if __name__ == '__main__':
+    unittest.main()
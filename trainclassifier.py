@@ -1,9 +1,24 @@
 """Methods for training various scikit-learn machine learning classifiers."""
 
+import hashlib
+import json
+import os
+import threading
+import time
+
+import numpy as np
 from sknn.mlp import Classifier, Layer
+from sklearn.decomposition import PCA
 from sklearn.externals import joblib
+from sklearn.model_selection import StratifiedKFold, train_test_split
 from sklearn import svm
 
+import compiledmodels
+
+
+# Directory where neural network training checkpoints are saved.
+CHECKPOINT_DIR = 'checkpoints'
+
 
 def check_samples(samples):
     """Checks the format of the given sample data.
@@ -46,6 +61,111 @@ def train_svm(samples, C=1, kernel='rbf', probability=False): #pylint:disable=in
     return clf
 
 
+def compute_rbf_kernel(inputs_a, inputs_b, gamma, block_size=1024):
+    """Computes the RBF kernel matrix between two sets of samples.
+
+    The matrix is computed in blocks of rows, which bounds the memory used for
+    intermediate results to block_size * len(inputs_b) values.
+
+    Args:
+        inputs_a: Array of shape (n_a, n_features).
+        inputs_b: Array of shape (n_b, n_features).
+        gamma: RBF kernel coefficient.
+        block_size: Number of rows of the kernel matrix to compute at once.
+
+    Returns:
+        Array of shape (n_a, n_b) containing exp(-gamma * |a - b|^2).
+    """
+    # The kernel is float64, so compute it from float64 inputs even if the
+    # features are float32.
+    inputs_a = np.asarray(inputs_a, dtype=np.float64)
+    inputs_b = np.asarray(inputs_b, dtype=np.float64)
+    norms_b = np.einsum('ij,ij->i', inputs_b, inputs_b)
+    kernel = np.empty((len(inputs_a), len(inputs_b)), dtype=np.float64)
+    for start in range(0, len(inputs_a), block_size):
+        block = inputs_a[start:start + block_size]
+        sq_dists = kernel[start:start + block_size]
+        np.dot(block, inputs_b.T, out=sq_dists)
+        sq_dists *= -2.0
+        sq_dists += np.einsum('ij,ij->i', block, block)[:, np.newaxis]
+        sq_dists += norms_b[np.newaxis, :]
+        np.maximum(sq_dists, 0, out=sq_dists)
+        sq_dists *= -gamma
+        np.exp(sq_dists, out=sq_dists)
+    return kernel
+
+
+def train_svm_precomputed(samples, gram, gamma, C=1): #pylint:disable=invalid-name
+    """Trains a RBF SVM on a precomputed kernel matrix.
+
+    Args:
+        samples: Tuple containing (sample inputs, sample outputs).
+        gram: RBF kernel matrix of the sample inputs, as computed by
+            compute_rbf_kernel with the given gamma.
+        gamma: RBF kernel coefficient used to compute the kernel matrix.
+        C: Penalty parameter C of the error term.
+
+    Returns:
+        The trained SVM as a compiledmodels.CompiledSVM, which computes
+        kernel values against its support vectors only.
+    """
+    sample_inputs, sample_outputs = check_samples(samples)
+    clf = svm.SVC(C=C, kernel='precomputed')
+    clf.fit(gram, sample_outputs)
+    return compiledmodels.CompiledSVM(
+        support_vectors=np.asarray(sample_inputs)[clf.support_],
+        dual_coef=clf._dual_coef_,  # pylint:disable=protected-access
+        intercept=clf._intercept_,  # pylint:disable=protected-access
+        n_support=clf.n_support_,
+        gamma=gamma,
+        classes=np.array(list(clf.classes_)))
+
+
+def sweep_svm(samples, C_values, gamma, gram=None, n_folds=3): #pylint:disable=invalid-name
+    """Selects the SVM penalty C by cross-validation on a precomputed kernel.
+
+    The kernel matrix is computed once and reused for every value of C and
+    every fold.
+
+    Args:
+        samples: Tuple containing (sample inputs, sample outputs).
+        C_values: Values of the penalty parameter C to try.
+        gamma: RBF kernel coefficient.
+        gram: (optional) RBF kernel matrix of the sample inputs. Computed if
+            not given.
+        n_folds: Number of cross-validation folds.
+
+    Returns:
+        Tuple containing (SVM trained on all samples with the best C,
+        list of (C, mean cross-validation accuracy) pairs).
+    """
+    sample_inputs, sample_outputs = check_samples(samples)
+    if gram is None:
+        gram = compute_rbf_kernel(sample_inputs, sample_inputs, gamma)
+    # Use as many folds as the smallest class allows.
+    n_folds = min(n_folds, np.min(np.unique(sample_outputs, return_counts=True)[1]))
+    folds = []
+    if n_folds >= 2:
+        splitter = StratifiedKFold(n_splits=n_folds, shuffle=True, random_state=0)
+        folds = list(splitter.split(np.zeros(len(sample_outputs)), sample_outputs))
+
+    scores = []
+    for C in C_values:  # pylint:disable=invalid-name
+        fold_scores = []
+        for train, test in folds:
+            clf = svm.SVC(C=C, kernel='precomputed')
+            clf.fit(gram[np.ix_(train, train)], sample_outputs[train])
+            fold_scores.append(clf.score(
+                gram[np.ix_(test, train)], sample_outputs[test]))
+        scores.append((C, np.mean(fold_scores) if fold_scores else float('nan')))
+
+    # Train on all samples with the best C (the first, if CV was not possible).
+    best_C = C_values[0]  # pylint:disable=invalid-name
+    if folds:
+        best_C = max(scores, key=lambda score: score[1])[0]  # pylint:disable=invalid-name
+    return (train_svm_precomputed(samples, gram, gamma, C=best_C), scores)
+
+
 def use_svm(clf, sample):
     """Uses given SVM to classify given data sample.
 
@@ -59,20 +179,245 @@ def use_svm(clf, sample):
     return clf.predict(sample)
 
 
-def train_neural_network(samples, nn=None, learning_rate=0.001, n_iter=25): #pylint:disable=invalid-name
+class EarlyStopping(Exception):
+    """Raised by a training callback to end neural network training."""
+
+
+class TrainingMonitor(object):
+    """Records the progress of neural network training.
+
+    The monitor is used as the sknn training callback. It records the loss
+    and duration of each epoch, keeps the weights with the lowest validation
+    loss and saves them to a checkpoint file, and stops training once the
+    validation loss has not improved for a number of epochs.
+    """
+
+    def __init__(self, patience=None, checkpoint_path=None):
+        """Creates a training monitor.
+
+        Args:
+            patience: (optional) Number of epochs without improvement of the
+                validation loss after which training is stopped.
+            checkpoint_path: (optional) File where the best weights are saved,
+                so that interrupted training can be resumed.
+        """
+        self.patience = patience
+        self.checkpoint_path = checkpoint_path
+        self.nn = None
+        self.epochs = []
+        self.resumed_epochs = 0
+        self.best_epoch = None
+        self.best_parameters = None
+        self.stopped_early = False
+        self.finished = False
+        self._lock = threading.Lock()
+        self._epoch_start = None
+
+    def resume(self):
+        """Restores the progress of an interrupted run from its checkpoint.
+
+        Returns:
+            The best weights of the interrupted run as a list of (weights,
+            biases) tuples, or None if there is no checkpoint.
+        """
+        if self.checkpoint_path is None:
+            return None
+        checkpoint = load_checkpoint(self.checkpoint_path)
+        if checkpoint is None:
+            return None
+        parameters, epochs = checkpoint
+        with self._lock:
+            self.epochs = epochs
+            self.resumed_epochs = len(epochs)
+            self.best_epoch = _best_epoch(epochs)
+            self.best_parameters = parameters
+        return parameters
+
+    def on_epoch_start(self, **_):
+        """Callback at the start of each epoch."""
+        self._epoch_start = time.time()
+
+    def on_epoch_finish(self, avg_train_error=None, avg_valid_error=None, **_):
+        """Callback at the end of each epoch.
+
+        Args:
+            avg_train_error: Training loss of the epoch.
+            avg_valid_error: Validation loss of the epoch, or None if there is
+                no validation set.
+
+        Raises:
+            EarlyStopping if the validation loss has not improved for the
+            specified number of epochs.
+        """
+        epoch = {
+            'epoch': len(self.epochs) + 1,
+            'train_loss': avg_train_error,
+            'valid_loss': avg_valid_error,
+            'seconds': time.time() - self._epoch_start}
+        with self._lock:
+            self.epochs.append(epoch)
+            if avg_valid_error is None:
+                return
+            if self.best_epoch is None or avg_valid_error < self.best_epoch['valid_loss']:
+                self.best_epoch = epoch
+                self.best_parameters = [(p.weights, p.biases) for p in self.nn.get_parameters()]
+                if self.checkpoint_path is not None:
+                    save_checkpoint(self.checkpoint_path, self.best_parameters, self.epochs)
+            elif self.patience and epoch['epoch'] - self.best_epoch['epoch'] >= self.patience:
+                self.stopped_early = True
+                raise EarlyStopping()
+
+    def finish(self):
+        """Marks training as finished and deletes the checkpoint."""
+        with self._lock:
+            self.finished = True
+        if self.checkpoint_path is not None and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+    def get_status(self):
+        """Returns a JSON-serializable summary of the training progress."""
+        with self._lock:
+            return {
+                'epochs': list(self.epochs),
+                'resumed_epochs': self.resumed_epochs,
+                'best_epoch': self.best_epoch,
+                'stopped_early': self.stopped_early,
+                'finished': self.finished}
+
+
+def _best_epoch(epochs):
+    """Returns the epoch with the lowest validation loss, or None."""
+    validated = [epoch for epoch in epochs if epoch['valid_loss'] is not None]
+    if not validated:
+        return None
+    return min(validated, key=lambda epoch: epoch['valid_loss'])
+
+
+def get_checkpoint_path(config, checkpoint_dir=CHECKPOINT_DIR):
+    """Returns the checkpoint file of a training run.
+
+    Args:
+        config: Dictionary identifying the training data and parameters.
+            Repeating a run with the same config resumes from its checkpoint.
+        checkpoint_dir: Directory where checkpoints are saved.
+
+    Returns:
+        Path of the checkpoint file.
+    """
+    key = hashlib.sha1(json.dumps(config, sort_keys=True)).hexdigest()
+    return os.path.join(checkpoint_dir, key + '.npz')
+
+
+def save_checkpoint(path, parameters, epochs):
+    """Saves neural network weights and training progress.
+
+    Args:
+        path: Path of the checkpoint file.
+        parameters: List of (weights, biases) tuples, one per layer.
+        epochs: List of per-epoch dictionaries recorded by TrainingMonitor.
+    """
+    checkpoint_dir = os.path.dirname(path)
+    if checkpoint_dir and not os.path.isdir(checkpoint_dir):
+        os.makedirs(checkpoint_dir)
+    arrays = {'epochs': np.array(json.dumps(epochs))}
+    for i, (weights, biases) in enumerate(parameters):
+        arrays['weights_%d' % i] = weights
+        arrays['biases_%d' % i] = biases
+    # Write to a temporary file first, so that an interruption never leaves
+    # a partially written checkpoint.
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as checkpoint_file:
+        np.savez(checkpoint_file, **arrays)
+    os.rename(temp_path, path)
+
+
+def load_checkpoint(path):
+    """Loads neural network weights and training progress.
+
+    Args:
+        path: Path of the checkpoint file.
+
+    Returns:
+        Tuple containing (list of (weights, biases) tuples, list of per-epoch
+        dictionaries), or None if the checkpoint does not exist.
+    """
+    if not os.path.exists(path):
+        return None
+    with np.load(path, allow_pickle=False) as arrays:
+        n_layers = len([name for name in arrays.files if name.startswith('weights_')])
+        parameters = [(arrays['weights_%d' % i], arrays['biases_%d' % i])
+                      for i in range(n_layers)]
+        epochs = json.loads(str(arrays['epochs']))
+    return (parameters, epochs)
+
+
+def split_validation(samples, validation_size):
+    """Splits a validation set off the given sample data.
+
+    The split is stratified by class if both parts can hold every class, and
+    is the same on every call so that resumed training validates on the same
+    samples. Data sets too small to leave at least two training samples and
+    one of each class are not split.
+
+    Args:
+        samples: Tuple containing (sample inputs, sample outputs).
+        validation_size: Fraction of the samples to use for validation.
+
+    Returns:
+        Tuple containing (training samples, validation samples). The
+        validation samples are None if the data set is too small to split.
+    """
+    sample_inputs, sample_outputs = samples
+    _, class_counts = np.unique(sample_outputs, return_counts=True)
+    n_classes = len(class_counts)
+    # train_test_split rounds the size of the validation set up.
+    n_valid = int(np.ceil(len(sample_outputs) * validation_size))
+    n_train = len(sample_outputs) - n_valid
+    if n_valid < 1 or n_train < max(n_classes, 2):
+        return ((sample_inputs, sample_outputs), None)
+    stratify = None
+    if class_counts.min() >= 2 and n_valid >= n_classes:
+        stratify = sample_outputs
+    train_inputs, valid_inputs, train_outputs, valid_outputs = train_test_split(
+        sample_inputs, sample_outputs, test_size=validation_size,
+        stratify=stratify, random_state=0)
+    return ((train_inputs, train_outputs), (valid_inputs, valid_outputs))
+
+
+def train_neural_network(samples, nn=None, learning_rate=0.001, n_iter=25, #pylint:disable=invalid-name
+                         validation_size=0.0, monitor=None):
     """Trains a neural network using the given sample data.
 
+    If a validation set is used, the weights with the lowest validation loss
+    are kept, and training stops early once the validation loss stops
+    improving for the monitor's patience. If the monitor has a checkpoint from
+    an interrupted run, training resumes from its best weights.
+
     Args:
         samples: Tuple containing (sample inputs, sample outputs).
         nn: Neural network that should be trained. If this is none, a new NN
             will be created.
         learning_rate: Neural network learning rate.
         n_iter: Number of training iterations to use.
+        validation_size: Fraction of the samples to hold out for validation.
+        monitor: (optional) TrainingMonitor that records training progress.
 
     Returns:
         The trained neural network.
     """
     sample_inputs, sample_outputs = check_samples(samples)
+    if monitor is None:
+        monitor = TrainingMonitor()
+
+    # Hold out a validation set if specified.
+    valid_set = None
+    if validation_size > 0:
+        (sample_inputs, sample_outputs), valid_set = split_validation(
+            samples, validation_size)
+
+    # Resume an interrupted run if possible.
+    parameters = monitor.resume()
+    n_iter = max(n_iter - monitor.resumed_epochs, 1)
 
     # Create a new classifier if necessary.
     if nn is None:
@@ -82,13 +427,132 @@ def train_neural_network(samples, nn=None, learning_rate=0.001, n_iter=25): #pyl
                 Layer("Maxout", units=n_features, pieces=2),
                 Layer("Softmax")],
             learning_rate=learning_rate,
-            n_iter=n_iter)
+            n_iter=n_iter,
+            parameters=parameters)
+    elif parameters is not None:
+        nn.set_parameters(parameters)
 
     # Train the classifier.
-    nn.fit(sample_inputs, sample_outputs)
+    monitor.nn = nn
+    nn.valid_set = valid_set
+    if monitor.patience:
+        nn.n_stable = monitor.patience
+    else:
+        # sknn stops by itself after n_stable epochs without improvement, so
+        # early stopping is only disabled if that never happens.
+        nn.n_stable = max(n_iter, nn.n_iter or 0)
+    nn.callback = {
+        'on_epoch_start': monitor.on_epoch_start,
+        'on_epoch_finish': monitor.on_epoch_finish}
+    try:
+        nn.fit(sample_inputs, sample_outputs)
+    except EarlyStopping:
+        pass
+    finally:
+        # The callbacks and validation set should not be saved with the NN.
+        nn.callback = None
+        nn.valid_set = None
+    # Keep the weights with the lowest validation loss.
+    if monitor.best_parameters is not None:
+        nn.set_parameters(monitor.best_parameters)
+    monitor.finish()
     return nn
 
 
+def fit_reduction(sample_inputs, n_components):
+    """Fits a PCA projection to the given sample inputs.
+
+    The principal components are computed with randomized SVD, which is much
+    faster than a full SVD when only a few components are kept.
+
+    Args:
+        sample_inputs: Array of shape (n_samples, n_features).
+        n_components: Number of components to keep. Limited to the number of
+            samples and features.
+
+    Returns:
+        A compiledmodels.LinearProjection.
+    """
+    n_components = min(n_components, *sample_inputs.shape)
+    pca = PCA(n_components=n_components, svd_solver='randomized', random_state=0)
+    pca.fit(sample_inputs)
+    return compiledmodels.LinearProjection(
+        pca.mean_.astype(sample_inputs.dtype),
+        pca.components_.astype(sample_inputs.dtype))
+
+
+def export_svm(clf):
+    """Exports a trained RBF SVM for NumPy-only inference.
+
+    Args:
+        clf: A trained svm.SVC with an RBF kernel.
+
+    Returns:
+        An equivalent compiledmodels.CompiledSVM.
+    """
+    if clf.kernel != 'rbf':
+        raise ValueError('Only RBF SVMs can be exported: %s' % clf.kernel)
+    # Use libsvm's internal coefficients, which sklearn flips for two classes.
+    return compiledmodels.CompiledSVM(
+        support_vectors=clf.support_vectors_,
+        dual_coef=clf._dual_coef_,  # pylint:disable=protected-access
+        intercept=clf._intercept_,  # pylint:disable=protected-access
+        n_support=clf.n_support_,
+        gamma=clf._gamma,  # pylint:disable=protected-access
+        classes=np.array(list(clf.classes_)))
+
+
+def export_neural_network(nn):
+    """Exports a trained Maxout+Softmax network for NumPy-only inference.
+
+    Args:
+        nn: A trained sknn Classifier.
+
+    Returns:
+        An equivalent compiledmodels.CompiledNeuralNetwork.
+    """
+    hidden_layers = nn.layers[:-1]
+    for layer in hidden_layers:
+        if layer.type != 'Maxout':
+            raise ValueError('Only Maxout hidden layers can be exported: %s' % layer.type)
+    if nn.layers[-1].type != 'Softmax':
+        raise ValueError('Only Softmax output layers can be exported: %s' % nn.layers[-1].type)
+    parameters = nn.get_parameters()
+    return compiledmodels.CompiledNeuralNetwork(
+        weights=[p.weights for p in parameters],
+        biases=[p.biases for p in parameters],
+        pieces=[layer.pieces for layer in hidden_layers],
+        classes=np.array(list(nn.label_binarizers[0].classes_)))
+
+
+def export_for_inference(classifier):
+    """Exports a trained classifier for NumPy-only inference.
+
+    Args:
+        classifier: A trained SVM or neural network.
+
+    Returns:
+        An equivalent classifier from the compiledmodels module.
+
+    Raises:
+        ValueError if the classifier cannot be exported.
+    """
+    if isinstance(classifier, (compiledmodels.CompiledSVM,
+                               compiledmodels.CompiledNeuralNetwork)):
+        return classifier
+    elif isinstance(classifier, compiledmodels.ReducedClassifier):
+        return compiledmodels.ReducedClassifier(
+            classifier.projection, export_for_inference(classifier.classifier))
+    elif isinstance(classifier, compiledmodels.PreprocessedClassifier):
+        return compiledmodels.PreprocessedClassifier(
+            classifier.pipeline, export_for_inference(classifier.classifier))
+    elif isinstance(classifier, svm.SVC):
+        return export_svm(classifier)
+    elif isinstance(classifier, Classifier):
+        return export_neural_network(classifier)
+    raise ValueError('Cannot export classifier: %s' % type(classifier).__name__)
+
+
 def save_classifier(classifier, name):
     """Saves given classifier in a .pkl file with specified name.
 
@@ -0,0 +1,308 @@
+"""Unit tests for the classifier training module."""
+
+import os
+import shutil
+import sys
+import tempfile
+import types
+import unittest
+
+import numpy as np
+from sklearn import svm
+from sklearn.decomposition import PCA
+from sklearn.metrics.pairwise import rbf_kernel
+
+# sknn is only needed to train neural networks. Stub it if it is not
+# installed, so that the remaining training methods can be tested.
+try:
+    import sknn.mlp  # pylint:disable=unused-import
+except ImportError:
+    SKNN_MLP = types.ModuleType('sknn.mlp')
+    SKNN_MLP.Classifier = type('Classifier', (object,), {})
+    SKNN_MLP.Layer = type('Layer', (object,), {})
+    sys.modules['sknn'] = types.ModuleType('sknn')
+    sys.modules['sknn.mlp'] = SKNN_MLP
+
+import compiledmodels  # pylint:disable=wrong-import-position
+import trainclassifier as trainer  # pylint:disable=wrong-import-position
+
+
+class FakeParameters(object):
+    """Weights and biases of one layer, as returned by sknn."""
+
+    def __init__(self, weights, biases):
+        self.weights = weights
+        self.biases = biases
+
+
+class FakeNeuralNetwork(object):
+    """Stands in for a sknn Classifier that reports given validation losses."""
+
+    def __init__(self, valid_losses, n_iter=None):
+        self.valid_losses = valid_losses
+        self.n_iter = n_iter or len(valid_losses)
+        self.n_stable = 10
+        self.valid_set = None
+        self.callback = None
+        self.parameters = [(np.zeros((2, 2)), np.zeros(2))]
+        self.fitted = None
+
+    def get_parameters(self):
+        """Returns the current weights."""
+        return [FakeParameters(weights, biases) for weights, biases in self.parameters]
+
+    def set_parameters(self, parameters):
+        """Replaces the current weights."""
+        self.parameters = list(parameters)
+
+    def fit(self, sample_inputs, sample_outputs):
+        """Runs one epoch per validation loss, changing the weights each time."""
+        self.fitted = (sample_inputs, sample_outputs, self.valid_set, self.n_stable)
+        for epoch, valid_loss in enumerate(self.valid_losses):
+            self.callback['on_epoch_start']()
+            self.parameters = [(np.full((2, 2), epoch), np.full(2, epoch))]
+            self.callback['on_epoch_finish'](
+                avg_train_error=1.0,
+                avg_valid_error=None if self.valid_set is None else valid_loss)
+
+
+class FakeLayer(object):
+    """Stands in for a sknn Layer."""
+
+    def __init__(self, layer_type, pieces=None):
+        self.type = layer_type
+        self.pieces = pieces
+
+
+class FakeLabelBinarizer(object):
+    """Stands in for the label binarizer of a trained sknn Classifier."""
+
+    def __init__(self, classes):
+        self.classes_ = np.array(classes)
+
+
+class TestTrainClassifier(unittest.TestCase):
+    """Tests the classifier training module."""
+
+    def setUp(self):
+        """Create random sample data."""
+        self.random = np.random.RandomState(0)
+        self.sample_inputs = self.random.randn(30, 4)
+
+    def test_compute_rbf_kernel(self):
+        """Blocked kernel matches sklearn's RBF kernel."""
+        other_inputs = self.random.randn(7, 4)
+        np.testing.assert_allclose(
+            rbf_kernel(self.sample_inputs, other_inputs, gamma=0.3),
+            trainer.compute_rbf_kernel(
+                self.sample_inputs, other_inputs, 0.3, block_size=8))
+
+    def test_compute_rbf_kernel_float32(self):
+        """Kernel of float32 inputs is computed in float64."""
+        inputs = self.sample_inputs.astype(np.float32)
+        kernel = trainer.compute_rbf_kernel(inputs, inputs, 0.3, block_size=8)
+        self.assertEqual(np.float64, kernel.dtype)
+        np.testing.assert_allclose(
+            rbf_kernel(self.sample_inputs, gamma=0.3), kernel, rtol=1e-5)
+
+    def test_train_svm_precomputed(self):
+        """SVM trained on a precomputed kernel matches a RBF SVM."""
+        sample_outputs = np.where(self.sample_inputs[:, 0] > 0, 'groupA', 'groupB')
+        gram = trainer.compute_rbf_kernel(self.sample_inputs, self.sample_inputs, 0.3)
+        model = trainer.train_svm_precomputed(
+            (self.sample_inputs, sample_outputs), gram, 0.3, C=2.0)
+        self.assertIsInstance(model, compiledmodels.CompiledSVM)
+        clf = svm.SVC(C=2.0, gamma=0.3).fit(self.sample_inputs, sample_outputs)
+        test_inputs = self.random.randn(20, 4)
+        np.testing.assert_array_equal(clf.predict(test_inputs), model.predict(test_inputs))
+
+    def test_train_svm_precomputed_float32(self):
+        """Compiled SVM of float32 features matches the precomputed-kernel SVM."""
+        # MRS features are large, so float32 distances would cancel badly.
+        inputs = (6e5 + 50 * self.random.randn(80, 20)).astype(np.float32)
+        sample_outputs = np.where(inputs[:, 0] > 6e5, 'groupA', 'groupB')
+        gamma = 1e-5
+        gram = trainer.compute_rbf_kernel(inputs, inputs, gamma)
+        model = trainer.train_svm_precomputed((inputs, sample_outputs), gram, gamma)
+        clf = svm.SVC(kernel='precomputed').fit(gram, sample_outputs)
+        test_inputs = (6e5 + 50 * self.random.randn(200, 20)).astype(np.float32)
+        np.testing.assert_array_equal(
+            clf.predict(trainer.compute_rbf_kernel(test_inputs, inputs, gamma)),
+            model.predict(test_inputs))
+
+    def test_sweep_svm(self):
+        """Sweep scores every C and trains on all samples with the best."""
+        sample_outputs = np.where(self.sample_inputs[:, 0] > 0, 'groupA', 'groupB')
+        model, scores = trainer.sweep_svm(
+            (self.sample_inputs, sample_outputs), [0.01, 1.0, 100.0], 0.3)
+        self.assertEqual([0.01, 1.0, 100.0], [C for C, _ in scores])
+        best_C = max(scores, key=lambda score: score[1])[0]  # pylint:disable=invalid-name
+        expected = trainer.train_svm_precomputed(
+            (self.sample_inputs, sample_outputs),
+            trainer.compute_rbf_kernel(self.sample_inputs, self.sample_inputs, 0.3),
+            0.3, C=best_C)
+        np.testing.assert_array_equal(
+            expected.predict(self.sample_inputs), model.predict(self.sample_inputs))
+
+    def test_sweep_svm_without_folds(self):
+        """Sweep uses the first C if a class is too small to cross-validate."""
+        sample_outputs = np.array(['groupA'] * 29 + ['groupB'])
+        model, scores = trainer.sweep_svm(
+            (self.sample_inputs, sample_outputs), [0.5, 2.0], 0.3)
+        self.assertEqual([0.5, 2.0], [C for C, _ in scores])
+        self.assertTrue(all(np.isnan(score) for _, score in scores))
+        self.assertIsInstance(model, compiledmodels.CompiledSVM)
+
+    def test_fit_reduction(self):
+        """Reduction matches a full PCA and keeps the input dtype."""
+        inputs = self.sample_inputs.astype(np.float32)
+        projection = trainer.fit_reduction(inputs, 2)
+        self.assertEqual(np.float32, projection.components.dtype)
+        pca = PCA(n_components=2, svd_solver='full').fit(self.sample_inputs)
+        # Components are only determined up to their sign.
+        signs = np.sign(np.sum(projection.components * pca.components_, axis=1))
+        np.testing.assert_allclose(
+            pca.transform(self.sample_inputs) * signs,
+            projection.transform(inputs), rtol=1e-3, atol=1e-4)
+        # The number of components is limited by the number of features.
+        self.assertEqual(4, len(trainer.fit_reduction(inputs, 10).components))
+
+    def test_training_monitor(self):
+        """Monitor keeps the best weights and stops after its patience."""
+        samples = (self.sample_inputs, np.array(['a', 'b'] * 15))
+        monitor = trainer.TrainingMonitor(patience=2)
+        nn = trainer.train_neural_network(
+            samples, nn=FakeNeuralNetwork([3.0, 2.0, 2.5, 2.6, 2.7, 1.0]),
+            validation_size=0.2, monitor=monitor)
+        status = monitor.get_status()
+        self.assertEqual([1, 2, 3, 4], [epoch['epoch'] for epoch in status['epochs']])
+        self.assertEqual(2, status['best_epoch']['epoch'])
+        self.assertTrue(status['stopped_early'])
+        self.assertTrue(status['finished'])
+        # The weights of the best epoch are restored.
+        np.testing.assert_array_equal(np.full(2, 1), nn.parameters[0][1])
+
+    def test_training_monitor_without_validation(self):
+        """Without a validation set, every epoch is kept and none is best."""
+        samples = (self.sample_inputs, np.array(['a', 'b'] * 15))
+        monitor = trainer.TrainingMonitor(patience=2)
+        trainer.train_neural_network(
+            samples, nn=FakeNeuralNetwork([3.0, 4.0, 5.0, 6.0]), monitor=monitor)
+        status = monitor.get_status()
+        self.assertEqual(4, len(status['epochs']))
+        self.assertIsNone(status['best_epoch'])
+        self.assertFalse(status['stopped_early'])
+
+    def test_save_load_checkpoint(self):
+        """Checkpoints restore weights and epochs, and resume training."""
+        checkpoint_dir = tempfile.mkdtemp()
+        try:
+            path = trainer.get_checkpoint_path({'n_iter': 5}, checkpoint_dir)
+            self.assertEqual(path, trainer.get_checkpoint_path({'n_iter': 5}, checkpoint_dir))
+            self.assertNotEqual(path, trainer.get_checkpoint_path({'n_iter': 6}, checkpoint_dir))
+            self.assertIsNone(trainer.load_checkpoint(path))
+
+            parameters = [(np.ones((4, 2)), np.zeros(2)), (np.eye(2), np.ones(2))]
+            epochs = [{'epoch': 1, 'train_loss': 1.0, 'valid_loss': 0.5, 'seconds': 0.1},
+                      {'epoch': 2, 'train_loss': 0.8, 'valid_loss': 0.7, 'seconds': 0.1}]
+            trainer.save_checkpoint(path, parameters, epochs)
+            loaded_parameters, loaded_epochs = trainer.load_checkpoint(path)
+            self.assertEqual(epochs, loaded_epochs)
+            for (weights, biases), (loaded_weights, loaded_biases) in zip(
+                    parameters, loaded_parameters):
+                np.testing.assert_array_equal(weights, loaded_weights)
+                np.testing.assert_array_equal(biases, loaded_biases)
+
+            # Resumed monitors continue from the checkpoint's best epoch.
+            monitor = trainer.TrainingMonitor(checkpoint_path=path)
+            nn = FakeNeuralNetwork([])
+            trainer.train_neural_network(
+                (self.sample_inputs, np.array(['a', 'b'] * 15)), nn=nn, monitor=monitor)
+            self.assertEqual(2, monitor.resumed_epochs)
+            self.assertEqual(1, monitor.get_status()['best_epoch']['epoch'])
+            np.testing.assert_array_equal(np.eye(2), nn.parameters[1][0])
+            # Finished training deletes its checkpoint.
+            self.assertFalse(os.path.exists(path))
+        finally:
+            shutil.rmtree(checkpoint_dir)
+
+    def test_export_svm(self):
+        """Exported SVMs match sklearn predictions for two and three classes."""
+        test_inputs = self.random.randn(40, 4)
+        for sample_outputs in [
+                np.where(self.sample_inputs[:, 0] > 0, 'groupA', 'groupB'),
+                np.digitize(self.sample_inputs[:, 0], [-0.5, 0.5])]:
+            clf = svm.SVC(gamma=0.2).fit(self.sample_inputs, sample_outputs)
+            model = trainer.export_svm(clf)
+            self.assertIsInstance(model, compiledmodels.CompiledSVM)
+            np.testing.assert_array_equal(clf.predict(test_inputs), model.predict(test_inputs))
+            self.assertIs(model, trainer.export_for_inference(model))
+
+        clf = svm.SVC(kernel='linear').fit(self.sample_inputs, sample_outputs)
+        self.assertRaises(ValueError, trainer.export_svm, clf)
+
+    def test_export_neural_network(self):
+        """Exported networks take the weights and classes of the sknn network."""
+        nn = FakeNeuralNetwork([])
+        nn.layers = [FakeLayer('Maxout', pieces=2), FakeLayer('Softmax')]
+        nn.label_binarizers = [FakeLabelBinarizer(['groupA', 'groupB'])]
+        nn.parameters = [(self.random.randn(4, 8), self.random.randn(8)),
+                         (self.random.randn(4, 2), self.random.randn(2))]
+        model = trainer.export_neural_network(nn)
+        self.assertIsInstance(model, compiledmodels.CompiledNeuralNetwork)
+        self.assertEqual([2], model.pieces)
+        np.testing.assert_array_equal(['groupA', 'groupB'], model.classes)
+
+        hidden = self.sample_inputs.dot(nn.parameters[0][0]) + nn.parameters[0][1]
+        hidden = hidden.reshape(30, 4, 2).max(axis=2)
+        logits = hidden.dot(nn.parameters[1][0]) + nn.parameters[1][1]
+        probabilities = np.exp(logits) / np.exp(logits).sum(axis=1)[:, np.newaxis]
+        np.testing.assert_allclose(probabilities, model.predict_proba(self.sample_inputs))
+
+        nn.layers[0] = FakeLayer('Rectifier')
+        self.assertRaises(ValueError, trainer.export_neural_network, nn)
+
+    def test_split_validation(self):
+        """Validation sets are stratified when every class fits in them."""
+        sample_outputs = np.array(['a', 'b'] * 15)
+        (train_inputs, train_outputs), (valid_inputs, valid_outputs) = \
+            trainer.split_validation((self.sample_inputs, sample_outputs), 0.2)
+        self.assertEqual((24, 4), train_inputs.shape)
+        self.assertEqual((6, 4), valid_inputs.shape)
+        self.assertEqual(3, np.sum(valid_outputs == 'a'))
+        self.assertEqual(12, np.sum(train_outputs == 'a'))
+        # The split is the same on every call.
+        np.testing.assert_array_equal(valid_inputs, trainer.split_validation(
+            (self.sample_inputs, sample_outputs), 0.2)[1][0])
+
+    def test_split_validation_small(self):
+        """Small data sets are split unstratified or not at all."""
+        for n_samples in [4, 5]:
+            samples = (self.sample_inputs[:n_samples], np.array(['a', 'b'] * 3)[:n_samples])
+            (train_inputs, _), (valid_inputs, _) = trainer.split_validation(samples, 0.2)
+            self.assertEqual(n_samples - 1, len(train_inputs))
+            self.assertEqual(1, len(valid_inputs))
+
+        samples = (self.sample_inputs[:2], np.array(['a', 'b']))
+        train_samples, valid_samples = trainer.split_validation(samples, 0.5)
+        self.assertIs(samples[0], train_samples[0])
+        self.assertIsNone(valid_samples)
+
+    def test_train_neural_network_without_patience(self):
+        """Disabling early stopping also disables sknn's own early stopping."""
+        samples = (self.sample_inputs, np.array(['a', 'b'] * 15))
+        nn = trainer.train_neural_network(
+            samples, nn=FakeNeuralNetwork([1.0] * 25), n_iter=25, validation_size=0.2)
+        self.assertEqual(25, nn.fitted[3])
+        self.assertEqual(24, len(nn.fitted[0]))
+        self.assertIsNone(nn.valid_set)
+        self.assertIsNone(nn.callback)
+
+        nn = trainer.train_neural_network(
+            samples, nn=FakeNeuralNetwork([1.0] * 25), n_iter=25,
+            monitor=trainer.TrainingMonitor(patience=3))
+        self.assertEqual(3, nn.fitted[3])
+
+
+if __name__ == '__main__':
+    unittest.main()